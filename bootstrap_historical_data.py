@@ -10,6 +10,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 from src.scrapers.api_odds_fetcher import OddsAPIFetcher
 from src.scrapers.historical_odds_scraper import FootballDataUK
 from src.utils.database import BettingDatabase
+from src.data.feature_engineering import AdvancedFeatureEngine
 from src.utils.notifications import TelegramNotifier
 from datetime import datetime, timedelta
 from loguru import logger
@@ -241,6 +242,12 @@ class HistoricalDataBootstrap:
 
         logger.info(f"Saved {saved_results} match results")
 
+        # 4. Materializar ELO (rebuild completo: el bootstrap inserta partidos antiguos)
+        try:
+            AdvancedFeatureEngine(self.db).materialize_elo_history("soccer", rebuild=True)
+        except Exception as e:
+            logger.warning(f"Could not materialize ELO history: {e}")
+
         # 5. Build features y training dataset
         logger.info("\nBuilding features and training dataset...")
 
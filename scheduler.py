@@ -19,6 +19,7 @@ from src.utils.clv_tracker import CLVTracker
 from src.models.predictor import MatchPredictor
 from src.betting.pick_selector import PickSelector
 from src.betting.parlay_builder import ParlayBuilder
+from src.data.feature_engineering import AdvancedFeatureEngine
 import subprocess
 
 
@@ -104,6 +105,13 @@ class BettingScheduler:
                     logger.debug(f"Could not save result for {score.get('match_id')}: {e}")
             
             logger.info(f"✅ Results updated: {saved} matches")
+
+            # Actualizar snapshots materializados de ELO con los nuevos resultados
+            if saved > 0:
+                try:
+                    AdvancedFeatureEngine(self.db).materialize_elo_history("soccer")
+                except Exception as e:
+                    logger.warning(f"Could not materialize ELO history: {e}")
             
             if saved > 0:
                 self.notifier.send_message(
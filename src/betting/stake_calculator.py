@@ -49,9 +49,9 @@ class StakeCalculator:
             stake = bankroll * 0.005
         stake = max(stake, 1.0)
         stake = round(stake, 2)
-        logger.info(
-            f"🎯 Kelly Stake calc: prob={probability:.1%} odds={odds:.2f} edge={edge:.1%} "
-            f"full={full_kelly:.1%} frac={fractional_kelly:.1%} stake=${stake:.2f} ({stake/bankroll*100:.2f}%)"
+        logger.debug(
+            "🎯 Kelly Stake calc: prob={:.1%} odds={:.2f} edge={:.1%} full={:.1%} frac={:.1%} stake=${:.2f} ({:.2f}%)",
+            probability, odds, edge, full_kelly, fractional_kelly, stake, stake / bankroll * 100
         )
         return stake
 
@@ -4,6 +4,7 @@ Stake Calculator - Calcula el tamaño óptimo de apuesta usando Kelly Criterion
 
 from typing import Dict
 from loguru import logger
+import numpy as np
 import yaml
 try:
     from src.utils.database import BettingDatabase
@@ -11,6 +12,14 @@ except Exception:
     BettingDatabase = None
 
 
+def _kelly_scalar_fast(p: float, odds: float) -> float:
+    """
+    Kelly sin validaciones: f = (odds*p - 1) / (odds - 1), recortado a 0
+    Requiere 0 < p < 1 y odds > 1 (validado por el llamador)
+    """
+    return max(0.0, (odds * p - 1.0) / (odds - 1.0))
+
+
 class StakeCalculator:
     """Calculador de tamaño de apuesta óptimo con Kelly Criterion mejorado"""
 
@@ -64,18 +73,32 @@ class StakeCalculator:
             logger.warning(f"Invalid odds: {odds}")
             return 0
 
-        b = odds - 1  # Net odds
-        p = probability
-        q = 1 - p
+        # (b*p - q) / b con b = odds - 1, q = 1 - p; Kelly negativo => 0 (no apostar)
+        return _kelly_scalar_fast(probability, odds)
 
-        kelly_fraction = (b * p - q) / b
+    def kelly_criterion_batch(self, probabilities, odds) -> np.ndarray:
+        """
+        Versión vectorizada de kelly_criterion para scoring en lote
 
-        # No apostar si Kelly es negativo (no hay ventaja)
-        if kelly_fraction <= 0:
-            logger.debug(f"Negative Kelly ({kelly_fraction:.4f}) - No bet recommended")
-            return 0
+        Las validaciones se aplican una sola vez sobre todo el array:
+        entradas con probabilidad fuera de (0, 1) u odds <= 1 devuelven 0.
+
+        Args:
+            probabilities: Array-like de probabilidades de ganar
+            odds: Array-like de cuotas decimales (mismo tamaño)
+
+        Returns:
+            Array con la fracción Kelly completa por pick
+        """
+        p = np.asarray(probabilities, dtype=float)
+        o = np.asarray(odds, dtype=float)
+
+        valid = (p > 0) & (p < 1) & (o > 1)
+        # Evitar división por cero en entradas inválidas (se anulan con el mask)
+        b = np.where(valid, o - 1.0, 1.0)
+        kelly = (o * p - 1.0) / b
 
-        return kelly_fraction
+        return np.where(valid, np.maximum(kelly, 0.0), 0.0)
 
     def calculate_kelly_stake(self, probability: float, odds: float, bankroll: float) -> float:
         """
@@ -100,7 +123,7 @@ class StakeCalculator:
         
         # Si edge < 2%, no apostar (demasiado pequeño para ser confiable)
         if edge < 0.02:
-            logger.debug(f"Edge too small ({edge:.2%}) - No bet recommended")
+            logger.debug("Edge too small ({:.2%}) - No bet recommended", edge)
             return 0
 
         # Kelly completo
@@ -133,11 +156,11 @@ class StakeCalculator:
         # Redondear a 2 decimales
         stake = round(stake, 2)
 
-        logger.info(
-            f"🎯 Kelly Stake: prob={probability:.1%}, odds={odds:.2f}, "
-            f"edge={edge:.1%}, full_kelly={full_kelly:.1%}, "
-            f"frac_kelly={fractional_kelly:.1%}, stake=${stake:.2f} "
-            f"({stake/bankroll*100:.1f}% of bankroll)"
+        # DEBUG con args: loguru sólo formatea si hay un handler a ese nivel
+        logger.debug(
+            "🎯 Kelly Stake: prob={:.1%}, odds={:.2f}, edge={:.1%}, full_kelly={:.1%}, "
+            "frac_kelly={:.1%}, stake=${:.2f} ({:.1f}% of bankroll)",
+            probability, odds, edge, full_kelly, fractional_kelly, stake, stake / bankroll * 100
         )
 
         return stake
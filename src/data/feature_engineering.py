@@ -5,9 +5,83 @@ CRÍTICO: TIME-AWARE - Sin data leakage - solo usa datos del pasado
 
 import pandas as pd
 import numpy as np
+import calendar
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 from loguru import logger
+from joblib import Parallel, delayed
+
+
+# Orden canónico de las features de build_advanced_features
+ADVANCED_FEATURE_COLUMNS = (
+    'home_elo', 'away_elo', 'elo_diff',
+    'home_form_5', 'away_form_5', 'form_diff',
+    'h2h_matches', 'h2h_home_win_rate', 'h2h_avg_goals_home', 'h2h_avg_goals_away',
+    'home_goals_scored_avg', 'home_goals_conceded_avg',
+    'away_goals_scored_avg', 'away_goals_conceded_avg',
+    'home_goal_diff', 'away_goal_diff',
+    'league_strength',
+    'home_win_odds', 'away_win_odds', 'implied_home', 'implied_away', 'market_margin'
+)
+
+# Prefijo de ADVANCED_FEATURE_COLUMNS que sale del histórico (el resto es mercado)
+HISTORY_FEATURE_COLUMNS = ADVANCED_FEATURE_COLUMNS[:17]
+
+# h2h_matches es un conteo; el resto de features de histórico son float
+HISTORY_FEATURE_DTYPES = {
+    name: np.int64 if name == 'h2h_matches' else np.float64
+    for name in HISTORY_FEATURE_COLUMNS
+}
+
+# Filas por fetchmany al recorrer raw_match_results completo
+FETCH_BATCH_SIZE = 4096
+
+# Segundos mínimos entre logs de progreso en los loops de batch
+PROGRESS_LOG_INTERVAL = 5.0
+
+# Claves (equipo, match_ts) por query de _lookup_elos (3 parámetros SQL cada una)
+ELO_LOOKUP_BATCH_SIZE = 500
+
+# Features extra que sólo existen en soccer (mercado de empate)
+SOCCER_EXTRA_COLUMNS = ('draw_odds', 'implied_draw')
+
+
+# Engines por proceso worker de build_features_batch(use_processes=True):
+# (db, deporte, parámetros ELO) -> (versión de resultados, engine)
+_process_engines = {}
+
+
+def _compute_match_features(
+    match: Dict,
+    db_class,
+    db_path: str,
+    sport: str,
+    columns: tuple,
+    initial_elo: int,
+    k_factor: int,
+    results_version: int
+) -> np.ndarray:
+    """
+    Vector de features de un partido dentro de un proceso worker
+    Cada proceso abre su propia conexión y reutiliza su engine (y caches)
+    entre partidos y llamadas mientras no cambie la versión de resultados;
+    si cambió, arranca un engine con caches vacías sobre la misma conexión.
+    """
+    key = (db_class, db_path, sport, initial_elo, k_factor)
+    entry = _process_engines.get(key)
+    if entry is None:
+        engine = AdvancedFeatureEngine(db_class(db_path), initial_elo, k_factor)
+        _process_engines[key] = (results_version, engine)
+    elif entry[0] != results_version:
+        engine = AdvancedFeatureEngine(entry[1].db, initial_elo, k_factor)
+        _process_engines[key] = (results_version, engine)
+    else:
+        engine = entry[1]
+    return engine.build_advanced_features_array(match, sport=sport, columns=columns)
 
 
 class AdvancedFeatureEngine:
@@ -33,6 +107,65 @@ class AdvancedFeatureEngine:
         # Cache de ELOs por equipo (se actualiza dinámicamente)
         self.elo_cache = {}
 
+        # Caches de H2H y goles (key con el timestamp exacto de before_date)
+        self._h2h_cache = {}
+        self._goals_cache = {}
+
+        # Deportes con tabla team_elo_history materializada (lookup O(1) de ELO)
+        self._elo_history_ready = {}
+
+        # Pesos de decay precalculados para los tamaños de ventana habituales
+        self._form_weights = {n: self._compute_form_weights(n) for n in (3, 5, 10)}
+
+    @staticmethod
+    def _compute_form_weights(n: int) -> np.ndarray:
+        """
+        Pesos normalizados de decay exponencial para n partidos
+        Progresión geométrica exp(-(n-1-i)/(n-1)), equivalente a exp(linspace(-1, 0, n))
+        """
+        if n <= 1:
+            return np.ones(max(n, 0))
+        weights = np.power(np.e, -np.arange(n - 1, -1, -1) / (n - 1))
+        return weights / weights.sum()
+
+    def _get_form_weights(self, n: int) -> np.ndarray:
+        """Devuelve pesos cacheados (calcula y guarda si n no está en cache)"""
+        weights = self._form_weights.get(n)
+        if weights is None:
+            weights = self._compute_form_weights(n)
+            self._form_weights[n] = weights
+        return weights
+
+    @staticmethod
+    def _to_timestamp(value) -> int:
+        """
+        Epoch en segundos comparable con raw_match_results.match_ts
+        Acepta datetime (naive = UTC, igual que SQLite) o un epoch ya calculado
+        """
+        if isinstance(value, datetime):
+            return calendar.timegm(value.utctimetuple())
+        return int(value)
+
+    def _tuple_cursor(self):
+        """
+        Cursor que devuelve tuplas planas (sin sqlite3.Row)
+        Las queries de histórico seleccionan siempre, en este orden:
+        home_team, away_team, result_label, home_score, away_score
+        """
+        cursor = self.db.conn.cursor()
+        cursor.row_factory = None
+        return cursor
+
+    @staticmethod
+    def _iter_rows(cursor, batch_size: int = FETCH_BATCH_SIZE):
+        """Itera el resultado de cursor en bloques de fetchmany (sin fetchall)"""
+        cursor.arraysize = batch_size
+        while True:
+            batch = cursor.fetchmany()
+            if not batch:
+                return
+            yield from batch
+
     def calculate_elo_rating(
         self,
         team: str,
@@ -53,26 +186,35 @@ class AdvancedFeatureEngine:
         Returns:
             ELO rating del equipo
         """
-        # Cache key
-        cache_key = f"{team}_{sport}_{before_date.date()}"
+        # Cache key (el ELO de liga no puede pisar el general)
+        before_ts = self._to_timestamp(before_date)
+        cache_key = f"{team}_{sport}_{league}_{before_ts}" if league else f"{team}_{sport}_{before_ts}"
         if cache_key in self.elo_cache:
             return self.elo_cache[cache_key]
 
-        # Obtener histórico del equipo
         self.db.connect()
-        cursor = self.db.conn.cursor()
+        cursor = self._tuple_cursor()
+
+        # ELO general (sin liga): leer snapshot materializado si está al día
+        if not league:
+            elos = self._lookup_elos(sport, [(team, before_ts)])
+            if elos is not None:
+                self.elo_cache[cache_key] = elos[0]
+                return elos[0]
 
+        # Obtener histórico del equipo
         query = """
         SELECT
-            r.home_team, r.away_team, r.result_label, r.match_date
+            r.home_team, r.away_team, r.result_label,
+            r.home_score, r.away_score
         FROM raw_match_results r
         WHERE r.sport = ?
         AND (r.home_team = ? OR r.away_team = ?)
-        AND datetime(r.match_date) < datetime(?)
-        ORDER BY r.match_date ASC
+        AND r.match_ts < ?
+        ORDER BY r.match_ts ASC
         """
 
-        params = [sport, team, team, before_date.isoformat()]
+        params = [sport, team, team, before_ts]
 
         if league:
             query = query.replace("WHERE r.sport", "WHERE r.league = ? AND r.sport")
@@ -81,46 +223,250 @@ class AdvancedFeatureEngine:
         cursor.execute(query, params)
         matches = cursor.fetchall()
 
+        elo = self._elo_from_matches(team, matches)
+
+        # Guardar en cache
+        self.elo_cache[cache_key] = elo
+
+        return elo
+
+    def _elo_from_matches(self, team: str, matches: List) -> float:
+        """ELO de un equipo a partir de su histórico (orden cronológico ASC)"""
         # Inicializar ELO
         elo = self.initial_elo
 
         # Actualizar ELO partido por partido
-        for match in matches:
-            is_home = match['home_team'] == team
-            opponent = match['away_team'] if is_home else match['home_team']
-            result = match['result_label']
+        for home, away, result, _, _ in matches:
+            elo = self._update_elo(elo, home == team, result)
 
-            # Determinar score del equipo (1.0 = win, 0.5 = draw, 0.0 = loss)
-            if is_home:
-                if result == 'home_win':
-                    score = 1.0
-                elif result == 'draw':
-                    score = 0.5
-                else:
-                    score = 0.0
-            else:
-                if result == 'away_win':
-                    score = 1.0
-                elif result == 'draw':
-                    score = 0.5
-                else:
-                    score = 0.0
+        return elo
 
-            # ELO del oponente (simplificación: usar ELO inicial)
-            # En implementación completa: calcular ELO del oponente recursivamente
-            opponent_elo = self.initial_elo
+    def _update_elo(self, elo: float, is_home: bool, result: str) -> float:
+        """Aplica un partido al ELO de un equipo"""
+        # Determinar score del equipo (1.0 = win, 0.5 = draw, 0.0 = loss)
+        if is_home:
+            if result == 'home_win':
+                score = 1.0
+            elif result == 'draw':
+                score = 0.5
+            else:
+                score = 0.0
+        else:
+            if result == 'away_win':
+                score = 1.0
+            elif result == 'draw':
+                score = 0.5
+            else:
+                score = 0.0
 
-            # Expected score según ELO
-            expected = 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+        # ELO del oponente (simplificación: usar ELO inicial)
+        # En implementación completa: calcular ELO del oponente recursivamente
+        opponent_elo = self.initial_elo
 
-            # Actualizar ELO
-            elo = elo + self.k_factor * (score - expected)
+        # Expected score según ELO
+        expected = 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
 
-        # Guardar en cache
-        self.elo_cache[cache_key] = elo
+        # Actualizar ELO
+        elo = elo + self.k_factor * (score - expected)
 
         return elo
 
+    def _has_elo_history(self, sport: str) -> bool:
+        """
+        True si team_elo_history está materializada y al día para el deporte
+        (con los mismos initial_elo/k_factor que este engine). Con resultados
+        posteriores a la última materialización (aunque su match_ts sea
+        anterior al último snapshot) se usa el histórico crudo.
+        """
+        if sport not in self._elo_history_ready:
+            cursor = self._tuple_cursor()
+            cursor.execute(
+                "SELECT last_result_id FROM team_elo_history_state "
+                "WHERE sport = ? AND initial_elo = ? AND k_factor = ?",
+                (sport, self.initial_elo, self.k_factor)
+            )
+            row = cursor.fetchone()
+            ready = False
+            if row is not None:
+                cursor.execute("""
+                SELECT 1 FROM raw_match_results
+                WHERE id > ? AND sport = ? AND match_ts IS NOT NULL
+                LIMIT 1
+                """, (row[0], sport))
+                ready = cursor.fetchone() is None
+                if not ready:
+                    logger.debug(f"ELO history for {sport} is stale - using raw results")
+            self._elo_history_ready[sport] = ready
+        return self._elo_history_ready[sport]
+
+    def materialize_elo_history(self, sport: str, rebuild: bool = False) -> int:
+        """
+        Materializa en team_elo_history el ELO de cada equipo tras cada partido
+        Un solo pase cronológico sobre raw_match_results; incremental por defecto
+        (sólo procesa resultados con id posterior a la última materialización)
+
+        Un resultado que llega tarde (match_ts <= último snapshot: kick-off
+        simultáneo con marcador posterior, backfill) invalida los snapshots
+        desde su match_ts, que se recalculan a partir de ahí.
+
+        Ejecutar tras insertar nuevos resultados para que calculate_elo_rating
+        pueda resolver el ELO con un lookup en lugar de recorrer el histórico.
+
+        Args:
+            sport: Deporte
+            rebuild: Si True, borra y recalcula todos los snapshots del deporte
+
+        Returns:
+            Número de snapshots escritos
+        """
+        self.db.connect()
+        cursor = self._tuple_cursor()
+
+        # Watermark: sólo se procesan resultados con id <= max_id (los que se
+        # inserten durante el pase quedan para la próxima materialización)
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM raw_match_results")
+        max_id = cursor.fetchone()[0]
+
+        last_id = None
+        if not rebuild:
+            # Sin estado (tabla previa al watermark) no se sabe qué se procesó;
+            # con otros parámetros de ELO los snapshots no sirven
+            cursor.execute(
+                "SELECT last_result_id FROM team_elo_history_state "
+                "WHERE sport = ? AND initial_elo = ? AND k_factor = ?",
+                (sport, self.initial_elo, self.k_factor)
+            )
+            row = cursor.fetchone()
+            last_id = row[0] if row is not None else None
+
+        elos = {}
+        start_ts = None
+
+        if last_id is None:
+            cursor.execute("DELETE FROM team_elo_history WHERE sport = ?", (sport,))
+        else:
+            # Primer match_ts afectado por los resultados nuevos
+            cursor.execute("""
+            SELECT MIN(match_ts) FROM raw_match_results
+            WHERE id > ? AND id <= ? AND sport = ? AND match_ts IS NOT NULL
+            """, (last_id, max_id, sport))
+            start_ts = cursor.fetchone()[0]
+            if start_ts is None:
+                self._save_elo_history_state(sport, max_id)
+                self.db.conn.commit()
+                self._elo_history_ready.pop(sport, None)
+                logger.info(f"ELO history for {sport} already up to date")
+                return 0
+
+            # Sólo borra algo si hay resultados tardíos
+            cursor.execute(
+                "DELETE FROM team_elo_history WHERE sport = ? AND match_ts >= ?", (sport, start_ts)
+            )
+            # ELO vigente de cada equipo = su último snapshot previo a start_ts
+            cursor.execute("""
+            SELECT h.team, h.elo FROM team_elo_history h
+            WHERE h.sport = ?
+            AND h.match_ts = (
+                SELECT MAX(match_ts) FROM team_elo_history
+                WHERE team = h.team AND sport = h.sport
+            )
+            """, (sport,))
+            elos = dict(cursor.fetchall())
+
+        query = """
+        SELECT r.home_team, r.away_team, r.result_label, r.match_ts
+        FROM raw_match_results r
+        WHERE r.sport = ?
+        AND r.match_ts IS NOT NULL
+        AND r.id <= ?
+        """
+        params = [sport, max_id]
+        if start_ts is not None:
+            query += " AND r.match_ts >= ?"
+            params.append(start_ts)
+        query += " ORDER BY r.match_ts ASC, r.id ASC"
+
+        cursor.execute(query, params)
+
+        insert_query = """
+        INSERT OR REPLACE INTO team_elo_history (team, sport, match_ts, elo)
+        VALUES (?, ?, ?, ?)
+        """
+        write_cursor = self.db.conn.cursor()
+
+        # Lectura en streaming; los snapshots se escriben por bloques
+        n_snapshots = 0
+        snapshots = []
+        for home, away, result, match_ts in self._iter_rows(cursor):
+            home_elo = self._update_elo(elos.get(home, self.initial_elo), True, result)
+            away_elo = self._update_elo(elos.get(away, self.initial_elo), False, result)
+            elos[home] = home_elo
+            elos[away] = away_elo
+            snapshots.append((home, sport, match_ts, home_elo))
+            snapshots.append((away, sport, match_ts, away_elo))
+
+            if len(snapshots) >= FETCH_BATCH_SIZE:
+                write_cursor.executemany(insert_query, snapshots)
+                n_snapshots += len(snapshots)
+                snapshots = []
+
+        write_cursor.executemany(insert_query, snapshots)
+        n_snapshots += len(snapshots)
+        self._save_elo_history_state(sport, max_id)
+        self.db.conn.commit()
+
+        # Invalidar caches dependientes
+        self._elo_history_ready.pop(sport, None)
+        self.elo_cache.clear()
+
+        logger.info(f"ELO history materialized for {sport}: {n_snapshots} snapshots")
+        return n_snapshots
+
+    def _save_elo_history_state(self, sport: str, last_result_id: int):
+        """Guarda el watermark de la materialización de ELO (sin commit)"""
+        self.db.conn.execute("""
+        INSERT OR REPLACE INTO team_elo_history_state (sport, last_result_id, initial_elo, k_factor)
+        VALUES (?, ?, ?, ?)
+        """, (sport, last_result_id, self.initial_elo, self.k_factor))
+
+    def _lookup_elos(self, sport: str, keys: List[tuple]) -> Optional[List[float]]:
+        """
+        ELO general de muchos (equipo, match_ts) desde team_elo_history
+        Último snapshot estrictamente anterior a match_ts (o initial_elo),
+        resuelto por la PK (team, sport, match_ts) en bloques de queries.
+
+        Args:
+            sport: Deporte
+            keys: Lista de tuplas (team, match_ts)
+
+        Returns:
+            Lista de ELOs alineada con keys, o None si la tabla no está al día
+        """
+        if not keys or not self._has_elo_history(sport):
+            return None
+
+        cursor = self._tuple_cursor()
+        elos = []
+        for start in range(0, len(keys), ELO_LOOKUP_BATCH_SIZE):
+            chunk = keys[start:start + ELO_LOOKUP_BATCH_SIZE]
+            values = ", ".join(["(?, ?, ?)"] * len(chunk))
+            params = [v for i, (team, match_ts) in enumerate(chunk) for v in (i, team, match_ts)]
+            cursor.execute(f"""
+            WITH k(i, team, match_ts) AS (VALUES {values})
+            SELECT (
+                SELECT h.elo FROM team_elo_history h
+                WHERE h.team = k.team AND h.sport = ? AND h.match_ts < k.match_ts
+                ORDER BY h.match_ts DESC
+                LIMIT 1
+            )
+            FROM k
+            ORDER BY k.i
+            """, params + [sport])
+            elos.extend(
+                self.initial_elo if elo is None else elo for (elo,) in cursor.fetchall()
+            )
+        return elos
+
     def calculate_form_with_decay(
         self,
         team: str,
@@ -143,31 +489,33 @@ class AdvancedFeatureEngine:
         """
         # Obtener últimos N partidos del equipo
         self.db.connect()
-        cursor = self.db.conn.cursor()
+        cursor = self._tuple_cursor()
 
         cursor.execute("""
         SELECT
-            r.home_team, r.away_team, r.result_label
+            r.home_team, r.away_team, r.result_label,
+            r.home_score, r.away_score
         FROM raw_match_results r
         WHERE r.sport = ?
         AND (r.home_team = ? OR r.away_team = ?)
-        AND datetime(r.match_date) < datetime(?)
-        ORDER BY r.match_date DESC
+        AND r.match_ts < ?
+        ORDER BY r.match_ts DESC
         LIMIT ?
-        """, (sport, team, team, before_date.isoformat(), n_matches))
+        """, (sport, team, team, self._to_timestamp(before_date), n_matches))
 
         matches = cursor.fetchall()
 
+        return self._form_from_matches(team, matches)
+
+    def _form_from_matches(self, team: str, matches: List) -> float:
+        """Form con decay a partir de los últimos partidos (orden DESC)"""
         if not matches:
             return 0.5  # Neutral form si no hay histórico
 
         # Calcular scores por partido
         scores = []
-        for match in matches:
-            is_home = match['home_team'] == team
-            result = match['result_label']
-
-            if is_home:
+        for home, away, result, _, _ in matches:
+            if home == team:
                 score = 1.0 if result == 'home_win' else (0.5 if result == 'draw' else 0.0)
             else:
                 score = 0.0 if result == 'home_win' else (0.5 if result == 'draw' else 1.0)
@@ -175,9 +523,8 @@ class AdvancedFeatureEngine:
             scores.append(score)
 
         # Decay exponencial: partidos más recientes pesan más
-        # exp(linspace(-1, 0, n)) da [0.37, ..., 1.0]
-        weights = np.exp(np.linspace(-1, 0, len(scores)))
-        weights = weights / weights.sum()  # Normalizar
+        # exp(linspace(-1, 0, n)) da [0.37, ..., 1.0] (ya normalizado, cacheado por n)
+        weights = self._get_form_weights(len(scores))
 
         # Form promedio ponderado
         form = np.average(scores, weights=weights)
@@ -205,8 +552,12 @@ class AdvancedFeatureEngine:
         Returns:
             Dict con estadísticas H2H
         """
+        cache_key = (home_team, away_team, sport, self._to_timestamp(before_date), n_matches)
+        if cache_key in self._h2h_cache:
+            return self._h2h_cache[cache_key]
+
         self.db.connect()
-        cursor = self.db.conn.cursor()
+        cursor = self._tuple_cursor()
 
         cursor.execute("""
         SELECT
@@ -218,14 +569,21 @@ class AdvancedFeatureEngine:
             (r.home_team = ? AND r.away_team = ?) OR
             (r.home_team = ? AND r.away_team = ?)
         )
-        AND datetime(r.match_date) < datetime(?)
-        ORDER BY r.match_date DESC
+        AND r.match_ts < ?
+        ORDER BY r.match_ts DESC
         LIMIT ?
         """, (sport, home_team, away_team, away_team, home_team,
-              before_date.isoformat(), n_matches))
+              self._to_timestamp(before_date), n_matches))
 
         matches = cursor.fetchall()
 
+        stats = self._h2h_from_matches(home_team, matches)
+        self._h2h_cache[cache_key] = stats
+
+        return stats
+
+    def _h2h_from_matches(self, home_team: str, matches: List) -> Dict:
+        """Estadísticas H2H a partir de los enfrentamientos (orden DESC)"""
         if not matches:
             return {
                 'h2h_matches': 0,
@@ -244,32 +602,32 @@ class AdvancedFeatureEngine:
         goals_home = []
         goals_away = []
 
-        for match in matches:
+        for home, away, result, home_score, away_score in matches:
             # Determinar quién era local/visitante en ese partido
-            if match['home_team'] == home_team:
+            if home == home_team:
                 # home_team era local
-                if match['result_label'] == 'home_win':
+                if result == 'home_win':
                     home_wins += 1
-                elif match['result_label'] == 'away_win':
+                elif result == 'away_win':
                     away_wins += 1
                 else:
                     draws += 1
 
-                if match['home_score'] is not None:
-                    goals_home.append(match['home_score'])
-                    goals_away.append(match['away_score'])
+                if home_score is not None:
+                    goals_home.append(home_score)
+                    goals_away.append(away_score)
             else:
                 # home_team era visitante
-                if match['result_label'] == 'away_win':
+                if result == 'away_win':
                     home_wins += 1
-                elif match['result_label'] == 'home_win':
+                elif result == 'home_win':
                     away_wins += 1
                 else:
                     draws += 1
 
-                if match['away_score'] is not None:
-                    goals_home.append(match['away_score'])
-                    goals_away.append(match['home_score'])
+                if away_score is not None:
+                    goals_home.append(away_score)
+                    goals_away.append(home_score)
 
         total = len(matches)
 
@@ -306,18 +664,23 @@ class AdvancedFeatureEngine:
         Returns:
             Dict con stats de goles
         """
+        cache_key = (team, sport, self._to_timestamp(before_date), n_matches, home_only, away_only)
+        if cache_key in self._goals_cache:
+            return self._goals_cache[cache_key]
+
         self.db.connect()
-        cursor = self.db.conn.cursor()
+        cursor = self._tuple_cursor()
 
         query = """
         SELECT
-            r.home_team, r.away_team, r.home_score, r.away_score
+            r.home_team, r.away_team, r.result_label,
+            r.home_score, r.away_score
         FROM raw_match_results r
         WHERE r.sport = ?
-        AND datetime(r.match_date) < datetime(?)
+        AND r.match_ts < ?
         """
 
-        params = [sport, before_date.isoformat()]
+        params = [sport, self._to_timestamp(before_date)]
 
         if home_only:
             query += " AND r.home_team = ?"
@@ -329,34 +692,32 @@ class AdvancedFeatureEngine:
             query += " AND (r.home_team = ? OR r.away_team = ?)"
             params.extend([team, team])
 
-        query += " ORDER BY r.match_date DESC LIMIT ?"
+        query += " ORDER BY r.match_ts DESC LIMIT ?"
         params.append(n_matches)
 
         cursor.execute(query, params)
         matches = cursor.fetchall()
 
-        if not matches:
-            return {
-                'avg_goals_scored': 1.5,
-                'avg_goals_conceded': 1.5,
-                'goal_difference': 0.0
-            }
+        stats = self._goals_from_matches(team, matches)
+        self._goals_cache[cache_key] = stats
+
+        return stats
 
+    def _goals_from_matches(self, team: str, matches: List) -> Dict:
+        """Stats de goles a partir de los últimos partidos del equipo"""
         goals_scored = []
         goals_conceded = []
 
-        for match in matches:
-            if match['home_score'] is None or match['away_score'] is None:
+        for home, away, _, home_score, away_score in matches:
+            if home_score is None or away_score is None:
                 continue
 
-            is_home = match['home_team'] == team
-
-            if is_home:
-                goals_scored.append(match['home_score'])
-                goals_conceded.append(match['away_score'])
+            if home == team:
+                goals_scored.append(home_score)
+                goals_conceded.append(away_score)
             else:
-                goals_scored.append(match['away_score'])
-                goals_conceded.append(match['home_score'])
+                goals_scored.append(away_score)
+                goals_conceded.append(home_score)
 
         if not goals_scored:
             return {
@@ -374,6 +735,65 @@ class AdvancedFeatureEngine:
             'goal_difference': float(avg_scored - avg_conceded)
         }
 
+    def fetch_match_histories(
+        self,
+        home_team: str,
+        away_team: str,
+        sport: str,
+        before_date: datetime
+    ) -> Dict[str, List]:
+        """
+        Obtiene en UNA sola query el histórico de ambos equipos y lo particiona
+        en histórico local, histórico visitante y H2H
+
+        Args:
+            home_team: Equipo local
+            away_team: Equipo visitante
+            sport: Deporte
+            before_date: Fecha límite
+
+        Returns:
+            Dict con listas 'home', 'away' y 'h2h' (orden cronológico ASC)
+        """
+        self.db.connect()
+        cursor = self._tuple_cursor()
+
+        cursor.execute("""
+        SELECT
+            r.home_team, r.away_team, r.result_label,
+            r.home_score, r.away_score
+        FROM raw_match_results r
+        WHERE r.sport = ?
+        AND (r.home_team IN (?, ?) OR r.away_team IN (?, ?))
+        AND r.match_ts < ?
+        ORDER BY r.match_ts ASC
+        """, (sport, home_team, away_team, home_team, away_team,
+              self._to_timestamp(before_date)))
+
+        rows = cursor.fetchall()
+
+        home_history = []
+        away_history = []
+        h2h_history = []
+
+        for row in rows:
+            home, away = row[0], row[1]
+            has_home = home == home_team or away == home_team
+            has_away = home == away_team or away == away_team
+
+            if has_home:
+                home_history.append(row)
+            if has_away:
+                away_history.append(row)
+            if has_home and has_away:
+                h2h_history.append(row)
+
+        return {
+            'home': home_history,
+            'away': away_history,
+            'h2h': h2h_history
+        }
+
     def calculate_league_strength(
         self,
         league: str,
@@ -393,16 +813,16 @@ class AdvancedFeatureEngine:
         """
         # Obtener equipos únicos de la liga
         self.db.connect()
-        cursor = self.db.conn.cursor()
+        cursor = self._tuple_cursor()
 
+        before_ts = self._to_timestamp(before_date)
         cursor.execute("""
         SELECT DISTINCT home_team FROM raw_match_results
-        WHERE league = ? AND sport = ? AND datetime(match_date) < datetime(?)
+        WHERE league = ? AND sport = ? AND match_ts < ?
         UNION
         SELECT DISTINCT away_team FROM raw_match_results
-        WHERE league = ? AND sport = ? AND datetime(match_date) < datetime(?)
-        """, (league, sport, before_date.isoformat(),
-              league, sport, before_date.isoformat()))
+        WHERE league = ? AND sport = ? AND match_ts < ?
+        """, (league, sport, before_ts, league, sport, before_ts))
 
         teams = [row[0] for row in cursor.fetchall()]
 
@@ -444,29 +864,10 @@ class AdvancedFeatureEngine:
         except:
             match_date = datetime.now()
 
-        logger.debug(f"Building features for {home_team} vs {away_team} ({match_date.date()})")
-
-        # ELO Ratings
-        home_elo = self.calculate_elo_rating(home_team, sport, match_date)
-        away_elo = self.calculate_elo_rating(away_team, sport, match_date)
-
-        # Form (últimos 5 partidos)
-        home_form_5 = self.calculate_form_with_decay(home_team, sport, match_date, n_matches=5)
-        away_form_5 = self.calculate_form_with_decay(away_team, sport, match_date, n_matches=5)
-
-        # Form específica (local/visitante)
-        home_form_home = self.calculate_form_with_decay(home_team, sport, match_date, n_matches=5)  # TODO: añadir filtro home_only
-        away_form_away = self.calculate_form_with_decay(away_team, sport, match_date, n_matches=5)  # TODO: añadir filtro away_only
-
-        # H2H
-        h2h_stats = self.calculate_h2h_stats(home_team, away_team, sport, match_date)
-
-        # Goals stats
-        home_goals = self.calculate_goals_stats(home_team, sport, match_date, n_matches=10)
-        away_goals = self.calculate_goals_stats(away_team, sport, match_date, n_matches=10)
+        # Formato diferido de loguru: no se arma el string si DEBUG no se emite
+        logger.debug("Building features for {} vs {} ({})", home_team, away_team, match_date.date())
 
-        # League strength
-        league_strength = self.calculate_league_strength(league, sport, match_date)
+        features = self._build_history_features(home_team, away_team, league, sport, match_date)
 
         # Market features (from odds)
         odds = match.get('odds', {})
@@ -483,8 +884,71 @@ class AdvancedFeatureEngine:
         total_implied = implied_home + implied_away + (implied_draw if sport == 'soccer' else 0)
         margin = total_implied - 1.0
 
-        # Features dict
-        features = {
+        # Market
+        features['home_win_odds'] = home_win_odds
+        features['away_win_odds'] = away_win_odds
+        features['implied_home'] = implied_home
+        features['implied_away'] = implied_away
+        features['market_margin'] = margin
+
+        if sport == 'soccer' and draw_odds:
+            features['draw_odds'] = draw_odds
+            features['implied_draw'] = implied_draw
+
+        logger.debug("Features built: ELO diff={:.1f}, Form diff={:.2f}", features['elo_diff'], features['form_diff'])
+
+        return features
+
+    def _build_history_features(
+        self,
+        home_team: str,
+        away_team: str,
+        league: Optional[str],
+        sport: str,
+        match_date: datetime
+    ) -> Dict:
+        """Features que dependen del histórico (ELO, form, H2H, goles, liga)"""
+        # Histórico de ambos equipos + H2H en una sola query
+        histories = self.fetch_match_histories(home_team, away_team, sport, match_date)
+        home_recent = histories['home'][::-1]  # DESC: más reciente primero
+        away_recent = histories['away'][::-1]
+
+        # ELO Ratings
+        match_ts = self._to_timestamp(match_date)
+        home_elo_key = f"{home_team}_{sport}_{match_ts}"
+        away_elo_key = f"{away_team}_{sport}_{match_ts}"
+        missing = [
+            (key, team, history)
+            for key, team, history in (
+                (home_elo_key, home_team, histories['home']),
+                (away_elo_key, away_team, histories['away'])
+            )
+            if key not in self.elo_cache
+        ]
+        if missing:
+            # Snapshots materializados (una query para ambos equipos) o, si la
+            # tabla no está al día, recorrido del histórico ya leído
+            elos = self._lookup_elos(sport, [(team, match_ts) for _, team, _ in missing])
+            for j, (key, team, history) in enumerate(missing):
+                self.elo_cache[key] = elos[j] if elos is not None else self._elo_from_matches(team, history)
+        home_elo = self.elo_cache[home_elo_key]
+        away_elo = self.elo_cache[away_elo_key]
+
+        # Form (últimos 5 partidos)
+        home_form_5 = self._form_from_matches(home_team, home_recent[:5])
+        away_form_5 = self._form_from_matches(away_team, away_recent[:5])
+
+        # H2H (últimos 10 enfrentamientos)
+        h2h_stats = self._h2h_from_matches(home_team, histories['h2h'][::-1][:10])
+
+        # Goals stats (últimos 10 partidos)
+        home_goals = self._goals_from_matches(home_team, home_recent[:10])
+        away_goals = self._goals_from_matches(away_team, away_recent[:10])
+
+        # League strength
+        league_strength = self.calculate_league_strength(league, sport, match_date)
+
+        return {
             # ELO
             'home_elo': home_elo,
             'away_elo': away_elo,
@@ -510,24 +974,364 @@ class AdvancedFeatureEngine:
             'away_goal_diff': away_goals['goal_difference'],
 
             # League
-            'league_strength': league_strength,
-
-            # Market
-            'home_win_odds': home_win_odds,
-            'away_win_odds': away_win_odds,
-            'implied_home': implied_home,
-            'implied_away': implied_away,
-            'market_margin': margin
+            'league_strength': league_strength
         }
 
-        if sport == 'soccer' and draw_odds:
-            features['draw_odds'] = draw_odds
-            features['implied_draw'] = implied_draw
+    def build_advanced_features_batch(
+        self,
+        matches: pd.DataFrame,
+        sport: str = 'soccer'
+    ) -> pd.DataFrame:
+        """
+        Versión batch de build_advanced_features sobre un DataFrame de partidos
+        Un solo engine (caches compartidas) para el histórico y features de
+        mercado calculadas como operaciones de columna
+
+        Args:
+            matches: DataFrame con match_id, home_team, away_team, league, match_date,
+                     home_win_odds, away_win_odds, draw_odds
+            sport: Deporte
+
+        Returns:
+            DataFrame con las mismas columnas que build_advanced_features, alineado
+            con el index de matches (sin las filas que fallan o no tienen odds)
+        """
+        # Sin odds local/visitante no hay features de mercado: descartar
+        has_odds = matches['home_win_odds'].notna() & matches['away_win_odds'].notna()
+        if not has_odds.all():
+            logger.warning(f"Skipping {int((~has_odds).sum())} matches without home/away odds")
+            matches = matches[has_odds]
+
+        match_dates = pd.to_datetime(matches['match_date'], utc=True, errors='coerce', format='ISO8601')
+
+        # Features de histórico: un solo pase cronológico para todos los partidos
+        # (targets identificados por su posición en matches)
+        targets = []
+        unparsed = []
+        for pos, (home_team, away_team, league, match_date) in enumerate(zip(
+            matches['home_team'], matches['away_team'], matches['league'], match_dates
+        )):
+            if pd.isna(match_date):
+                unparsed.append((pos, home_team, away_team, league))
+            else:
+                targets.append((pos, home_team, away_team, league,
+                                self._to_timestamp(match_date.to_pydatetime())))
+
+        columns, computed = self._history_features_sweep(targets, len(matches), sport)
+
+        # Fechas no parseables: mismo fallback que build_advanced_features (now)
+        for pos, home_team, away_team, league in unparsed:
+            try:
+                row = self._build_history_features(
+                    home_team, away_team, league, sport, datetime.now()
+                )
+            except Exception as e:
+                logger.warning(f"Error processing match {matches['match_id'].iloc[pos]}: {e}")
+                continue
+            for name in HISTORY_FEATURE_COLUMNS:
+                columns[name][pos] = row[name]
+            computed[pos] = True
+
+        if not computed.any():
+            return pd.DataFrame()
+
+        # DataFrame directo desde los arrays, ya en el orden original de matches
+        features = pd.DataFrame(
+            {name: values[computed] for name, values in columns.items()},
+            index=matches.index[computed]
+        )
 
-        logger.debug(f"Features built: ELO diff={features['elo_diff']:.1f}, Form diff={features['form_diff']:.2f}")
+        # Market features vectorizadas
+        odds = matches.loc[features.index]
+        home_win_odds = odds['home_win_odds'].astype(float).to_numpy()
+        away_win_odds = odds['away_win_odds'].astype(float).to_numpy()
+
+        with np.errstate(divide='ignore'):
+            implied_home = np.where(home_win_odds > 0, 1.0 / home_win_odds, 0.5)
+            implied_away = np.where(away_win_odds > 0, 1.0 / away_win_odds, 0.5)
+            total_implied = implied_home + implied_away
+
+            if sport == 'soccer':
+                draw_odds = odds['draw_odds'].astype(float).to_numpy()
+                implied_draw = np.where(draw_odds > 0, 1.0 / draw_odds, 0.33)
+                total_implied = total_implied + implied_draw
+
+        features['home_win_odds'] = home_win_odds
+        features['away_win_odds'] = away_win_odds
+        features['implied_home'] = implied_home
+        features['implied_away'] = implied_away
+        features['market_margin'] = total_implied - 1.0
+
+        if sport == 'soccer':
+            # Igual que el dict: sólo hay draw_odds/implied_draw si la cuota existe
+            has_draw = ~np.isnan(draw_odds) & (draw_odds != 0)
+            if has_draw.any():
+                features['draw_odds'] = np.where(has_draw, draw_odds, np.nan)
+                features['implied_draw'] = np.where(has_draw, implied_draw, np.nan)
 
         return features
 
+    def _history_features_sweep(
+        self,
+        targets: List[tuple],
+        n_rows: int,
+        sport: str
+    ) -> tuple:
+        """
+        Features de histórico para muchos partidos en UN pase cronológico
+        sobre raw_match_results (en vez de consultar el histórico por partido)
+
+        Mantiene estado incremental por equipo (últimos partidos y ELO, si
+        team_elo_history no está al día), por cruce (H2H) y por liga; antes
+        de cada partido objetivo sólo se han aplicado resultados con match_ts
+        estrictamente menor, igual que en _build_history_features.
+
+        Args:
+            targets: Lista de tuplas (pos, home_team, away_team, league, match_ts);
+                     pos es la fila de salida (0 <= pos < n_rows)
+            n_rows: Número de filas de los arrays de salida
+            sport: Deporte
+
+        Returns:
+            Tupla (columns, computed): dict columna -> array preasignado de
+            n_rows valores (HISTORY_FEATURE_COLUMNS) y máscara booleana de las
+            filas calculadas (las que fallan o no son target quedan en False)
+        """
+        self.db.connect()
+        cursor = self._tuple_cursor()
+        cursor.execute("""
+        SELECT
+            r.home_team, r.away_team, r.result_label,
+            r.home_score, r.away_score, r.league, r.match_ts
+        FROM raw_match_results r
+        WHERE r.sport = ?
+        AND r.match_ts IS NOT NULL
+        ORDER BY r.match_ts ASC
+        """, (sport,))
+
+        # ELO general de todos los targets desde team_elo_history (si está al
+        # día): el pase sólo mantiene el ELO por liga
+        table_elos = self._lookup_elos(
+            sport,
+            [(home_team, match_ts) for _, home_team, _, _, match_ts in targets]
+            + [(away_team, match_ts) for _, _, away_team, _, match_ts in targets]
+        )
+        if table_elos is not None:
+            n_targets = len(targets)
+            table_elos = {
+                target[0]: (table_elos[j], table_elos[n_targets + j])
+                for j, target in enumerate(targets)
+            }
+
+        # Resultados en streaming: sólo se lee hasta el partido objetivo actual
+        results = self._iter_rows(cursor)
+        next_result = next(results, None)
+
+        team_history = defaultdict(list)   # equipo -> partidos (orden ASC)
+        pair_history = defaultdict(list)   # {equipo_a, equipo_b} -> enfrentamientos
+        elos = {}                          # equipo -> ELO general
+        league_elos = {}                   # (liga, equipo) -> ELO dentro de la liga
+        league_teams = defaultdict(set)    # liga -> equipos vistos
+
+        # Acumulación columnar: un array preasignado por feature, escrito por posición
+        columns = {
+            name: np.zeros(n_rows, dtype=HISTORY_FEATURE_DTYPES[name])
+            for name in HISTORY_FEATURE_COLUMNS
+        }
+        computed = np.zeros(n_rows, dtype=bool)
+        total = len(targets)
+        last_log = time.monotonic()
+
+        for i, (pos, home_team, away_team, league, match_ts) in enumerate(
+            sorted(targets, key=lambda t: t[4])
+        ):
+            # Progreso por tiempo de reloj, no por número de iteraciones
+            now = time.monotonic()
+            if now - last_log >= PROGRESS_LOG_INTERVAL:
+                logger.info("Processing match {}/{}...", i, total)
+                last_log = now
+
+            # Aplicar resultados anteriores al partido
+            while next_result is not None and next_result[6] < match_ts:
+                home, away, result, home_score, away_score, res_league, _ = next_result
+                row = (home, away, result, home_score, away_score)
+
+                team_history[home].append(row)
+                team_history[away].append(row)
+                pair_history[frozenset((home, away))].append(row)
+
+                if table_elos is None:
+                    elos[home] = self._update_elo(elos.get(home, self.initial_elo), True, result)
+                    elos[away] = self._update_elo(elos.get(away, self.initial_elo), False, result)
+
+                if res_league is not None:
+                    league_elos[(res_league, home)] = self._update_elo(
+                        league_elos.get((res_league, home), self.initial_elo), True, result
+                    )
+                    league_elos[(res_league, away)] = self._update_elo(
+                        league_elos.get((res_league, away), self.initial_elo), False, result
+                    )
+                    league_teams[res_league].update((home, away))
+
+                next_result = next(results, None)
+
+            try:
+                home_recent = team_history[home_team][-10:][::-1]
+                away_recent = team_history[away_team][-10:][::-1]
+                h2h_recent = pair_history[frozenset((home_team, away_team))][-10:][::-1]
+
+                if table_elos is not None:
+                    home_elo, away_elo = table_elos[pos]
+                else:
+                    home_elo = elos.get(home_team, self.initial_elo)
+                    away_elo = elos.get(away_team, self.initial_elo)
+
+                home_form_5 = self._form_from_matches(home_team, home_recent[:5])
+                away_form_5 = self._form_from_matches(away_team, away_recent[:5])
+                h2h_stats = self._h2h_from_matches(home_team, h2h_recent)
+                home_goals = self._goals_from_matches(home_team, home_recent[:10])
+                away_goals = self._goals_from_matches(away_team, away_recent[:10])
+
+                # League strength: mismos 20 equipos (orden alfabético) que
+                # calculate_league_strength
+                teams = sorted(league_teams[league])[:20] if league is not None else []
+                if teams:
+                    league_strength = float(np.mean([league_elos[(league, team)] for team in teams]))
+                else:
+                    league_strength = self.initial_elo
+
+                values = (
+                    # ELO
+                    home_elo, away_elo, home_elo - away_elo,
+                    # Form
+                    home_form_5, away_form_5, home_form_5 - away_form_5,
+                    # H2H
+                    h2h_stats['h2h_matches'], h2h_stats['h2h_home_win_rate'],
+                    h2h_stats['h2h_avg_goals_home'], h2h_stats['h2h_avg_goals_away'],
+                    # Goals
+                    home_goals['avg_goals_scored'], home_goals['avg_goals_conceded'],
+                    away_goals['avg_goals_scored'], away_goals['avg_goals_conceded'],
+                    home_goals['goal_difference'], away_goals['goal_difference'],
+                    # League
+                    league_strength
+                )
+            except Exception as e:
+                logger.warning(f"Error processing match at row {pos}: {e}")
+                continue
+
+            for name, value in zip(HISTORY_FEATURE_COLUMNS, values):
+                columns[name][pos] = value
+            computed[pos] = True
+
+        return columns, computed
+
+    def build_advanced_features_array(
+        self,
+        match: Dict,
+        sport: str = 'soccer',
+        columns: Optional[List[str]] = None
+    ) -> np.ndarray:
+        """
+        Igual que build_advanced_features pero devuelve un vector float32
+        en orden fijo de columnas, listo para apilar en una matriz (N, F)
+
+        Args:
+            match: Dict con match_id, home_team, away_team, match_date, odds
+            sport: Deporte
+            columns: Orden de columnas (default: ADVANCED_FEATURE_COLUMNS + extras de soccer)
+
+        Returns:
+            np.ndarray float32 (features ausentes = 0.0)
+        """
+        if columns is None:
+            columns = ADVANCED_FEATURE_COLUMNS
+            if sport == 'soccer':
+                columns = columns + SOCCER_EXTRA_COLUMNS
+
+        features = self.build_advanced_features(match, sport=sport)
+
+        return np.fromiter(
+            (features.get(col, 0.0) for col in columns),
+            dtype=np.float32,
+            count=len(columns)
+        )
+
+    def build_features_batch(
+        self,
+        matches: List[Dict],
+        sport: str = 'soccer',
+        max_workers: Optional[int] = None,
+        use_processes: bool = False
+    ) -> np.ndarray:
+        """
+        Construye la matriz de features (N, F) float32 para una lista de partidos
+        en paralelo con un ThreadPoolExecutor (o procesos joblib)
+
+        Cada hilo usa su propio engine y conexión SQLite (una conexión compartida
+        serializaría las queries); sqlite3 libera el GIL durante la ejecución.
+        Con use_processes=True el cálculo Python (form, H2H, goles) tampoco
+        compite por el GIL: cada proceso worker mantiene su propio engine.
+
+        Args:
+            matches: Lista de dicts de partido (ver build_advanced_features)
+            sport: Deporte
+            max_workers: Hilos/procesos del pool (default: uno por CPU)
+            use_processes: Usar procesos (joblib/loky) en lugar de hilos
+
+        Returns:
+            np.ndarray float32 de forma (len(matches), n_features)
+        """
+        columns = ADVANCED_FEATURE_COLUMNS
+        if sport == 'soccer':
+            columns = columns + SOCCER_EXTRA_COLUMNS
+
+        output = np.zeros((len(matches), len(columns)), dtype=np.float32)
+        if not matches:
+            return output
+
+        if use_processes:
+            # Los workers de loky sobreviven entre llamadas: la versión de
+            # resultados invalida sus caches cuando entran resultados nuevos
+            results_version = self.db.get_results_version(sport)
+            rows = Parallel(n_jobs=max_workers or -1, prefer='processes', batch_size=64)(
+                delayed(_compute_match_features)(
+                    match, type(self.db), self.db.db_path, sport, columns,
+                    self.initial_elo, self.k_factor, results_version
+                )
+                for match in matches
+            )
+            for i, row in enumerate(rows):
+                output[i] = row
+            return output
+
+        local = threading.local()
+        engines = []
+        engines_lock = threading.Lock()
+
+        def _thread_engine() -> 'AdvancedFeatureEngine':
+            engine = getattr(local, 'engine', None)
+            if engine is None:
+                engine = AdvancedFeatureEngine(
+                    type(self.db)(self.db.db_path), self.initial_elo, self.k_factor
+                )
+                local.engine = engine
+                with engines_lock:
+                    engines.append(engine)
+            return engine
+
+        def _fill_row(i: int):
+            output[i] = _thread_engine().build_advanced_features_array(
+                matches[i], sport=sport, columns=columns
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(_fill_row, range(len(matches))))
+        finally:
+            for engine in engines:
+                engine.db.close()
+
+        return output
 
 if __name__ == "__main__":
     # Test del feature engineering
@@ -2,12 +2,55 @@
 Feature Integration - Integra advanced features en el pipeline de training/prediction
 """
 
+import threading
 import pandas as pd
+from collections import OrderedDict
 from typing import Dict, List
 from loguru import logger
 from src.data.feature_engineering import AdvancedFeatureEngine
 from src.utils.database import BettingDatabase
 
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+try:
+    import pyarrow  # noqa: F401  (motor de DataFrame.to_parquet)
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+# Partidos con resultado + odds canónicas (base del dataset de entrenamiento)
+TRAINING_MATCHES_QUERY = """
+SELECT
+    r.match_id,
+    r.sport,
+    r.league,
+    r.home_team,
+    r.away_team,
+    r.match_date,
+    r.result_label,
+    r.home_score,
+    r.away_score,
+    c.home_win_odds,
+    c.away_win_odds,
+    c.draw_odds
+FROM {results} r
+JOIN {odds} c ON r.match_id = c.match_id
+WHERE r.sport = ?
+AND r.result_label IS NOT NULL
+ORDER BY r.match_date ASC
+"""
+
+
+# Memo LRU de features por partido: (db, sport, partido, odds, versión de datos) -> features
+_match_features_cache: OrderedDict = OrderedDict()
+_match_features_cache_lock = threading.Lock()
+_MATCH_FEATURES_CACHE_MAX = 4096
+
 
 def calculate_match_features_advanced(
     match: Dict,
@@ -16,7 +59,10 @@ def calculate_match_features_advanced(
     """
     Calcula features avanzadas para un match usando AdvancedFeatureEngine
 
-    Este es el wrapper que se integra con el sistema actual
+    Este es el wrapper que se integra con el sistema actual. El resultado se
+    memoiza (LRU) por partido + odds; la clave incluye la versión de
+    raw_match_results del deporte (BettingDatabase.get_results_version), así
+    que insertar, corregir o borrar un resultado invalida las entradas.
 
     Args:
         match: Dict con match info (home_team, away_team, match_date, odds, etc.)
@@ -27,15 +73,66 @@ def calculate_match_features_advanced(
     """
     sport = match.get('sport', 'soccer')
 
+    odds = match.get('odds')
+    cache_key = (
+        db.db_path,
+        sport,
+        match.get('home_team'),
+        match.get('away_team'),
+        match.get('league'),
+        str(match.get('match_date')),
+        tuple(sorted(odds.items())) if isinstance(odds, dict) else odds,
+        db.get_results_version(sport)
+    )
+    with _match_features_cache_lock:
+        cached = _match_features_cache.get(cache_key)
+        if cached is not None:
+            _match_features_cache.move_to_end(cache_key)
+            return dict(cached)
+
     # Crear feature engine
     engine = AdvancedFeatureEngine(db)
 
     # Build advanced features
     features = engine.build_advanced_features(match, sport=sport)
 
+    with _match_features_cache_lock:
+        _match_features_cache[cache_key] = dict(features)
+        if len(_match_features_cache) > _MATCH_FEATURES_CACHE_MAX:
+            _match_features_cache.popitem(last=False)
+
     return features
 
 
+def _load_training_matches(db: BettingDatabase, sport: str) -> pd.DataFrame:
+    """
+    Carga el join resultados + odds canónicas como DataFrame
+
+    Con DuckDB instalado el join corre en su motor columnar leyendo el archivo
+    SQLite directamente (extensión sqlite); si no está disponible o falla,
+    se ejecuta en SQLite vía pandas.
+    """
+    if DUCKDB_AVAILABLE:
+        try:
+            con = duckdb.connect()
+            try:
+                con.execute("INSTALL sqlite; LOAD sqlite;")
+                db_path = db.db_path.replace("'", "''")
+                con.execute(f"ATTACH '{db_path}' AS betting (TYPE sqlite, READ_ONLY)")
+                query = TRAINING_MATCHES_QUERY.format(
+                    results='betting.raw_match_results', odds='betting.canonical_odds'
+                )
+                return con.execute(query, [sport]).df()
+            finally:
+                con.close()
+        except Exception as e:
+            logger.warning(f"DuckDB load failed ({e}) - falling back to SQLite")
+
+    db.connect()
+    query = TRAINING_MATCHES_QUERY.format(results='raw_match_results', odds='canonical_odds')
+    return pd.read_sql_query(query, db.conn, params=(sport,))
+
+
 def build_training_dataset_with_advanced_features(
     db: BettingDatabase,
     sport: str = 'soccer',
@@ -55,84 +152,33 @@ def build_training_dataset_with_advanced_features(
     logger.info(f"Building training dataset with advanced features for {sport}...")
 
     # 1. Obtener matches con odds y resultados
-    db.connect()
-    cursor = db.conn.cursor()
-
-    query = """
-    SELECT
-        r.match_id,
-        r.sport,
-        r.league,
-        r.home_team,
-        r.away_team,
-        r.match_date,
-        r.result_label,
-        r.home_score,
-        r.away_score,
-        c.home_win_odds,
-        c.away_win_odds,
-        c.draw_odds
-    FROM raw_match_results r
-    JOIN canonical_odds c ON r.match_id = c.match_id
-    WHERE r.sport = ?
-    AND r.result_label IS NOT NULL
-    ORDER BY r.match_date ASC
-    """
-
-    cursor.execute(query, (sport,))
-    rows = cursor.fetchall()
+    matches = _load_training_matches(db, sport)
 
-    if len(rows) < min_rows:
-        logger.warning(f"Insufficient data: {len(rows)} rows (min: {min_rows})")
+    if len(matches) < min_rows:
+        logger.warning(f"Insufficient data: {len(matches)} rows (min: {min_rows})")
         return pd.DataFrame()
 
-    logger.info(f"Found {len(rows)} matches with results")
-
-    # 2. Build features para cada match
-    features_list = []
-
-    for i, row in enumerate(rows):
-        if i % 100 == 0:
-            logger.info(f"Processing match {i}/{len(rows)}...")
-
-        match = {
-            'match_id': row['match_id'],
-            'sport': row['sport'],
-            'league': row['league'],
-            'home_team': row['home_team'],
-            'away_team': row['away_team'],
-            'match_date': row['match_date'],
-            'odds': {
-                'home_win': row['home_win_odds'],
-                'away_win': row['away_win_odds'],
-                'draw': row['draw_odds']
-            }
-        }
+    logger.info(f"Found {len(matches)} matches with results")
 
-        try:
-            features = calculate_match_features_advanced(match, db)
-
-            # Agregar target
-            features['result'] = row['result_label']
-            features['match_id'] = row['match_id']
-            features['match_date'] = row['match_date']
-
-            features_list.append(features)
-        except Exception as e:
-            logger.warning(f"Error processing match {match['match_id']}: {e}")
-            continue
+    # 2. Build features para todos los matches con un solo engine
+    engine = AdvancedFeatureEngine(db)
+    features = engine.build_advanced_features_batch(matches, sport=sport)
 
-    if not features_list:
+    if features.empty:
         logger.error("No features generated")
         return pd.DataFrame()
 
-    # 3. Convertir a DataFrame
-    df = pd.DataFrame(features_list)
+    # 3. Agregar target e identificadores
+    meta = matches.loc[features.index, ['result_label', 'match_id', 'match_date']]
+    df = pd.concat(
+        [features, meta.rename(columns={'result_label': 'result'})],
+        axis=1
+    ).reset_index(drop=True)
 
     logger.info(f"Dataset built: {len(df)} rows, {len(df.columns)} columns")
     logger.info(f"Features: {df.columns.tolist()}")
 
-    # 4. Guardar CSV para referencia
+    # 4. Guardar CSV para referencia (+ Parquet columnar si hay pyarrow)
     import os
     os.makedirs("data", exist_ok=True)
 
@@ -140,6 +186,11 @@ def build_training_dataset_with_advanced_features(
     df.to_csv(output_path, index=False)
     logger.info(f"Dataset saved to {output_path}")
 
+    if PYARROW_AVAILABLE:
+        parquet_path = f"data/training_advanced_{sport}.parquet"
+        df.to_parquet(parquet_path, index=False)
+        logger.info(f"Dataset saved to {parquet_path}")
+
     return df
 
 
@@ -6,18 +6,66 @@ Modelo ML con probabilidades calibradas para value betting
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import TimeSeriesSplit
-from sklearn.calibration import CalibratedClassifierCV
 from sklearn.metrics import brier_score_loss, log_loss, accuracy_score
 from sklearn.preprocessing import LabelEncoder
 try:
+    from sklearn.frozen import FrozenEstimator  # sklearn >= 1.6
+    FROZEN_ESTIMATOR_AVAILABLE = True
+except ImportError:
+    FROZEN_ESTIMATOR_AVAILABLE = False
+try:
+    import xgboost as xgb
     from xgboost import XGBClassifier
+    XGBOOST_AVAILABLE = True
 except ImportError:
     from sklearn.ensemble import GradientBoostingClassifier as XGBClassifier
-from typing import Dict, Tuple
+    XGBOOST_AVAILABLE = False
+from typing import Dict, Optional, Tuple
 from loguru import logger
-import pickle
+import joblib
 import json
 import os
+import warnings
+
+try:
+    import lz4  # noqa: F401  (compresión rápida para joblib)
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# lz4 descomprime mucho más rápido que zlib; sin lz4 se guarda sin comprimir
+MODEL_COMPRESS = ('lz4', 3) if LZ4_AVAILABLE else 0
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _ece_core(y_pred_proba, y_pred, y_true, bins):
+        """ECE en un solo pase: bin (lo, hi] + acumulación por bin sin máscaras"""
+        n_bins = bins.shape[0] - 1
+        counts = np.zeros(n_bins)
+        acc_sum = np.zeros(n_bins)
+        conf_sum = np.zeros(n_bins)
+
+        n = y_pred_proba.shape[0]
+        for i in range(n):
+            b = np.searchsorted(bins, y_pred_proba[i]) - 1
+            b = min(max(b, 0), n_bins - 1)
+            counts[b] += 1
+            conf_sum[b] += y_pred_proba[i]
+            if y_pred[i] == y_true[i]:
+                acc_sum[b] += 1
+
+        ece = 0.0
+        for b in range(n_bins):
+            if counts[b] > 0:
+                ece += counts[b] / n * abs(acc_sum[b] / counts[b] - conf_sum[b] / counts[b])
+        return ece
 
 
 class CalibratedBettingModel:
@@ -36,7 +84,9 @@ class CalibratedBettingModel:
         self.base_model = None
         self.calibrated_model = None
         self.feature_columns = []
+        self._feature_index = pd.Index([])
         self.label_encoder = LabelEncoder()
+        self._classes = ()
         self.calibration_metrics = {}
 
     def train(
@@ -61,12 +111,19 @@ class CalibratedBettingModel:
         # Separar features y target
         X = data.drop(['result', 'match_id', 'match_date'], axis=1, errors='ignore')
         X = X.select_dtypes(include=[np.number])
+        # Los árboles (XGBoost hist / sklearn) trabajan en float32 de todos modos
+        X = X.astype(np.float32, copy=False)
         y = data['result']
 
         self.feature_columns = X.columns.tolist()
+        self._feature_index = pd.Index(self.feature_columns)
+
+        # Array contiguo único: folds y splits se cortan con indexado numpy
+        X_np = np.ascontiguousarray(X.to_numpy(dtype=np.float32))
 
         # Label encoding
         y_encoded = self.label_encoder.fit_transform(y)
+        self._classes = tuple(self.label_encoder.classes_)
 
         # TimeSeriesSplit - CRÍTICO
         tscv = TimeSeriesSplit(n_splits=n_splits)
@@ -80,6 +137,9 @@ class CalibratedBettingModel:
                     learning_rate=0.1,
                     subsample=0.8,
                     colsample_bytree=0.8,
+                    tree_method='hist',  # binning por cuantiles: mucho más rápido que exact
+                    max_bin=256,
+                    n_jobs=os.cpu_count(),
                     random_state=42,
                     eval_metric='mlogloss'
                 )
@@ -106,16 +166,47 @@ class CalibratedBettingModel:
 
         logger.info("Starting walk-forward validation...")
 
-        for train_idx, val_idx in tscv.split(X):
-            X_train, X_val = X.iloc[train_idx], X.iloc[val_idx]
-            y_train, y_val = y_encoded[train_idx], y_encoded[val_idx]
+        # XGBoost nativo: cuantiles (bins) calculados una vez y reutilizados
+        # por todos los folds
+        use_native_xgb = XGBOOST_AVAILABLE and isinstance(self.base_model, XGBClassifier)
+        if use_native_xgb:
+            n_classes = len(self.label_encoder.classes_)
+            dmatrix_ref = xgb.QuantileDMatrix(X_np, y_encoded, max_bin=self.base_model.max_bin)
+            xgb_params = {
+                k: v for k, v in self.base_model.get_xgb_params().items() if v is not None
+            }
+            if n_classes > 2:
+                xgb_params.update(objective='multi:softprob', num_class=n_classes)
+            else:
+                xgb_params['objective'] = 'binary:logistic'
+
+        for train_idx, val_idx in tscv.split(X_np):
+            # TimeSeriesSplit da rangos contiguos: con slices los folds son vistas, sin copia
+            train_sl = slice(train_idx[0], train_idx[-1] + 1)
+            val_sl = slice(val_idx[0], val_idx[-1] + 1)
+            y_train, y_val = y_encoded[train_sl], y_encoded[val_sl]
+
+            if use_native_xgb:
+                # Train on fold (bins compartidos vía ref)
+                dtrain = xgb.QuantileDMatrix(X_np[train_sl], y_train, ref=dmatrix_ref)
+                booster = xgb.train(
+                    xgb_params, dtrain, num_boost_round=self.base_model.n_estimators
+                )
+
+                # Predict
+                y_val_proba = booster.inplace_predict(X_np[val_sl])
+                if n_classes <= 2:
+                    y_val_proba = np.column_stack([1 - y_val_proba, y_val_proba])
+                y_val_pred = np.argmax(y_val_proba, axis=1)
+            else:
+                X_train, X_val = X_np[train_sl], X_np[val_sl]
 
-            # Train on fold
-            self.base_model.fit(X_train, y_train)
+                # Train on fold
+                self.base_model.fit(X_train, y_train)
 
-            # Predict
-            y_val_proba = self.base_model.predict_proba(X_val)
-            y_val_pred = self.base_model.predict(X_val)
+                # Predict
+                y_val_proba = self.base_model.predict_proba(X_val)
+                y_val_pred = self.base_model.predict(X_val)
 
             # Métricas
             accuracy = accuracy_score(y_val, y_val_pred)
@@ -126,8 +217,8 @@ class CalibratedBettingModel:
 
             cv_metrics.append({
                 'fold': fold,
-                'accuracy': accuracy,
-                'log_loss': logloss,
+                'accuracy': float(accuracy),
+                'log_loss': float(logloss),
                 'ece': ece,
                 'n_samples': len(y_val)
             })
@@ -137,23 +228,33 @@ class CalibratedBettingModel:
             )
             fold += 1
 
-        # Train final model on all data
-        logger.info("Training final model on all data...")
-        self.base_model.fit(X, y_encoded)
+        # Últimos 20% reservados para calibración: el modelo final NO los ve
+        cal_size = int(len(X) * 0.2)
+        X_cal = X_np[-cal_size:]
+        y_cal = y_encoded[-cal_size:]
+
+        # Train final model (primer 80%, un solo fit)
+        logger.info("Training final model on first 80% of data...")
+        self.base_model.fit(X_np[:-cal_size], y_encoded[:-cal_size])
 
         # CALIBRATION - Isotonic regression
         logger.info(f"Calibrating probabilities with {calibration_method}...")
 
-        # Usar últimos 20% para calibración
-        cal_size = int(len(X) * 0.2)
-        X_cal = X.iloc[-cal_size:]
-        y_cal = y_encoded[-cal_size:]
+        # Import diferido: sólo se necesita al entrenar (al cargar lo trae el unpickle)
+        from sklearn.calibration import CalibratedClassifierCV
 
-        self.calibrated_model = CalibratedClassifierCV(
-            self.base_model,
-            method=calibration_method,
-            cv='prefit'
-        )
+        if FROZEN_ESTIMATOR_AVAILABLE:
+            # Modelo congelado: CalibratedClassifierCV no lo clona ni reentrena
+            self.calibrated_model = CalibratedClassifierCV(
+                FrozenEstimator(self.base_model),
+                method=calibration_method
+            )
+        else:
+            self.calibrated_model = CalibratedClassifierCV(
+                self.base_model,
+                method=calibration_method,
+                cv='prefit'
+            )
 
         self.calibrated_model.fit(X_cal, y_cal)
 
@@ -169,9 +270,9 @@ class CalibratedBettingModel:
             'ece_after_calibration': ece_after,
             'ece_improvement': ece_before - ece_after,
             'cv_metrics': cv_metrics,
-            'cv_accuracy_mean': np.mean([m['accuracy'] for m in cv_metrics]),
-            'cv_logloss_mean': np.mean([m['log_loss'] for m in cv_metrics]),
-            'cv_ece_mean': np.mean([m['ece'] for m in cv_metrics])
+            'cv_accuracy_mean': float(np.mean([m['accuracy'] for m in cv_metrics])),
+            'cv_logloss_mean': float(np.mean([m['log_loss'] for m in cv_metrics])),
+            'cv_ece_mean': float(np.mean([m['ece'] for m in cv_metrics]))
         }
 
         logger.info(f"✅ Calibration: ECE {ece_before:.3f} → {ece_after:.3f} (improvement: {ece_before - ece_after:.3f})")
@@ -188,39 +289,79 @@ class CalibratedBettingModel:
         Expected Calibration Error (ECE)
         ECE < 0.05 = excelente calibración
         """
-        y_pred_proba = np.max(y_proba, axis=1)
+        y_pred_proba = np.max(y_proba, axis=1).astype(np.float64)
         y_pred = np.argmax(y_proba, axis=1)
 
         bins = np.linspace(0, 1, n_bins + 1)
 
-        ece = 0.0
-        total_samples = len(y_true)
+        if NUMBA_AVAILABLE:
+            return float(_ece_core(y_pred_proba, y_pred, np.asarray(y_true, dtype=y_pred.dtype), bins))
 
-        for i in range(n_bins):
-            bin_mask = (y_pred_proba > bins[i]) & (y_pred_proba <= bins[i + 1])
+        correct = (y_pred == np.asarray(y_true)).astype(np.float64)
 
-            if np.sum(bin_mask) > 0:
-                bin_acc = np.mean(y_pred[bin_mask] == y_true[bin_mask])
-                bin_conf = np.mean(y_pred_proba[bin_mask])
-                bin_weight = np.sum(bin_mask) / total_samples
+        # Bin de cada muestra (intervalos (lo, hi]) calculado una sola vez
+        bin_idx = np.clip(np.digitize(y_pred_proba, bins, right=True) - 1, 0, n_bins - 1)
 
-                ece += bin_weight * np.abs(bin_acc - bin_conf)
+        bin_counts = np.bincount(bin_idx, minlength=n_bins)
+        bin_acc_sum = np.bincount(bin_idx, weights=correct, minlength=n_bins)
+        bin_conf_sum = np.bincount(bin_idx, weights=y_pred_proba, minlength=n_bins)
 
-        return ece
+        nonempty = bin_counts > 0
+        counts = bin_counts[nonempty]
+        ece = np.sum(
+            counts / len(y_true)
+            * np.abs(bin_acc_sum[nonempty] / counts - bin_conf_sum[nonempty] / counts)
+        )
 
-    def predict_proba(self, features: pd.DataFrame) -> Dict:
-        """Predice probabilidades CALIBRADAS"""
+        return float(ece)
+
+    def predict_proba_batch(self, features: pd.DataFrame) -> pd.DataFrame:
+        """
+        Predice probabilidades CALIBRADAS para muchos partidos en una llamada
+
+        Args:
+            features: DataFrame con una fila por partido
+
+        Returns:
+            DataFrame (mismo index) con una columna de probabilidad por clase
+        """
         if self.calibrated_model is None:
             raise ValueError("Model not trained yet")
 
-        features = features[self.feature_columns]
-        probas = self.calibrated_model.predict_proba(features)[0]
+        # reindex rellenaría con NaN: columnas faltantes son un error, no "missing"
+        missing = self._feature_index.difference(features.columns)
+        if len(missing):
+            raise KeyError(f"Missing feature columns: {list(missing)}")
+
+        X = features.reindex(columns=self._feature_index).to_numpy(dtype=np.float32)
+        probas = self.calibrated_model.predict_proba(X)
+
+        return pd.DataFrame(probas, columns=list(self._classes), index=features.index)
+
+    def predict_proba_array(self, x: np.ndarray) -> Dict:
+        """
+        Predice probabilidades CALIBRADAS desde un vector de features ya armado
 
-        result = {}
-        for i, class_label in enumerate(self.label_encoder.classes_):
-            result[class_label] = float(probas[i])
+        Args:
+            x: Array (n_features,) en el orden de feature_columns
+
+        Returns:
+            Dict clase -> probabilidad
+        """
+        if self.calibrated_model is None:
+            raise ValueError("Model not trained yet")
 
-        return result
+        probas = self.calibrated_model.predict_proba(
+            np.asarray(x, dtype=np.float32).reshape(1, -1)
+        )[0]
+
+        return dict(zip(self._classes, map(float, probas)))
+
+    def predict_proba(self, features: pd.DataFrame) -> Dict:
+        """Predice probabilidades CALIBRADAS"""
+        probas = self.predict_proba_batch(features.iloc[:1]).to_numpy()[0]
+
+        return dict(zip(self._classes, map(float, probas)))
 
     def predict(self, features: pd.DataFrame) -> str:
         """Predice clase más probable"""
@@ -229,9 +370,8 @@ class CalibratedBettingModel:
 
         features = features[self.feature_columns]
         prediction_encoded = self.calibrated_model.predict(features)[0]
-        prediction = self.label_encoder.inverse_transform([prediction_encoded])[0]
 
-        return prediction
+        return self._classes[int(prediction_encoded)]
 
     def save(self, filepath: str):
         """Guarda modelo calibrado"""
@@ -246,8 +386,12 @@ class CalibratedBettingModel:
             'calibration_metrics': self.calibration_metrics
         }
 
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        # joblib escribe los arrays numpy como buffers contiguos (no byte a byte).
+        # Temporal + rename: un proceso que cargó el modelo con mmap_mode='r'
+        # sigue mapeando el archivo anterior (truncarlo en el lugar da SIGBUS)
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        joblib.dump(model_data, tmp_path, compress=MODEL_COMPRESS)
+        os.replace(tmp_path, filepath)
 
         # Guardar métricas en JSON
         metrics_path = filepath.replace('.pkl', '_metrics.json')
@@ -259,23 +403,59 @@ class CalibratedBettingModel:
         with open(metrics_path, 'w') as f:
             json.dump(metrics_to_save, f, indent=2)
 
+        # Metadata liviana (features, clases) legible sin cargar el modelo
+        meta_path = filepath.replace('.pkl', '.meta.json')
+        with open(meta_path, 'w') as f:
+            json.dump({
+                'sport': self.sport,
+                'model_type': self.model_type,
+                'feature_columns': self.feature_columns,
+                'classes': list(self._classes)
+            }, f, indent=2)
+
         logger.info(f"✅ Model saved to {filepath}")
 
     @classmethod
-    def load(cls, filepath: str):
-        """Carga modelo calibrado"""
-        with open(filepath, 'rb') as f:
-            model_data = pickle.load(f)
+    def load(cls, filepath: str, mmap_mode: Optional[str] = None):
+        """
+        Carga modelo calibrado (también lee los .pkl antiguos de pickle)
+
+        Args:
+            filepath: Ruta del .pkl
+            mmap_mode: 'r' mapea los arrays del archivo en vez de leerlos a memoria
+                       (sólo archivos sin comprimir)
+        """
+        with warnings.catch_warnings():
+            # Archivo comprimido: joblib ignora mmap_mode y avisa
+            warnings.filterwarnings('ignore', message='mmap_mode .* compressed')
+            model_data = joblib.load(filepath, mmap_mode=mmap_mode)
 
         instance = cls(model_data['sport'], model_data['model_type'])
         instance.calibrated_model = model_data['calibrated_model']
         instance.feature_columns = model_data['feature_columns']
+        instance._feature_index = pd.Index(instance.feature_columns)
         instance.label_encoder = model_data['label_encoder']
+        instance._classes = tuple(instance.label_encoder.classes_)
         instance.calibration_metrics = model_data.get('calibration_metrics', {})
 
         logger.info(f"✅ Model loaded from {filepath}")
         return instance
 
+    @staticmethod
+    def load_meta(filepath: str) -> Dict:
+        """
+        Lee sólo la metadata del modelo (sport, model_type, feature_columns,
+        classes) desde el sidecar .meta.json, sin deserializar el modelo
+
+        Args:
+            filepath: Ruta del .pkl del modelo
+
+        Returns:
+            Dict con la metadata
+        """
+        with open(filepath.replace('.pkl', '.meta.json')) as f:
+            return json.load(f)
+
 
 if __name__ == "__main__":
     # Test del modelo calibrado
@@ -6,16 +6,25 @@ Mejora accuracy y robustez mediante voting ensemble con calibración
 import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
-import pickle
+import joblib
 import json
+import copy
+import math
+import os
+import re
+import warnings
 from datetime import datetime
 from loguru import logger
 
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
-from sklearn.calibration import CalibratedClassifierCV
+from sklearn.isotonic import IsotonicRegression
 from sklearn.model_selection import TimeSeriesSplit
-from sklearn.metrics import accuracy_score, log_loss, brier_score_loss
+from sklearn.metrics import accuracy_score, log_loss
 from sklearn.preprocessing import LabelEncoder
+from sklearn.tree._tree import NODE_DTYPE, Tree
+from sklearn.utils import Bunch
 
 try:
     import xgboost as xgb
@@ -31,6 +40,265 @@ except ImportError:
     LIGHTGBM_AVAILABLE = False
     logger.warning("LightGBM not available - will use only XGBoost and RandomForest")
 
+try:
+    import treelite
+    import tl2cgen
+    TREELITE_AVAILABLE = True
+except ImportError:
+    TREELITE_AVAILABLE = False
+
+try:
+    import lz4  # noqa: F401  (compresión rápida para joblib)
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+try:
+    import onnx
+    import onnxmltools
+    import onnxruntime as ort
+    from onnxmltools.convert.common.data_types import FloatTensorType
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Máximo opset soportado por los conversores de onnxmltools
+ONNX_TARGET_OPSET = 15
+
+# lz4 descomprime mucho más rápido que zlib; sin lz4 se guarda sin comprimir
+MODEL_COMPRESS = ('lz4', 3) if LZ4_AVAILABLE else 0
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True)
+    def _calibrate_rows(probas, xs, ys, lens):
+        """Isotónico de cada clase (interpolación lineal) + renormalización en un pase"""
+        n, k = probas.shape
+        out = np.empty((n, k))
+        for i in range(n):
+            total = 0.0
+            for j in range(k):
+                # Interpolación lineal con clip a los extremos (np.interp)
+                m = lens[j]
+                x = probas[i, j]
+                if x <= xs[j, 0]:
+                    v = ys[j, 0]
+                elif x >= xs[j, m - 1]:
+                    v = ys[j, m - 1]
+                else:
+                    lo = np.searchsorted(xs[j, :m], x, side='right') - 1
+                    v = ys[j, lo] + (x - xs[j, lo]) * (ys[j, lo + 1] - ys[j, lo]) / (xs[j, lo + 1] - xs[j, lo])
+                out[i, j] = v
+                total += v
+            if total > 0:
+                for j in range(k):
+                    out[i, j] /= total
+            else:
+                # Fila con todo en 0 tras el isotónico: distribución uniforme
+                for j in range(k):
+                    out[i, j] = 1.0 / k
+        return out
+
+
+def _fit_estimator(estimator, X, y):
+    """Entrena un modelo base (función de módulo para dispatch con joblib)"""
+    return estimator.fit(X, y)
+
+
+def _soft_vote(probas_iter) -> np.ndarray:
+    """
+    Soft voting acumulando en un único buffer (N, K)
+
+    VotingClassifier apila las K probabilidades de cada modelo en un tensor
+    (n_modelos, N, K) antes de promediar; acá se suma en el lugar.
+
+    Args:
+        probas_iter: Iterable con el predict_proba de cada modelo base
+
+    Returns:
+        Promedio de las probabilidades (float64)
+    """
+    total = None
+    n_models = 0
+    for proba in probas_iter:
+        if total is None:
+            total = np.array(proba, dtype=np.float64)
+        else:
+            total += proba
+        n_models += 1
+    total /= n_models
+    return total
+
+
+def _continue_fit(estimator, X, y, tail_idx):
+    """
+    Extiende un modelo base ya entrenado con las filas de la cola
+
+    XGBoost y LightGBM (gbdt) siguen desde su booster agregando árboles en
+    proporción al tamaño de la cola; el resto se reentrena en todo X.
+
+    Args:
+        estimator: Modelo base entrenado en las filas previas a tail_idx
+        X: Features completas
+        y: Target completo (codificado)
+        tail_idx: Índices de las filas que el modelo no vio
+
+    Returns:
+        Modelo entrenado sobre todo el dataset
+    """
+    n_extra = max(1, math.ceil(estimator.n_estimators * len(tail_idx) / len(y)))
+    if XGBOOST_AVAILABLE and isinstance(estimator, xgb.XGBClassifier):
+        return clone(estimator).set_params(n_estimators=n_extra, n_jobs=-1).fit(
+            X[tail_idx], y[tail_idx], xgb_model=estimator.get_booster()
+        )
+    if LIGHTGBM_AVAILABLE and isinstance(estimator, lgb.LGBMClassifier) and estimator.boosting_type != 'rf':
+        return clone(estimator).set_params(n_estimators=n_extra, n_jobs=-1).fit(
+            X[tail_idx], y[tail_idx], init_model=estimator.booster_
+        )
+    return clone(estimator).set_params(n_jobs=-1).fit(X, y)
+
+
+def _rf_as_gbdt(booster):
+    """
+    Reescribe un booster LightGBM en modo rf como un gbdt equivalente
+
+    Los conversores ONNX suman los árboles e ignoran average_output; dividiendo
+    cada hoja por el número de iteraciones la suma es el promedio del bosque.
+
+    Args:
+        booster: lgb.Booster entrenado con boosting_type='rf'
+
+    Returns:
+        lgb.Booster con las mismas predicciones y sin average_output
+    """
+    n_iter = booster.current_iteration()
+    model_str = re.sub(
+        r'^leaf_value=(.*)$',
+        lambda m: 'leaf_value=' + ' '.join(repr(float(v) / n_iter) for v in m.group(1).split()),
+        booster.model_to_string(),
+        flags=re.M
+    )
+    # tree_sizes deja de coincidir con el texto reescrito; LightGBM lo recalcula
+    model_str = re.sub(r'^(average_output|tree_sizes=.*)\n', '', model_str, flags=re.M)
+    return lgb.Booster(model_str=model_str)
+
+
+def _pack_tree(tree) -> Dict:
+    """
+    Representación compacta (sin pérdida para predecir) de un árbol sklearn
+
+    - Índices/enteros en int32; impurity (sólo feature_importances_) en float32.
+    - Umbrales en float32 redondeados hacia abajo: sklearn compara X en float32,
+      y el mayor float32 <= umbral separa exactamente igual.
+    - Valores de hoja como conteos enteros (proporción x peso del nodo) cuando
+      la reconstrucción conteo / peso es exacta; si no, se guardan tal cual.
+
+    Args:
+        tree: sklearn.tree._tree.Tree entrenado
+
+    Returns:
+        Dict con los arrays compactos (ver _unpack_tree)
+    """
+    state = tree.__getstate__()
+    nodes = state['nodes']
+    fields = {}
+    for name in nodes.dtype.names:
+        column = nodes[name]
+        if name == 'threshold':
+            column = column.astype(np.float32)
+            above = column > nodes[name]
+            column[above] = np.nextafter(column[above], np.float32(-np.inf))
+        elif name == 'impurity':
+            column = column.astype(np.float32)
+        elif name == 'weighted_n_node_samples' and np.array_equal(column, np.rint(column)):
+            column = column.astype(np.uint32)
+        elif column.dtype.kind == 'i':
+            column = column.astype(np.int32)
+        fields[name] = column
+
+    packed = {'max_depth': state['max_depth'], 'node_count': state['node_count'], 'fields': fields}
+    weights = nodes['weighted_n_node_samples'][:, None, None]
+    counts = np.rint(state['values'] * weights)
+    if np.array_equal(counts / weights, state['values']) and counts.max() < 2 ** 32:
+        packed['counts'] = counts.astype(np.uint32)
+    else:
+        packed['values'] = state['values']
+    return packed
+
+
+def _unpack_tree(packed: Dict, estimator) -> 'Tree':
+    """Reconstruye el Tree de un DecisionTreeClassifier desde _pack_tree"""
+    tree = Tree(
+        estimator.n_features_in_,
+        np.atleast_1d(np.asarray(estimator.n_classes_, dtype=np.intp)),
+        estimator.n_outputs_
+    )
+    nodes = np.zeros(packed['node_count'], dtype=NODE_DTYPE)
+    for name, column in packed['fields'].items():
+        nodes[name] = column
+    if 'counts' in packed:
+        values = packed['counts'] / nodes['weighted_n_node_samples'][:, None, None]
+    else:
+        values = packed['values']
+    tree.__setstate__({
+        'max_depth': packed['max_depth'],
+        'node_count': packed['node_count'],
+        'nodes': nodes,
+        'values': np.ascontiguousarray(values, dtype=np.float64)
+    })
+    return tree
+
+
+def _prefit_voting(voting: VotingClassifier, fitted: list, y: np.ndarray) -> VotingClassifier:
+    """Arma un VotingClassifier con modelos base ya entrenados (sin llamar a fit)"""
+    voting.estimators_ = fitted
+    voting.named_estimators_ = Bunch(**{
+        name: est for (name, _), est in zip(voting.estimators, fitted)
+    })
+    voting.le_ = LabelEncoder().fit(y)
+    voting.classes_ = voting.le_.classes_
+    return voting
+
+
+class _NativeSoftVote(ClassifierMixin, BaseEstimator):
+    """
+    Soft voting (promedio de probabilidades) sobre los modelos base compilados
+    a código nativo con Treelite/TL2cgen; mismo contrato que VotingClassifier
+    (classes_ + predict_proba) para poder colgarlo de un calibrador de sklearn
+    """
+
+    def __init__(self, predictors: list, classes: np.ndarray):
+        self.predictors = predictors
+        self.classes = classes
+        self.classes_ = classes
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X)
+        dmatrices = {}
+
+        def _member_probas():
+            for predictor in self.predictors:
+                # Cada librería espera el tipo de umbral con el que se importó
+                dtype = predictor.threshold_type
+                if dtype not in dmatrices:
+                    dmatrices[dtype] = tl2cgen.DMatrix(np.ascontiguousarray(X, dtype=dtype))
+                proba = predictor.predict(dmatrices[dtype]).reshape(len(X), -1)
+                if proba.shape[1] == 1:
+                    # Binario: la librería devuelve sólo P(clase positiva)
+                    proba = np.column_stack([1.0 - proba[:, 0], proba[:, 0]])
+                yield proba
+
+        return _soft_vote(_member_probas())
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
 
 class EnsembleBettingModel:
     """
@@ -42,6 +310,7 @@ class EnsembleBettingModel:
     - Random Forest: Robusto, menos propenso a overfitting
     
     Usa soft voting (promedio de probabilidades) + calibración isotónica
+    por clase ajustada sobre las probabilidades out-of-fold del CV temporal
     """
     
     def __init__(self, sport: str = 'soccer'):
@@ -52,9 +321,16 @@ class EnsembleBettingModel:
         self.sport = sport
         self.label_encoder = LabelEncoder()
         self.ensemble_model = None
+        self._calibrators = None  # IsotonicRegression por clase (OOF)
+        self._calib_tables = None  # (calibradores, xs, ys, lens) para _apply_calibration
         self.base_models = {}
         self.feature_names = None
         self.metrics = {}
+        self._native_models = None  # compile_native(); no se serializa
+        self._onnx_session = None  # load_onnx(); no se serializa
+        # Posiciones de feature_names en las columnas de X (cacheadas por objeto columns)
+        self._feat_idx = None
+        self._cached_columns = None
         
     def _create_base_models(self) -> List[Tuple[str, object]]:
         """Crea los modelos base del ensemble"""
@@ -100,17 +376,33 @@ class EnsembleBettingModel:
             logger.info("✓ LightGBM agregado al ensemble")
         
         # 3. Random Forest - Robusto y menos propenso a overfitting
-        rf_model = RandomForestClassifier(
-            n_estimators=200,
-            max_depth=10,
-            min_samples_split=20,
-            min_samples_leaf=10,
-            max_features='sqrt',
-            bootstrap=True,
-            oob_score=True,
-            random_state=42,
-            n_jobs=-1
-        )
+        if LIGHTGBM_AVAILABLE:
+            # Modo bagging de LightGBM: mismos histogramas, mucho más rápido
+            # de entrenar/predecir y más liviano que el bosque de sklearn
+            rf_model = lgb.LGBMClassifier(
+                boosting_type='rf',
+                n_estimators=200,
+                max_depth=10,
+                subsample=0.8,
+                subsample_freq=1,
+                colsample_bytree=0.8,
+                min_child_samples=10,
+                random_state=42,
+                n_jobs=-1,
+                verbose=-1
+            )
+        else:
+            rf_model = RandomForestClassifier(
+                n_estimators=200,
+                max_depth=10,
+                min_samples_split=20,
+                min_samples_leaf=10,
+                max_features='sqrt',
+                bootstrap=True,
+                oob_score=True,
+                random_state=42,
+                n_jobs=-1
+            )
         estimators.append(('random_forest', rf_model))
         logger.info("✓ Random Forest agregado al ensemble")
         
@@ -139,6 +431,11 @@ class EnsembleBettingModel:
         
         # Guardar nombres de features
         self.feature_names = list(X.columns)
+        self._native_models = None
+        self._onnx_session = None
+        self._calibrators = None
+        self._feat_idx = None
+        self._cached_columns = None
         
         # Encode labels si son strings
         if y.dtype == 'object':
@@ -150,13 +447,27 @@ class EnsembleBettingModel:
         # Crear modelos base
         base_estimators = self._create_base_models()
         
+        # Presupuesto de hilos en capas: un worker por modelo base y los hilos
+        # OpenMP de cada uno repartidos entre ellos (n_jobs=-1 en ambos niveles
+        # sobresuscribe la CPU con n_modelos x n_cpus hilos)
+        n_models = len(base_estimators)
+        n_cpus = os.cpu_count() or 1
+        fit_jobs = min(n_models, n_cpus)
+        threads_per_model = max(1, n_cpus // n_models)
+        base_estimators = [
+            (name, est.set_params(n_jobs=threads_per_model)) for name, est in base_estimators
+        ]
+        
         # Crear ensemble con soft voting (promedio de probabilidades)
         self.ensemble_model = VotingClassifier(
             estimators=base_estimators,
             voting='soft',  # Usa probabilidades, no votos duros
-            n_jobs=-1
+            n_jobs=fit_jobs
         )
         
+        # Features a float32 contiguo una sola vez (folds, fit final y calibración)
+        X_np = np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+        
         # Validación temporal (TimeSeriesSplit)
         logger.info(f"Validación con TimeSeriesSplit (n_splits={n_splits})")
         tscv = TimeSeriesSplit(n_splits=n_splits)
@@ -167,44 +478,59 @@ class EnsembleBettingModel:
             'brier_score': []
         }
         
-        for fold, (train_idx, val_idx) in enumerate(tscv.split(X), 1):
-            X_train_fold, X_val_fold = X.iloc[train_idx], X.iloc[val_idx]
-            y_train_fold, y_val_fold = y_encoded[train_idx], y_encoded[val_idx]
+        # Probabilidades out-of-fold para la calibración (una columna por clase)
+        n_classes = len(np.unique(y_encoded))
+        oof_proba = []
+        oof_y = []
+        
+        # Modelos base en paralelo (un proceso por modelo, con el presupuesto de hilos)
+        fold_estimators = [est for _, est in base_estimators]
+        
+        for fold, (train_idx, val_idx) in enumerate(tscv.split(X_np), 1):
+            # TimeSeriesSplit da rangos contiguos: con slices los folds son vistas, sin copia
+            train_sl = slice(train_idx[0], train_idx[-1] + 1)
+            val_sl = slice(val_idx[0], val_idx[-1] + 1)
+            X_train_fold, X_val_fold = X_np[train_sl], X_np[val_sl]
+            y_train_fold, y_val_fold = y_encoded[train_sl], y_encoded[val_sl]
             
-            # Entrenar fold
-            self.ensemble_model.fit(X_train_fold, y_train_fold)
+            # Entrenar fold: los modelos base a la vez, sin VotingClassifier
+            fitted = Parallel(n_jobs=fit_jobs, backend='loky')(
+                delayed(_fit_estimator)(clone(est), X_train_fold, y_train_fold)
+                for est in fold_estimators
+            )
+            
+            # Predecir: soft voting = promedio de probabilidades
+            y_proba = _soft_vote(est.predict_proba(X_val_fold) for est in fitted)
+            fold_classes = np.unique(y_train_fold)
+            y_pred = fold_classes[np.argmax(y_proba, axis=1)]
             
-            # Predecir
-            y_pred = self.ensemble_model.predict(X_val_fold)
-            y_proba = self.ensemble_model.predict_proba(X_val_fold)
+            fold_oof = np.zeros((len(val_idx), n_classes))
+            fold_oof[:, fold_classes] = y_proba
+            oof_proba.append(fold_oof)
+            oof_y.append(y_val_fold)
             
             # Métricas
             acc = accuracy_score(y_val_fold, y_pred)
             ll = log_loss(y_val_fold, y_proba)
             
-            # Brier score para multiclass: promedio de brier por clase
-            if y_proba.shape[1] == 2:
-                # Binario
-                bs = brier_score_loss(y_val_fold, y_proba[:, 1])
-            else:
-                # Multiclass: calcular brier score por cada clase y promediar
-                from sklearn.preprocessing import label_binarize
-                y_bin = label_binarize(y_val_fold, classes=range(y_proba.shape[1]))
-                bs = np.mean([brier_score_loss(y_bin[:, i], y_proba[:, i]) 
-                             for i in range(y_proba.shape[1])])
+            # Brier score: promedio de brier por clase (en binario coincide con
+            # el de la clase positiva) contra el one-hot del target
+            one_hot = np.zeros_like(fold_oof)
+            one_hot[np.arange(len(y_val_fold)), y_val_fold] = 1.0
+            bs = float(np.mean((fold_oof - one_hot) ** 2))
             
-            cv_scores['accuracy'].append(acc)
-            cv_scores['log_loss'].append(ll)
+            cv_scores['accuracy'].append(float(acc))
+            cv_scores['log_loss'].append(float(ll))
             cv_scores['brier_score'].append(bs)
             
             logger.info(f"Fold {fold}/{n_splits} - Acc: {acc:.3f}, LogLoss: {ll:.3f}, Brier: {bs:.3f}")
         
         # Métricas promedio
         metrics_avg = {
-            'cv_accuracy': np.mean(cv_scores['accuracy']),
-            'cv_accuracy_std': np.std(cv_scores['accuracy']),
-            'cv_log_loss': np.mean(cv_scores['log_loss']),
-            'cv_brier_score': np.mean(cv_scores['brier_score']),
+            'cv_accuracy': float(np.mean(cv_scores['accuracy'])),
+            'cv_accuracy_std': float(np.std(cv_scores['accuracy'])),
+            'cv_log_loss': float(np.mean(cv_scores['log_loss'])),
+            'cv_brier_score': float(np.mean(cv_scores['brier_score'])),
             'n_folds': n_splits,
             'n_samples': len(X),
             'n_features': X.shape[1]
@@ -217,28 +543,43 @@ class EnsembleBettingModel:
         logger.info(f"  Brier Score:  {metrics_avg['cv_brier_score']:.3f}")
         logger.info(f"{'='*60}\n")
         
-        # Entrenar modelo final en todo el dataset
-        logger.info("Entrenando modelo final en dataset completo...")
-        self.ensemble_model.fit(X, y_encoded)
+        # Modelo final: el último fold ya entrenó todo salvo su validación, así
+        # que se continúa desde esos modelos con la cola en vez de reentrenar
+        all_classes = np.arange(n_classes)
+        if (np.array_equal(np.unique(y_encoded[train_idx]), all_classes)
+                and np.array_equal(np.unique(y_encoded[val_idx]), all_classes)):
+            logger.info("Entrenando modelo final (continuando modelos del último fold)...")
+            final_estimators = [
+                _continue_fit(est, X_np, y_encoded, val_idx) for est in fitted
+            ]
+            self.ensemble_model = _prefit_voting(self.ensemble_model, final_estimators, y_encoded)
+        else:
+            logger.info("Entrenando modelo final en dataset completo...")
+            self.ensemble_model.fit(X_np, y_encoded)
         
         # Calibración (opcional pero RECOMENDADO para betting)
         if calibrate:
-            logger.info("Aplicando calibración isotónica con más folds...")
+            logger.info("Aplicando calibración isotónica sobre probabilidades out-of-fold...")
 
-            # Calibrar el ensemble completo con más folds para mejor calibración
-            self.ensemble_model = CalibratedClassifierCV(
-                self.ensemble_model,
-                method='isotonic',
-                cv=5,  # Usar 5-fold CV para mejor calibración (antes era 3)
-                n_jobs=-1
-            )
-            self.ensemble_model.fit(X, y_encoded)
+            # Un isotónico por clase sobre las probabilidades OOF del CV temporal:
+            # sin reentrenar el ensemble por cada fold de calibración
+            n_holdout = len(oof_y[-1])
+            oof_proba = np.concatenate(oof_proba)
+            oof_y = np.concatenate(oof_y)
             
-            # Evaluar calibración
-            y_proba_calib = self.ensemble_model.predict_proba(X)
+            # Evaluar calibración fuera de muestra también para los isotónicos:
+            # se ajustan con los folds anteriores y se mide ECE sobre el bloque
+            # OOF del último fold (no hace falta otra pasada de predict_proba)
+            self._calibrators = self._fit_calibrators(
+                oof_proba[:-n_holdout], oof_y[:-n_holdout], n_classes
+            )
+            y_proba_calib = self._apply_calibration(oof_proba[-n_holdout:])
             
             # Expected Calibration Error (ECE)
-            ece = self._calculate_ece(y_encoded, y_proba_calib)
+            ece = self._calculate_ece(oof_y[-n_holdout:], y_proba_calib)
+            
+            # Isotónicos finales: todas las probabilidades OOF
+            self._calibrators = self._fit_calibrators(oof_proba, oof_y, n_classes)
             
             metrics_avg['ece_after_calibration'] = ece
             metrics_avg['calibrated'] = True
@@ -266,20 +607,17 @@ class EnsembleBettingModel:
             y_pred_proba = y_proba.max(axis=1)
             y_pred_class = y_proba.argmax(axis=1)
             
-            # Crear bins de confianza
+            correct = (y_true == y_pred_class).astype(np.float64)
+            
+            # Crear bins de confianza ([lo, hi); confianza 1.0 cae fuera, como antes)
             bins = np.linspace(0, 1, n_bins + 1)
             bin_indices = np.digitize(y_pred_proba, bins) - 1
             
-            ece = 0.0
-            for i in range(n_bins):
-                mask = bin_indices == i
-                if mask.sum() > 0:
-                    bin_accuracy = (y_true[mask] == y_pred_class[mask]).mean()
-                    bin_confidence = y_pred_proba[mask].mean()
-                    bin_weight = mask.sum() / len(y_true)
-                    ece += bin_weight * abs(bin_accuracy - bin_confidence)
+            # Sumas por bin en una pasada: |acc - conf| ponderado = |suma_acc - suma_conf| / N
+            acc_sum = np.bincount(bin_indices, weights=correct, minlength=n_bins + 1)[:n_bins]
+            conf_sum = np.bincount(bin_indices, weights=y_pred_proba, minlength=n_bins + 1)[:n_bins]
             
-            return ece
+            return float(np.sum(np.abs(acc_sum - conf_sum)) / len(y_true))
         except Exception as e:
             logger.warning(f"Error calculando ECE: {e}")
             return 0.0
@@ -297,62 +635,433 @@ class EnsembleBettingModel:
         if self.ensemble_model is None:
             raise ValueError("Modelo no entrenado. Llama a train() primero.")
         
-        # Asegurar que tenga las features correctas
-        if self.feature_names:
-            missing = set(self.feature_names) - set(X.columns)
-            if missing:
-                raise ValueError(f"Features faltantes: {missing}")
-            X = X[self.feature_names]
-        
         # Predecir probabilidades
-        probabilities = self.ensemble_model.predict_proba(X)
+        probabilities = self._predict_proba_array(self._feature_array(X))
         
-        # Convertir a dict(s)
+        # Convertir a dict(s): cada columna con el nombre de su clase.
+        # tolist() pasa toda la matriz a floats de Python en una sola llamada
+        class_names = self._class_names()
+        rows = probabilities.tolist()
         if len(X) == 1:
             # Un solo match
-            if self.sport == 'soccer':
-                return {
-                    'home_win': float(probabilities[0][0]),
-                    'draw': float(probabilities[0][1]),
-                    'away_win': float(probabilities[0][2])
-                }
-            else:  # NBA (sin empate)
-                return {
-                    'home_win': float(probabilities[0][0]),
-                    'away_win': float(probabilities[0][1])
-                }
+            return dict(zip(class_names, rows[0]))
         else:
             # Múltiples matches
-            results = []
-            for probs in probabilities:
-                if self.sport == 'soccer':
-                    results.append({
-                        'home_win': float(probs[0]),
-                        'draw': float(probs[1]),
-                        'away_win': float(probs[2])
-                    })
-                else:
-                    results.append({
-                        'home_win': float(probs[0]),
-                        'away_win': float(probs[1])
-                    })
-            return results
+            return [dict(zip(class_names, probs)) for probs in rows]
+    
+    def predict_proba_batch(self, X: pd.DataFrame) -> pd.DataFrame:
+        """
+        Predice probabilidades calibradas para muchos matches en una llamada
+        
+        Args:
+            X: Features (DataFrame con una fila por match)
+            
+        Returns:
+            DataFrame (mismo index) con una columna de probabilidad por outcome
+        """
+        if self.ensemble_model is None:
+            raise ValueError("Modelo no entrenado. Llama a train() primero.")
+        
+        probabilities = self._predict_proba_array(self._feature_array(X))
+        
+        return pd.DataFrame(probabilities, columns=self._class_names(), index=X.index)
+    
+    def predict_proba_array(self, x: np.ndarray) -> Dict:
+        """
+        Predice probabilidades desde un vector de features ya armado
+
+        Args:
+            x: Array (n_features,) en el orden de feature_names
+
+        Returns:
+            Dict outcome -> probabilidad
+        """
+        if self.ensemble_model is None:
+            raise ValueError("Modelo no entrenado. Llama a train() primero.")
+        
+        probabilities = self._predict_proba_array(
+            np.asarray(x, dtype=np.float32).reshape(1, -1)
+        )
+        
+        return dict(zip(self._class_names(), probabilities[0].tolist()))
     
-    def predict(self, X: pd.DataFrame) -> str:
+    def _class_names(self) -> List[str]:
+        """Outcome de cada columna de probabilidad (orden de classes_)"""
+        if hasattr(self.label_encoder, 'classes_'):
+            return self.label_encoder.inverse_transform(self.ensemble_model.classes_).tolist()
+        # Labels no codificados: convención home/draw/away
+        if self.sport == 'soccer':
+            return ['home_win', 'draw', 'away_win']
+        return ['home_win', 'away_win']  # NBA (sin empate)
+    
+    def predict(self, X: pd.DataFrame, probas: Optional[np.ndarray] = None) -> str:
         """Predice el outcome más probable"""
+        return self.predict_batch(X, probas)[0]
+    
+    def predict_batch(self, X: pd.DataFrame, probas: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Predice el outcome más probable para cada fila de X
+
+        Args:
+            X: Features (DataFrame)
+            probas: Probabilidades (N, K) ya calculadas para X; evita otra pasada del ensemble
+
+        Returns:
+            Array con el outcome de cada fila
+        """
         if self.ensemble_model is None:
             raise ValueError("Modelo no entrenado.")
         
-        if self.feature_names:
-            X = X[self.feature_names]
+        if probas is None:
+            probas = self._predict_proba_array(self._feature_array(X))
         
-        prediction = self.ensemble_model.predict(X)
+        # Soft voting (calibrado o no): clase de mayor probabilidad
+        classes = self.ensemble_model.classes_
+        prediction = classes[np.argmax(probas, axis=1)]
         
         # Decode label
         if hasattr(self.label_encoder, 'classes_'):
-            return self.label_encoder.inverse_transform(prediction)[0]
+            return self.label_encoder.inverse_transform(prediction)
+        else:
+            return prediction
+    
+    def _feature_array(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        Matriz de features en el orden de feature_names sin reindexar el DataFrame
+
+        Las posiciones de columna (y la validación de faltantes) se calculan una
+        vez por objeto columns distinto; si X ya viene en el orden del
+        entrenamiento no se hace ninguna selección.
+        """
+        X_arr = X.to_numpy()
+        if not self.feature_names:
+            return X_arr
+        
+        columns = X.columns
+        if columns is not self._cached_columns and not columns.equals(self._cached_columns):
+            missing = set(self.feature_names) - set(columns)
+            if missing:
+                raise ValueError(f"Features faltantes: {missing}")
+            feat_idx = columns.get_indexer(self.feature_names)
+            identity = len(columns) == len(feat_idx) and np.array_equal(feat_idx, np.arange(len(feat_idx)))
+            self._feat_idx = None if identity else feat_idx
+        self._cached_columns = columns
+        
+        return X_arr if self._feat_idx is None else X_arr[:, self._feat_idx]
+    
+    def _predict_proba_array(self, X_np: np.ndarray) -> np.ndarray:
+        """Probabilidades (N, K): librerías nativas si están compiladas, si no sklearn"""
+        if self._onnx_session is not None and not self._native_models:
+            probas = self._onnx_session.run(
+                ['probabilities'], {'input': X_np.astype(np.float32, copy=False)}
+            )[0].astype(np.float64)
+        elif not self._native_models:
+            X_np = X_np.astype(np.float32, copy=False)
+            if isinstance(self.ensemble_model, VotingClassifier):
+                probas = _soft_vote(est.predict_proba(X_np) for est in self.ensemble_model.estimators_)
+            else:
+                probas = self.ensemble_model.predict_proba(X_np)
         else:
-            return prediction[0]
+            # Igual que CalibratedClassifierCV: promedio de los calibradores por fold
+            probas = np.zeros((len(X_np), len(self.ensemble_model.classes_)))
+            for model in self._native_models:
+                probas += model.predict_proba(X_np)
+            probas /= len(self._native_models)
+        
+        if self._calibrators:
+            probas = self._apply_calibration(probas)
+        return probas
+    
+    @staticmethod
+    def _fit_calibrators(probas: np.ndarray, y: np.ndarray, n_classes: int) -> List:
+        """
+        Ajusta un IsotonicRegression por clase (sólo la positiva en binario)
+        
+        Args:
+            probas: Probabilidades OOF del soft voting (N, K)
+            y: Target codificado (N,)
+            n_classes: Número de clases
+            
+        Returns:
+            Lista de IsotonicRegression, en el orden de las columnas
+        """
+        calib_columns = [1] if n_classes == 2 else range(n_classes)
+        return [
+            IsotonicRegression(out_of_bounds='clip').fit(
+                probas[:, k], (y == k).astype(np.float64)
+            )
+            for k in calib_columns
+        ]
+    
+    def _apply_calibration(self, probas: np.ndarray) -> np.ndarray:
+        """
+        Aplica los isotónicos por clase y renormaliza cada fila a 1
+
+        Args:
+            probas: Probabilidades del soft voting (N, K)
+
+        Returns:
+            Probabilidades calibradas (N, K)
+        """
+        # IsotonicRegression(out_of_bounds='clip').predict es una interpolación
+        # lineal entre sus umbrales: np.interp sin la validación de sklearn
+        if len(self._calibrators) == 1:
+            # Binario: se calibra sólo la clase positiva
+            calibrator = self._calibrators[0]
+            positive = np.interp(probas[:, 1], calibrator.X_thresholds_, calibrator.y_thresholds_)
+            return np.column_stack([1.0 - positive, positive])
+        
+        if NUMBA_AVAILABLE:
+            xs, ys, lens = self._calibration_tables()
+            return _calibrate_rows(np.ascontiguousarray(probas, dtype=np.float64), xs, ys, lens)
+        
+        calibrated = np.column_stack([
+            np.interp(probas[:, k], calibrator.X_thresholds_, calibrator.y_thresholds_)
+            for k, calibrator in enumerate(self._calibrators)
+        ])
+        total = calibrated.sum(axis=1, keepdims=True)
+        # Filas con todo en 0 tras el isotónico: distribución uniforme
+        return np.divide(calibrated, total,
+                         out=np.full_like(calibrated, 1.0 / calibrated.shape[1]),
+                         where=total > 0)
+    
+    def _calibration_tables(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Umbrales de los isotónicos en arrays (K, M) con padding, armados una vez"""
+        if self._calib_tables is None or self._calib_tables[0] is not self._calibrators:
+            lens = np.array([len(c.X_thresholds_) for c in self._calibrators], dtype=np.int64)
+            xs = np.zeros((len(self._calibrators), lens.max()))
+            ys = np.zeros_like(xs)
+            for k, calibrator in enumerate(self._calibrators):
+                xs[k, :lens[k]] = calibrator.X_thresholds_
+                ys[k, :lens[k]] = calibrator.y_thresholds_
+            self._calib_tables = (self._calibrators, xs, ys, lens)
+        return self._calib_tables[1:]
+    
+    @staticmethod
+    def _to_treelite(estimator):
+        """Importa un modelo base entrenado a Treelite"""
+        if XGBOOST_AVAILABLE and isinstance(estimator, xgb.XGBClassifier):
+            return treelite.frontend.from_xgboost(estimator.get_booster())
+        if LIGHTGBM_AVAILABLE and isinstance(estimator, lgb.LGBMClassifier):
+            return treelite.frontend.from_lightgbm(estimator.booster_)
+        return treelite.sklearn.import_model(estimator)
+    
+    def compile_native(self, libdir: str = 'models/native', tag: Optional[str] = None,
+                       build: bool = True) -> bool:
+        """
+        Compila los árboles de cada modelo base a librerías nativas (Treelite)
+        para inferencia sin el dispatch Python de VotingClassifier
+
+        Los isotónicos por clase se siguen aplicando sobre las probabilidades
+        nativas. En modelos guardados con CalibratedClassifierCV se compilan
+        los modelos base de cada fold y se mantienen sus calibradores.
+
+        Cada librería se compila a un archivo temporal y se mueve con
+        os.replace, así otro proceso nunca hace dlopen de un .so a medio
+        escribir. Tras cargar, se borran las librerías del deporte con otro
+        tag (entrenamientos anteriores).
+
+        Args:
+            libdir: Directorio donde se escriben las librerías (.so)
+            tag: Identificador estable del modelo (ej. mtime del .pkl); con tag
+                 las librerías ya compiladas con el mismo nombre se reutilizan
+            build: Si False, sólo carga librerías ya compiladas (nunca invoca gcc)
+
+        Returns:
+            True si quedó cargado; False si Treelite/TL2cgen no están instalados
+            o (build=False) faltan librerías
+        """
+        if self.ensemble_model is None:
+            raise ValueError("Modelo no entrenado. Llama a train() primero.")
+        
+        if not TREELITE_AVAILABLE:
+            logger.warning("Treelite/TL2cgen not available - using sklearn inference")
+            return False
+        
+        # Modelos guardados por versiones anteriores (CalibratedClassifierCV)
+        calibrated = hasattr(self.ensemble_model, 'calibrated_classifiers_')
+        if calibrated:
+            voting_models = [c.estimator for c in self.ensemble_model.calibrated_classifiers_]
+        else:
+            voting_models = [self.ensemble_model]
+        
+        # Nombre único por compilación: dlopen reutiliza una librería ya cargada
+        # con la misma ruta aunque el archivo se haya reescrito
+        build_tag = tag or datetime.now().strftime('%Y%m%d%H%M%S%f')
+        prefix = f"{self.sport}_ensemble_{build_tag}_"
+        libpaths = [
+            [os.path.join(libdir, f"{prefix}{i}_{name}.so") for name in voting.named_estimators_]
+            for i, voting in enumerate(voting_models)
+        ]
+        
+        if not build and not all(os.path.exists(path) for paths in libpaths for path in paths):
+            logger.debug(f"No hay librerías nativas precompiladas para {prefix}* en {libdir}")
+            return False
+        
+        os.makedirs(libdir, exist_ok=True)
+        
+        native_models = []
+        for i, voting in enumerate(voting_models):
+            predictors = []
+            for libpath, estimator in zip(libpaths[i], voting.named_estimators_.values()):
+                if tag is None or not os.path.exists(libpath):
+                    tmp_path = f"{libpath[:-3]}.{os.getpid()}.tmp.so"
+                    tl2cgen.export_lib(
+                        self._to_treelite(estimator),
+                        toolchain='gcc',
+                        libpath=tmp_path,
+                        params={'parallel_comp': 32}
+                    )
+                    os.replace(tmp_path, libpath)
+                predictors.append(tl2cgen.Predictor(libpath))
+            
+            native_voting = _NativeSoftVote(predictors, voting.classes_)
+            if calibrated:
+                # Copia del calibrador del fold apuntando al voting nativo
+                native_calibrated = copy.copy(self.ensemble_model.calibrated_classifiers_[i])
+                native_calibrated.estimator = native_voting
+                native_models.append(native_calibrated)
+            else:
+                native_models.append(native_voting)
+        
+        self._native_models = native_models
+        self._remove_stale_native(libdir, prefix)
+        logger.info(f"✓ Ensemble compilado a código nativo ({len(native_models)} modelo(s)) en {libdir}")
+        return True
+    
+    def _remove_stale_native(self, libdir: str, prefix: str):
+        """Borra las librerías nativas del deporte que no son del tag actual"""
+        sport_prefix = f"{self.sport}_ensemble_"
+        for entry in os.scandir(libdir):
+            if (entry.name.startswith(sport_prefix) and entry.name.endswith('.so')
+                    and not entry.name.startswith(prefix)):
+                try:
+                    # Un proceso que ya hizo dlopen conserva su copia (inode)
+                    os.remove(entry.path)
+                except OSError as e:
+                    logger.debug(f"No se pudo borrar {entry.path}: {e}")
+    
+    def attach_native(self, model_path: str, build: bool = True) -> bool:
+        """
+        Librerías nativas del modelo guardado en model_path
+
+        Se guardan en <dir del .pkl>/native con el mtime del .pkl como tag:
+        un reentrenamiento genera nombres nuevos y el entrenamiento offline
+        (build=True) y el predictor (build=False) resuelven las mismas rutas.
+
+        Args:
+            model_path: Ruta del .pkl del ensemble
+            build: Compilar las librerías que falten (si False, sólo cargar)
+
+        Returns:
+            True si quedó cargado el motor nativo
+        """
+        libdir = os.path.join(os.path.dirname(model_path) or '.', 'native')
+        tag = str(int(os.path.getmtime(model_path)))
+        return self.compile_native(libdir, tag=tag, build=build)
+    
+    @staticmethod
+    def _to_onnx(estimator, n_features: int):
+        """Convierte un modelo base entrenado a ONNX (salidas label y probabilities)"""
+        initial_types = [('input', FloatTensorType([None, n_features]))]
+        if XGBOOST_AVAILABLE and isinstance(estimator, xgb.XGBClassifier):
+            # El conversor deduce las clases con n_estimators: tras continuar el
+            # entrenamiento (_continue_fit) el booster tiene más rondas que el parámetro
+            estimator = copy.copy(estimator)
+            estimator.n_estimators = estimator.get_booster().num_boosted_rounds()
+            return onnxmltools.convert_xgboost(
+                estimator, initial_types=initial_types, target_opset=ONNX_TARGET_OPSET
+            )
+        if LIGHTGBM_AVAILABLE and isinstance(estimator, lgb.LGBMClassifier):
+            booster = estimator.booster_
+            if estimator.boosting_type == 'rf':
+                booster = _rf_as_gbdt(booster)
+            return onnxmltools.convert_lightgbm(
+                booster, initial_types=initial_types, zipmap=False, target_opset=ONNX_TARGET_OPSET
+            )
+        from skl2onnx import to_onnx
+        return to_onnx(estimator, initial_types=initial_types,
+                       options={'zipmap': False}, target_opset=ONNX_TARGET_OPSET)
+    
+    def export_onnx(self, filepath: str) -> bool:
+        """
+        Exporta el soft voting a un único grafo ONNX para servir con ONNX Runtime
+
+        Cada modelo base se convierte por separado y sus probabilidades se
+        promedian con un nodo Mean. Los isotónicos por clase no van en el
+        grafo: se siguen aplicando sobre la salida de la sesión.
+
+        Args:
+            filepath: Ruta del .onnx (convención: junto al .pkl)
+
+        Returns:
+            True si se exportó; False si faltan onnxmltools/onnxruntime o el
+            modelo es un CalibratedClassifierCV guardado por versiones anteriores
+        """
+        if self.ensemble_model is None:
+            raise ValueError("Modelo no entrenado. Llama a train() primero.")
+        
+        if not ONNX_AVAILABLE:
+            logger.warning("onnxmltools/onnxruntime not available - ONNX export skipped")
+            return False
+        
+        if not isinstance(self.ensemble_model, VotingClassifier):
+            logger.warning("Export ONNX requiere el VotingClassifier: re-entrenar el modelo")
+            return False
+        
+        n_features = len(self.feature_names)
+        nodes, initializers, member_probas, opsets = [], [], [], {'': ONNX_TARGET_OPSET}
+        ir_version = 0
+        for name, estimator in self.ensemble_model.named_estimators_.items():
+            member = onnx.compose.add_prefix(
+                self._to_onnx(estimator, n_features), prefix=f"{name}_", rename_inputs=False
+            )
+            nodes.extend(member.graph.node)
+            initializers.extend(member.graph.initializer)
+            member_probas.append(member.graph.output[1].name)
+            ir_version = max(ir_version, member.ir_version)
+            for opset in member.opset_import:
+                opsets[opset.domain] = max(opset.version, opsets.get(opset.domain, 0))
+        
+        # Soft voting: promedio de las probabilidades de los modelos base
+        nodes.append(onnx.helper.make_node('Mean', member_probas, ['probabilities']))
+        graph = onnx.helper.make_graph(
+            nodes,
+            f"{self.sport}_ensemble",
+            inputs=[onnx.helper.make_tensor_value_info(
+                'input', onnx.TensorProto.FLOAT, [None, n_features])],
+            outputs=[onnx.helper.make_tensor_value_info(
+                'probabilities', onnx.TensorProto.FLOAT, [None, len(self.ensemble_model.classes_)])],
+            initializer=initializers
+        )
+        model = onnx.helper.make_model(
+            graph, opset_imports=[onnx.helper.make_opsetid(d, v) for d, v in opsets.items()]
+        )
+        # IR de los conversores (el de make_model puede ser más nuevo que el runtime)
+        model.ir_version = ir_version
+        
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        onnx.save(model, filepath)
+        logger.info(f"✓ Ensemble exportado a ONNX: {filepath}")
+        return True
+    
+    def load_onnx(self, filepath: str) -> bool:
+        """
+        Usa una sesión de ONNX Runtime para las probabilidades (ver export_onnx)
+
+        Args:
+            filepath: Ruta del .onnx exportado
+
+        Returns:
+            True si se cargó la sesión; False si onnxruntime no está instalado
+        """
+        if not ONNX_AVAILABLE:
+            logger.warning("onnxruntime not available - using sklearn inference")
+            return False
+        
+        self._onnx_session = ort.InferenceSession(filepath, providers=['CPUExecutionProvider'])
+        logger.info(f"✓ Sesión ONNX Runtime cargada: {filepath}")
+        return True
     
     def get_feature_importance(self, method: str = 'mean') -> pd.DataFrame:
         """
@@ -389,18 +1098,64 @@ class EnsembleBettingModel:
         
         return df_importance.sort_values('importance', ascending=False)
     
+    def _packed_forest(self) -> Tuple[object, Optional[Dict]]:
+        """
+        Ensemble a persistir con el Random Forest sklearn (fallback sin
+        LightGBM) en representación compacta
+
+        No modifica el modelo en memoria: se guardan copias superficiales del
+        VotingClassifier y del bosque sin los Tree, y los árboles empaquetados aparte.
+
+        Returns:
+            Tupla (ensemble a serializar, dict con los árboles o None)
+        """
+        voting = self.ensemble_model
+        if not isinstance(voting, VotingClassifier):
+            return voting, None
+        
+        forest_idx = next(
+            (i for i, est in enumerate(voting.estimators_) if isinstance(est, RandomForestClassifier)),
+            None
+        )
+        if forest_idx is None:
+            return voting, None
+        
+        forest = voting.estimators_[forest_idx]
+        trees = [_pack_tree(est.tree_) for est in forest.estimators_]
+        
+        forest_copy = copy.copy(forest)
+        forest_copy.estimators_ = []
+        for est in forest.estimators_:
+            est_copy = copy.copy(est)
+            del est_copy.tree_
+            forest_copy.estimators_.append(est_copy)
+        
+        voting_copy = copy.copy(voting)
+        voting_copy.estimators_ = list(voting.estimators_)
+        voting_copy.estimators_[forest_idx] = forest_copy
+        voting_copy.named_estimators_ = Bunch(**dict(zip(voting.named_estimators_, voting_copy.estimators_)))
+        
+        return voting_copy, {'index': forest_idx, 'trees': trees}
+    
     def save(self, filepath: str):
         """Guarda el modelo entrenado"""
+        ensemble_model, packed_forest = self._packed_forest()
         model_data = {
-            'ensemble_model': self.ensemble_model,
+            'ensemble_model': ensemble_model,
+            'packed_forest': packed_forest,
+            'calibrators': self._calibrators,
             'label_encoder': self.label_encoder,
             'feature_names': self.feature_names,
             'metrics': self.metrics,
             'sport': self.sport
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        # joblib escribe los arrays numpy como buffers contiguos (no byte a byte).
+        # Temporal + rename: un proceso que cargó el modelo con mmap_mode='r'
+        # sigue mapeando el archivo anterior (truncarlo en el lugar da SIGBUS)
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        joblib.dump(model_data, tmp_path, compress=MODEL_COMPRESS)
+        os.replace(tmp_path, filepath)
         
         # Guardar métricas también en JSON
         metrics_path = filepath.replace('.pkl', '_metrics.json')
@@ -411,13 +1166,30 @@ class EnsembleBettingModel:
         logger.info(f"✓ Métricas guardadas: {metrics_path}")
     
     @classmethod
-    def load(cls, filepath: str) -> 'EnsembleBettingModel':
-        """Carga un modelo guardado"""
-        with open(filepath, 'rb') as f:
-            model_data = pickle.load(f)
+    def load(cls, filepath: str, mmap_mode: Optional[str] = None) -> 'EnsembleBettingModel':
+        """
+        Carga un modelo guardado
+
+        Args:
+            filepath: Ruta del .pkl
+            mmap_mode: 'r' mapea los arrays del archivo en vez de leerlos a memoria
+                       (páginas compartidas entre workers). Sólo aplica a archivos
+                       sin comprimir; con lz4 se carga normal.
+        """
+        with warnings.catch_warnings():
+            # Archivo comprimido: joblib ignora mmap_mode y avisa
+            warnings.filterwarnings('ignore', message='mmap_mode .* compressed')
+            model_data = joblib.load(filepath, mmap_mode=mmap_mode)
         
         instance = cls(sport=model_data.get('sport', 'soccer'))
         instance.ensemble_model = model_data['ensemble_model']
+        instance._calibrators = model_data.get('calibrators')
+        
+        packed_forest = model_data.get('packed_forest')
+        if packed_forest:
+            forest = instance.ensemble_model.estimators_[packed_forest['index']]
+            for est, packed in zip(forest.estimators_, packed_forest['trees']):
+                est.tree_ = _unpack_tree(packed, est)
         instance.label_encoder = model_data['label_encoder']
         instance.feature_names = model_data['feature_names']
         instance.metrics = model_data['metrics']
@@ -3,16 +3,159 @@ Predictor - Usa modelos entrenados para predecir resultados de partidos
 Actualizado para usar EnsembleModel o CalibratedBettingModel con features avanzadas
 """
 
+import numpy as np
 import pandas as pd
 from typing import Dict, Optional, List
 from loguru import logger
-from src.models.ensemble_model import EnsembleBettingModel
-from src.models.calibrated_model_simple import CalibratedBettingModel
-from src.models.train_model import BettingModel  # Fallback para NBA
+from joblib import Parallel, delayed
 from src.data.feature_integration import calculate_match_features_advanced
 from src.utils.database import BettingDatabase
 import os
 import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from collections import OrderedDict
+from operator import itemgetter
+
+# Cache de features por partido: ventana de validez (s) y máximo de entradas
+FEATURES_CACHE_TTL = 900
+FEATURES_CACHE_MAX = 4096
+
+# Modelos ensemble/calibrados se mapean en memoria (read-only): los workers que
+# cargan el mismo .pkl comparten páginas. Requiere guardarlos sin comprimir
+# (MODEL_COMPRESS = 0, el default sin lz4); los comprimidos se cargan normal.
+MODEL_MMAP_MODE = 'r'
+
+# Threads para calcular features en predict_multiple_matches (I/O de SQLite;
+# cada thread usa su propia conexión, ver BettingDatabase.conn)
+FEATURE_WORKERS = 8
+
+# Elección del auto-select persistida entre procesos: si los .pkl candidatos y
+# sus métricas no cambiaron (mismos mtimes), se carga el ganador sin re-puntuar
+MODEL_CHOICE_FILE = 'models/.predictor_choice.json'
+
+
+def _load_legacy_model(filepath: str):
+    """
+    Carga un BettingModel legacy (fallback para NBA)
+
+    El import es diferido: train_model arrastra todo el stack de entrenamiento
+    de sklearn y no hace falta si no hay modelos legacy en disco.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
+    from src.models.train_model import BettingModel
+    return BettingModel.load(filepath)
+
+
+def _make_row_getter(expected_cols: List[str]):
+    """
+    Función features_dict -> tupla de valores en el orden de expected_cols
+
+    itemgetter resuelve todas las claves en una sola llamada en C; si falta
+    alguna feature se completa con 0.0 desde un dict de defaults.
+    """
+    getter = itemgetter(*expected_cols)
+    defaults = dict.fromkeys(expected_cols, 0.0)
+    single = len(expected_cols) == 1
+
+    def get_row(features_dict: Dict) -> tuple:
+        try:
+            row = getter(features_dict)
+        except KeyError:
+            row = getter({**defaults, **features_dict})
+        return (row,) if single else row
+
+    return get_row
+
+
+def _load_ensemble_model(filepath: str):
+    """Carga un EnsembleBettingModel (import diferido: xgboost, lightgbm, onnx, treelite)"""
+    from src.models.ensemble_model import EnsembleBettingModel
+    return EnsembleBettingModel.load(filepath, mmap_mode=MODEL_MMAP_MODE)
+
+
+def _load_calibrated_model(filepath: str):
+    """Carga un CalibratedBettingModel (import diferido)"""
+    from src.models.calibrated_model_simple import CalibratedBettingModel
+    return CalibratedBettingModel.load(filepath, mmap_mode=MODEL_MMAP_MODE)
+
+
+# Modelos y métricas JSON ya leídos en este proceso: ruta -> (mtime, objeto)
+_MODEL_CACHE: Dict[str, tuple] = {}
+_METRICS_CACHE: Dict[str, tuple] = {}
+
+
+def _cached_by_mtime(cache: Dict[str, tuple], loader, path: str, mtime: Optional[float] = None):
+    """
+    Devuelve loader(path), reutilizando el resultado mientras el archivo no cambie
+
+    Re-instanciar MatchPredictor en el mismo proceso (app, tests, notebooks)
+    no vuelve a leer los archivos; un reentrenamiento cambia el mtime y
+    fuerza la recarga. FileNotFoundError se propaga igual que con loader.
+
+    Args:
+        cache: _MODEL_CACHE o _METRICS_CACHE
+        loader: Función que lee el archivo
+        path: Ruta del archivo
+        mtime: mtime ya conocido (ej. de un os.DirEntry); None = os.path.getmtime
+    """
+    key = os.path.abspath(path)
+    if mtime is None:
+        mtime = os.path.getmtime(path)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    value = loader(path)
+    cache[key] = (mtime, value)
+    return value
+
+
+def _cached_load(loader, path: str, mtime: Optional[float] = None):
+    """Carga un modelo con loader, cacheado por ruta + mtime"""
+    return _cached_by_mtime(_MODEL_CACHE, loader, path, mtime)
+
+
+def _read_json(path: str) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_model_choice(fingerprint: Dict[str, float], use_ensemble: bool) -> Optional[Dict]:
+    """
+    Lee la elección persistida del auto-select
+
+    Args:
+        fingerprint: Archivo de models/ -> mtime de los candidatos actuales
+        use_ensemble: Si el ensemble participa de la selección
+
+    Returns:
+        Dict con 'winner' y 'metrics', o None si no existe o quedó desactualizada
+    """
+    try:
+        choice = _read_json(MODEL_CHOICE_FILE)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(choice, dict)
+            or choice.get('paths_mtimes') != fingerprint
+            or choice.get('use_ensemble') != use_ensemble):
+        return None
+    return choice
+
+
+def _write_model_choice(fingerprint: Dict[str, float], use_ensemble: bool,
+                        winner: str, metrics: Dict) -> None:
+    """Persiste la elección del auto-select (write + rename atómico)"""
+    tmp_path = f"{MODEL_CHOICE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'paths_mtimes': fingerprint, 'use_ensemble': use_ensemble,
+                       'winner': winner, 'metrics': metrics}, f)
+        os.replace(tmp_path, MODEL_CHOICE_FILE)
+    except OSError as e:
+        logger.debug("No se pudo guardar {}: {}", MODEL_CHOICE_FILE, e)
 
 
 class MatchPredictor:
@@ -22,7 +165,8 @@ class MatchPredictor:
                  soccer_model_path: Optional[str] = None,
                  nba_model_path: str = "models/nba_model.pkl",
                  use_ensemble: bool = True,
-                 auto_select_best: bool = True):
+                 auto_select_best: bool = True,
+                 use_native: bool = False):
         """Inicializa el predictor y selecciona el mejor modelo disponible.
 
         Estrategia de selección (si auto_select_best=True):
@@ -37,18 +181,29 @@ class MatchPredictor:
             nba_model_path: Ruta modelo NBA.
             use_ensemble: Incluir ensemble como candidato.
             auto_select_best: Si True, decide dinámicamente el mejor modelo.
+            use_native: Si no hay .onnx ni librerías nativas precompiladas,
+                compilarlas al arrancar (Treelite + gcc, lento). Por defecto sólo
+                se cargan las que compila train_ensemble_model.py.
         """
         self.soccer_model = None
         self.model_type = None
         self.is_calibrated = False
+        self.use_native = use_native
 
         # --- Helpers internos ---
-        def _load_metrics(path: str) -> Dict:
+        def _load_metrics(path: str, entries: Optional[Dict[str, os.DirEntry]] = None) -> Dict:
+            # entries: listado del directorio ya hecho (evita un stat por archivo)
             metrics_path = path.replace('.pkl', '_metrics.json')
-            if os.path.exists(metrics_path):
+            if entries is None:
+                metrics_entry = None
+                metrics_exists = os.path.exists(metrics_path)
+            else:
+                metrics_entry = entries.get(os.path.basename(metrics_path))
+                metrics_exists = metrics_entry is not None
+            if metrics_exists:
                 try:
-                    with open(metrics_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
+                    mtime = metrics_entry.stat().st_mtime if metrics_entry is not None else None
+                    data = _cached_by_mtime(_METRICS_CACHE, _read_json, metrics_path, mtime)
                     # Normalizar claves esperadas (ensemble usa cv_*, otros usan nombres directos)
                     accuracy = data.get('cv_accuracy') or data.get('cv_accuracy_mean') or data.get('accuracy')
                     log_loss = data.get('cv_log_loss') or data.get('cv_logloss_mean') or data.get('log_loss')
@@ -95,47 +250,78 @@ class MatchPredictor:
             forced_metrics = _load_metrics(soccer_model_path)
             try:
                 if 'ensemble' in soccer_model_path:
-                    model = EnsembleBettingModel.load(soccer_model_path)
+                    model = _cached_load(_load_ensemble_model, soccer_model_path)
                     model_type = 'ensemble'
                     calibrated_flag = True
                 elif 'calibrated' in soccer_model_path:
-                    model = CalibratedBettingModel.load(soccer_model_path)
+                    model = _cached_load(_load_calibrated_model, soccer_model_path)
                     model_type = 'calibrated_advanced'
                     calibrated_flag = True
                 else:
-                    model = BettingModel.load(soccer_model_path)
+                    model = _cached_load(_load_legacy_model, soccer_model_path)
                     model_type = 'legacy'
                     calibrated_flag = False
                 self.soccer_model = model
                 self.model_type = model_type
                 self.is_calibrated = calibrated_flag
                 logger.info(f"✅ Soccer model (forced) loaded: {soccer_model_path} [{model_type}]")
+                if model_type == 'ensemble':
+                    self._attach_runtime(soccer_model_path)
             except Exception as e:
                 logger.error(f"❌ Failed to load forced soccer model {soccer_model_path}: {e}")
         else:
-            # Construir lista de candidatos
-            if use_ensemble and os.path.exists("models/soccer_ensemble.pkl"):
-                candidates.append({'loader': EnsembleBettingModel.load,
-                                   'path': 'models/soccer_ensemble.pkl',
-                                   'type': 'ensemble',
-                                   'calibrated': True,
-                                   'metrics': _load_metrics('models/soccer_ensemble.pkl')})
-            if os.path.exists("models/soccer_calibrated_advanced.pkl"):
-                candidates.append({'loader': CalibratedBettingModel.load,
-                                   'path': 'models/soccer_calibrated_advanced.pkl',
-                                   'type': 'calibrated_advanced',
-                                   'calibrated': True,
-                                   'metrics': _load_metrics('models/soccer_calibrated_advanced.pkl')})
-            if os.path.exists("models/soccer_model.pkl"):
-                candidates.append({'loader': BettingModel.load,
-                                   'path': 'models/soccer_model.pkl',
-                                   'type': 'legacy',
-                                   'calibrated': False,
-                                   'metrics': _load_metrics('models/soccer_model.pkl')})
-
-            if not candidates:
+            # Un solo listado de models/ para ver qué candidatos (y métricas) existen
+            try:
+                with os.scandir("models") as it:
+                    entries = {e.name: e for e in it}
+            except FileNotFoundError:
+                entries = {}
+
+            # Candidatos en orden de preferencia: (archivo, loader, tipo, calibrado)
+            specs = [
+                ("soccer_ensemble.pkl", _load_ensemble_model, 'ensemble', True),
+                ("soccer_calibrated_advanced.pkl", _load_calibrated_model, 'calibrated_advanced', True),
+                ("soccer_model.pkl", _load_legacy_model, 'legacy', False),
+            ]
+            if not use_ensemble:
+                specs = specs[1:]
+            specs = [spec for spec in specs if spec[0] in entries]
+
+            # Huella de los candidatos: mtimes de cada .pkl y de su JSON de métricas
+            fingerprint = {}
+            for name, *_ in specs:
+                for fname in (name, name.replace('.pkl', '_metrics.json')):
+                    if fname in entries:
+                        fingerprint[fname] = entries[fname].stat().st_mtime
+
+            best = None
+            choice = _read_model_choice(fingerprint, use_ensemble) if specs else None
+            if choice is not None:
+                # Warm start: nada cambió desde la última selección
+                for name, loader, model_type, calibrated_flag in specs:
+                    if f"models/{name}" == choice.get('winner'):
+                        best = {'loader': loader,
+                                'path': f"models/{name}",
+                                'entry': entries[name],
+                                'type': model_type,
+                                'calibrated': calibrated_flag,
+                                'metrics': choice['metrics']}
+                        break
+
+            if best is None:
+                # Construir lista de candidatos
+                for name, loader, model_type, calibrated_flag in specs:
+                    path = f"models/{name}"
+                    candidates.append({'loader': loader,
+                                       'path': path,
+                                       'entry': entries[name],
+                                       'type': model_type,
+                                       'calibrated': calibrated_flag,
+                                       'metrics': _load_metrics(path, entries)})
+
+            if best is None and not candidates:
                 logger.error("❌ No hay modelos de soccer disponibles.")
-            else:
+            elif best is None:
                 # Calcular scores
                 for c in candidates:
                     c['score'] = _score(c['metrics'])
@@ -155,10 +341,16 @@ class MatchPredictor:
                             best = adv_candidate
                             logger.info("🔄 Override: usando modelo calibrado avanzado por mejor ECE.")
 
+                _write_model_choice(fingerprint, use_ensemble, best['path'], best['metrics'])
+
+            if best is not None:
                 try:
-                    self.soccer_model = best['loader'](best['path'])
+                    self.soccer_model = _cached_load(best['loader'], best['path'],
+                                                     best['entry'].stat().st_mtime)
                     self.model_type = best['type']
                     self.is_calibrated = best['calibrated']
+                    if self.model_type == 'ensemble':
+                        self._attach_runtime(best['path'])
                     m = best['metrics']
                     if m['has_metrics']:
                         logger.info(f"✅ Modelo seleccionado [{self.model_type}] - Acc={m['accuracy']}, LogLoss={m['log_loss']}, ECE={m['ece']}")
@@ -169,7 +361,7 @@ class MatchPredictor:
 
         # NBA model (legacy por ahora)
         try:
-            self.nba_model = BettingModel.load(nba_model_path)
+            self.nba_model = _cached_load(_load_legacy_model, nba_model_path)
             logger.info("NBA model loaded successfully")
         except FileNotFoundError:
             logger.warning(f"NBA model not found at {nba_model_path}")
@@ -178,6 +370,314 @@ class MatchPredictor:
         # DB para features
         self.db = BettingDatabase()
 
+        # Getter de features en el orden de cada modelo, resuelto una vez
+        self._row_getters = {}
+        for sport, model in (('soccer', self.soccer_model), ('nba', self.nba_model)):
+            expected_cols = self._expected_columns(model)
+            if expected_cols:
+                self._row_getters[sport] = _make_row_getter(expected_cols)
+
+        # LRU de features por partido (ver _match_features)
+        self._features_cache: OrderedDict = OrderedDict()
+        self._features_cache_lock = threading.Lock()
+        # Buffers de features por lote, reutilizados entre llamadas (ver _batch_buffer)
+        self._batch_bufs = threading.local()
+
+        # Motor de features por deporte: avanzadas sólo para soccer con modelo
+        # calibrado; legacy, NBA y el resto usan las básicas
+        self._feature_fns = {
+            'soccer': self._advanced_features if self.is_calibrated else self.db.calculate_match_features,
+            'nba': self.db.calculate_match_features,
+        }
+
+    def _attach_runtime(self, model_path: str):
+        """Motor de inferencia del ensemble: ONNX si está exportado, si no código nativo"""
+        if self.soccer_model._onnx_session is not None or self.soccer_model._native_models:
+            # Modelo reutilizado de _MODEL_CACHE: ya tiene su motor
+            return
+        if not self._attach_onnx(model_path):
+            self._attach_native(model_path)
+
+    def _attach_onnx(self, model_path: str) -> bool:
+        """
+        Sirve el ensemble con ONNX Runtime si hay un .onnx exportado junto al .pkl
+
+        Un .onnx más viejo que el .pkl corresponde a un entrenamiento anterior
+        y se ignora.
+
+        Returns:
+            True si la sesión ONNX quedó cargada
+        """
+        onnx_path = model_path.replace('.pkl', '.onnx')
+        if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(model_path):
+            return False
+        try:
+            self.soccer_model.load_onnx(onnx_path)
+            return True
+        except Exception as e:
+            logger.warning(f"No se pudo cargar {onnx_path}: {e} - usando sklearn")
+            return False
+
+    def _attach_native(self, model_path: str):
+        """
+        Sirve el ensemble con librerías nativas (Treelite) del modelo
+
+        Por defecto sólo se cargan las precompiladas (train_ensemble_model.py);
+        con use_native=True las que falten se compilan aquí.
+        """
+        try:
+            self.soccer_model.attach_native(model_path, build=self.use_native)
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el ensemble nativo: {e} - usando sklearn")
+
+    def _match_features(self, match: Dict, model) -> Dict:
+        """
+        Features de un partido, cacheadas (LRU) por partido + odds
+
+        Re-predecir la misma jornada no vuelve a consultar la DB. La clave
+        incluye una ventana de FEATURES_CACHE_TTL segundos para recoger
+        resultados nuevos; los errores no se cachean.
+
+        Args:
+            match: Diccionario con información del partido
+            model: Modelo que va a predecir (define el set de features)
+
+        Returns:
+            Dict de features, o dict con 'error' si no se pudieron calcular
+        """
+        odds = match.get('odds')
+        cache_key = (
+            match['sport'],
+            match.get('league'),
+            match['home_team'],
+            match['away_team'],
+            str(match.get('match_date')),
+            tuple(sorted(odds.items())) if isinstance(odds, dict) else odds,
+            int(time.time() // FEATURES_CACHE_TTL)
+        )
+        with self._features_cache_lock:
+            features_dict = self._features_cache.get(cache_key)
+            if features_dict is not None:
+                self._features_cache.move_to_end(cache_key)
+                return features_dict
+
+        features_dict = self._compute_match_features(match, model)
+        if 'error' not in features_dict:
+            with self._features_cache_lock:
+                self._features_cache[cache_key] = features_dict
+                if len(self._features_cache) > FEATURES_CACHE_MAX:
+                    self._features_cache.popitem(last=False)
+
+        return features_dict
+
+    def clear_feature_cache(self):
+        """Vacía el cache de features (ej. tras cargar resultados nuevos en la DB)"""
+        with self._features_cache_lock:
+            self._features_cache.clear()
+
+    def _compute_match_features(self, match: Dict, model) -> Dict:
+        """
+        Calcula las features de un partido para el modelo indicado
+
+        Args:
+            match: Diccionario con información del partido
+            model: Modelo que va a predecir (define el set de features)
+
+        Returns:
+            Dict de features, o dict con 'error' si no se pudieron calcular
+        """
+        # Motor de features elegido una vez por deporte (ver __init__)
+        feature_fn = self._feature_fns.get(match['sport'], self.db.calculate_match_features)
+        features_dict = feature_fn(match)
+
+        if features_dict is None:
+            logger.warning(f"Could not calculate features for {match['home_team']} vs {match['away_team']}")
+            return {'error': 'Could not calculate features'}
+
+        return features_dict
+
+    def _advanced_features(self, match: Dict) -> Optional[Dict]:
+        """Features avanzadas (ELO, form, H2H, etc.) con fallback a las básicas"""
+        try:
+            features_dict = calculate_match_features_advanced(match, self.db)
+        except Exception as e:
+            logger.warning(f"Advanced feature engine failed: {e} - falling back to basic features")
+            features_dict = None
+        # Si fallan o vienen vacías, usar básicas
+        if not features_dict or len(features_dict) < 5:
+            basic = self.db.calculate_match_features(match)
+            if basic:
+                features_dict = basic
+                logger.info("Fallback to basic feature set applied")
+            else:
+                logger.error("No features (advanced or basic) available for match")
+                return {'error': 'No features available'}
+        return features_dict
+
+    @staticmethod
+    def _expected_columns(model) -> List[str]:
+        """Columnas (en orden) que espera el modelo; [] si no las declara"""
+        # Ensemble usa feature_names, calibrated usa feature_columns
+        if hasattr(model, 'feature_names') and isinstance(getattr(model, 'feature_names'), list):
+            return model.feature_names
+        if hasattr(model, 'feature_columns') and isinstance(getattr(model, 'feature_columns'), list):
+            return model.feature_columns
+        return []
+
+    @staticmethod
+    def _features_vector(features_dict: Dict, get_row) -> Optional[np.ndarray]:
+        """
+        Vector float32 de features en el orden del modelo, sin pasar por pandas
+
+        Args:
+            features_dict: Features del partido
+            get_row: Getter de _make_row_getter para las columnas del modelo
+
+        Returns:
+            Array (n_features,) o None si alguna feature no es numérica
+        """
+        try:
+            return np.asarray(get_row(features_dict), dtype=np.float32)
+        except (TypeError, ValueError):
+            return None
+
+    def _batch_buffer(self, sport: str, n_rows: int, n_cols: int) -> np.ndarray:
+        """
+        Buffer float32 reutilizable para la matriz de features de un lote
+
+        Crece hasta el lote más grande visto y se reutiliza entre llamadas.
+        Es por thread (predict_multiple_matches y AsyncBatchPredictor pueden
+        correr a la vez) y por deporte (cada modelo tiene su número de features).
+
+        Returns:
+            Vista (n_rows, n_cols) sobre el buffer
+        """
+        bufs = getattr(self._batch_bufs, 'by_sport', None)
+        if bufs is None:
+            bufs = self._batch_bufs.by_sport = {}
+        buf = bufs.get(sport)
+        if buf is None or buf.shape[0] < n_rows or buf.shape[1] != n_cols:
+            buf = bufs[sport] = np.empty((n_rows, n_cols), dtype=np.float32)
+        return buf[:n_rows]
+
+    @classmethod
+    def _features_frame(cls, rows: List[Dict], model, get_row=None,
+                        out: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Arma el DataFrame de features alineado a las columnas esperadas del modelo
+
+        Args:
+            rows: Dicts de features, uno por partido
+            model: Modelo que va a predecir
+            get_row: Getter ya armado para las columnas del modelo (opcional)
+            out: Buffer float32 (len(rows), n_features) a llenar en lugar de
+                alocar uno nuevo (opcional, ver _batch_buffer)
+        """
+        expected_cols = cls._expected_columns(model)
+        if not expected_cols:
+            return pd.DataFrame(rows)
+        # Rellenar columnas faltantes con 0.0 para evitar errores de predicción
+        if get_row is None:
+            get_row = _make_row_getter(expected_cols)
+        values = [get_row(row) for row in rows]
+        try:
+            # Un solo bloque float32 (el dtype con el que predicen los árboles):
+            # evita la inferencia de tipos columna a columna
+            if out is not None and out.shape == (len(values), len(expected_cols)):
+                out[...] = values
+                return pd.DataFrame(out, columns=expected_cols, copy=False)
+            return pd.DataFrame(np.asarray(values, dtype=np.float32), columns=expected_cols)
+        except (TypeError, ValueError):
+            # Alguna feature no numérica: construcción genérica
+            return pd.DataFrame(values, columns=expected_cols)
+
+    @staticmethod
+    def _predict_batch(model, features_df: pd.DataFrame):
+        """
+        Predice todas las filas con una sola llamada al modelo
+
+        Args:
+            model: Modelo cargado (ensemble, calibrado o legacy)
+            features_df: DataFrame alineado, una fila por partido
+
+        Returns:
+            Tupla (lista de dicts de probabilidades, lista de predicciones,
+            lista de confianzas o None si el modelo no expone la matriz)
+        """
+        # Sin isinstance: las clases de modelo se importan recién al cargarlas
+        if hasattr(model, 'predict_proba_batch'):
+            # Ensemble / CalibratedBettingModel / BettingModel: matriz (N, clases) de una vez
+            probas = model.predict_proba_batch(features_df)
+            classes = list(probas.columns)
+            probas_np = probas.to_numpy()
+            pred_idx = probas_np.argmax(axis=1)
+            # Confianza = probabilidad de la clase predicha, sin loop por fila
+            confidences = np.take_along_axis(probas_np, pred_idx[:, None], axis=1).ravel().tolist()
+            probabilities = [dict(zip(classes, row)) for row in probas_np.tolist()]
+            predictions = [classes[i] for i in pred_idx.tolist()]
+            return probabilities, predictions, confidences
+
+        # Sin API por lote: su predict_proba solo devuelve la primera fila
+        probabilities = [model.predict_proba(features_df.iloc[i:i + 1])
+                         for i in range(len(features_df))]
+        predictions = [max(probs, key=probs.get) for probs in probabilities]
+        return probabilities, predictions, None
+
+    @staticmethod
+    def _predict_rows(model, features_df: pd.DataFrame):
+        """
+        Predice fila por fila (fallback cuando falla la llamada por lote)
+
+        Args:
+            model: Modelo cargado
+            features_df: DataFrame alineado, una fila por partido
+
+        Returns:
+            Tupla (probabilidades, predicciones, [(índice, error)]); las filas
+            que fallan quedan con probabilidades {} y predicción None
+        """
+        probabilities, predictions, failed = [], [], []
+        for i in range(len(features_df)):
+            try:
+                probs = model.predict_proba(features_df.iloc[i:i + 1])
+                probabilities.append(probs)
+                predictions.append(max(probs, key=probs.get))
+            except Exception as e:
+                logger.error(f"Model prediction failure: {e}")
+                probabilities.append({})
+                predictions.append(None)
+                failed.append((i, e))
+        return probabilities, predictions, failed
+
+    def _build_result(self, match: Dict, prediction: str, probabilities: Dict,
+                      confidence: Optional[float] = None) -> Dict:
+        """Arma el dict de resultado de un partido (confidence ya calculada o None)"""
+        # Tipos nativos en el borde (JSON/pickle de la respuesta): los modelos
+        # legacy pueden devolver clases numpy.str_ o probabilidades numpy
+        probabilities = {str(k): float(v) for k, v in probabilities.items()}
+        prediction = str(prediction)
+
+        # Calcular confianza (probabilidad de la predicción)
+        if confidence is None:
+            confidence = probabilities[prediction]
+
+        result = {
+            'match_id': match['match_id'],
+            'sport': match['sport'],
+            'league': match['league'],
+            'home_team': match['home_team'],
+            'away_team': match['away_team'],
+            'match_date': match['match_date'],
+            'prediction': prediction,
+            'confidence': confidence,
+            'probabilities': probabilities,
+            'odds': match['odds'],
+            'model_type': self.model_type,  # Nuevo: identificar modelo usado
+            'is_calibrated': self.is_calibrated
+        }
+
+        return result
+
     def predict_match(self, match: Dict) -> Dict:
         """
         Predice el resultado de un partido usando features de la base de datos
@@ -205,56 +705,27 @@ class MatchPredictor:
                 'probabilities': {}
             }
 
-        # Calcular features - usar avanzadas si modelo calibrado
-        if sport == "soccer" and self.is_calibrated:
-            # Intentar advanced features (ELO, form, H2H, etc.)
-            try:
-                features_dict = calculate_match_features_advanced(match, self.db)
-            except Exception as e:
-                logger.warning(f"Advanced feature engine failed: {e} - falling back to basic features")
-                features_dict = None
-            # Si fallan o vienen vacías, usar básicas
-            if not features_dict or len(features_dict) < 5:
-                basic = self.db.calculate_match_features(match)
-                if basic:
-                    features_dict = basic
-                    logger.info("Fallback to basic feature set applied")
-                else:
-                    logger.error("No features (advanced or basic) available for match")
-                    return {
-                        'error': 'No features available',
-                        'probabilities': {}
-                    }
-        else:
-            # Modelo legacy o NBA: usar básicas directamente
-            features_dict = self.db.calculate_match_features(match)
-
-        if features_dict is None:
-            logger.warning(f"Could not calculate features for {home_team} vs {away_team}")
+        features_dict = self._match_features(match, model)
+        if 'error' in features_dict:
             return {
-                'error': 'Could not calculate features',
+                'error': features_dict['error'],
                 'probabilities': {}
             }
 
-        # Convertir a DataFrame y alinear columnas esperadas del modelo
-        features_df = pd.DataFrame([features_dict])
-        expected_cols = []
-        # Ensemble usa feature_names, calibrated usa feature_columns
-        if hasattr(model, 'feature_names') and isinstance(getattr(model, 'feature_names'), list):
-            expected_cols = model.feature_names
-        elif hasattr(model, 'feature_columns') and isinstance(getattr(model, 'feature_columns'), list):
-            expected_cols = model.feature_columns
-        # Rellenar columnas faltantes con 0.0 para evitar errores de predicción
-        for col in expected_cols:
-            if col not in features_df.columns:
-                features_df[col] = 0.0
-        if expected_cols:
-            features_df = features_df[expected_cols]
+        # Ensemble/calibrado: vector en el orden del modelo, sin DataFrame
+        get_row = self._row_getters.get(sport)
+        x = None
+        if get_row is not None and hasattr(model, 'predict_proba_array'):
+            x = self._features_vector(features_dict, get_row)
 
-        # Predecir
+        # Predecir: una sola pasada del modelo, la predicción es la clase más probable
         try:
-            probabilities = model.predict_proba(features_df)
-            prediction = model.predict(features_df)
+            if x is not None:
+                probabilities = model.predict_proba_array(x)
+            else:
+                # Legacy (o features no numéricas): DataFrame alineado
+                probabilities = model.predict_proba(self._features_frame([features_dict], model, get_row))
+            prediction = max(probabilities, key=probabilities.get)
         except Exception as e:
             logger.error(f"Model prediction failure: {e}")
             return {
@@ -262,66 +733,225 @@ class MatchPredictor:
                 'probabilities': {}
             }
 
-        # Calcular confianza (probabilidad de la predicción)
-        confidence = probabilities[prediction]
-
-        result = {
-            'match_id': match['match_id'],
-            'sport': sport,
-            'league': match['league'],
-            'home_team': home_team,
-            'away_team': away_team,
-            'match_date': match['match_date'],
-            'prediction': prediction,
-            'confidence': confidence,
-            'probabilities': probabilities,
-            'odds': match['odds'],
-            'model_type': self.model_type,  # Nuevo: identificar modelo usado
-            'is_calibrated': self.is_calibrated
-        }
-        logger.info(f"Prediction: {prediction} (confidence: {confidence:.2%}) [Model: {self.model_type}]")
+        result = self._build_result(match, prediction, probabilities)
+        logger.info(f"Prediction: {prediction} (confidence: {result['confidence']:.2%}) [Model: {self.model_type}]")
 
         return result
 
-    def predict_multiple_matches(self, matches: list) -> list:
+    def predict_multiple_matches(self, matches: list, max_workers: Optional[int] = FEATURE_WORKERS) -> list:
         """
         Predice resultados para múltiples partidos
 
+        Las features se calculan por partido (opcionalmente en threads, la
+        mayor parte del tiempo es I/O de SQLite) y luego se apilan en un
+        único DataFrame por deporte: el modelo se invoca una sola vez.
+
         Args:
             matches: Lista de diccionarios de partidos
+            max_workers: Threads para el cálculo de features (None/1 = secuencial)
 
         Returns:
             Lista de predicciones
         """
-        predictions = []
+        results, errors = self._predict_aligned(matches, max_workers)
+        predictions = [result for result in results if 'error' not in result]
+
+        # Log summary
+        if errors:
+            logger.warning(f"Prediction errors summary: {len(errors)} failures out of {len(matches)} matches")
+            logger.warning(f"First error: {errors[0]}")
+
+        logger.info(f"Successfully predicted {len(predictions)} out of {len(matches)} matches")
+
+        return predictions
+
+    def _predict_aligned(self, matches: list, max_workers: Optional[int] = FEATURE_WORKERS):
+        """
+        Núcleo de predict_multiple_matches: un resultado por partido, en orden
+
+        Args:
+            matches: Lista de diccionarios de partidos
+            max_workers: Threads para el cálculo de features (None/1 = secuencial)
+
+        Returns:
+            Tupla (resultados alineados con matches, mensajes de error). Los
+            partidos que fallan quedan como {'error': ..., 'probabilities': {}},
+            igual que en predict_match.
+        """
         errors = []
+        results_by_id = {}
 
-        for match in matches:
+        def _fail(match, message):
+            errors.append(message)
+            results_by_id[id(match)] = {'error': message, 'probabilities': {}}
+
+        def _safe_features(match, model):
             try:
-                prediction = self.predict_match(match)
+                return self._match_features(match, model)
+            except Exception as e:
+                # loguru adjunta el traceback sólo si algún sink emite el mensaje
+                logger.opt(exception=True).error(f"Error predicting match {match.get('match_id')}: {e}")
+                return {'error': str(e), 'exception': True}
 
-                # Skip if prediction contains error
-                if 'error' in prediction:
-                    errors.append(f"{match.get('match_id')}: {prediction['error']}")
+        # Agrupar por deporte: cada grupo usa un único modelo
+        by_sport: Dict[str, List[Dict]] = {}
+        for match in matches:
+            by_sport.setdefault(match.get('sport'), []).append(match)
+
+        for sport, sport_matches in by_sport.items():
+            model = self.soccer_model if sport == "soccer" else self.nba_model
+            if model is None:
+                logger.error(f"Model for {sport} not loaded")
+                for m in sport_matches:
+                    _fail(m, f"{m.get('match_id')}: Model for {sport} not available")
+                continue
+
+            # 1. Features por partido
+            if max_workers and max_workers > 1 and len(sport_matches) > 1:
+                features_list = Parallel(n_jobs=max_workers, prefer='threads')(
+                    delayed(_safe_features)(m, model) for m in sport_matches
+                )
+            else:
+                features_list = [_safe_features(m, model) for m in sport_matches]
+
+            ok_matches, rows = [], []
+            for match, features_dict in zip(sport_matches, features_list):
+                if 'error' in features_dict:
+                    if features_dict.get('exception'):
+                        _fail(match, features_dict['error'])
+                    else:
+                        _fail(match, f"{match.get('match_id')}: {features_dict['error']}")
                     continue
+                ok_matches.append(match)
+                rows.append(features_dict)
 
-                predictions.append(prediction)
-            except Exception as e:
-                import traceback
-                error_msg = f"{match.get('match_id')}: {str(e)}\n{traceback.format_exc()}"
-                logger.error(f"Error predicting match: {error_msg}")
-                errors.append(str(e))
+            if not rows:
                 continue
 
-        # Log summary
-        if errors:
-            logger.warning(f"Prediction errors summary: {len(errors)} failures out of {len(matches)} matches")
-            logger.warning(f"First error: {errors[0]}")
+            # 2-3. Un DataFrame apilado y una sola llamada al modelo
+            get_row = self._row_getters.get(sport)
+            out = None
+            if get_row is not None:
+                out = self._batch_buffer(sport, len(rows), len(self._expected_columns(model)))
+            features_df = self._features_frame(rows, model, get_row, out)
+            try:
+                probabilities, labels, confidences = self._predict_batch(model, features_df)
+            except Exception as e:
+                # Fallback: partido por partido, así una fila rota no tira todo el lote
+                logger.warning(f"Batch prediction failed ({e}) - falling back to per-match prediction")
+                probabilities, labels, failed = self._predict_rows(model, features_df)
+                confidences = None
+                for i, err in failed:
+                    _fail(ok_matches[i], f"{ok_matches[i].get('match_id')}: Model prediction failure: {err}")
+
+            # 4. Resultado por partido
+            if confidences is None:
+                confidences = [None] * len(labels)
+            for match, probs, label, confidence in zip(ok_matches, probabilities, labels, confidences):
+                if label is None:
+                    continue
+                try:
+                    result = self._build_result(match, label, probs, confidence)
+                    # Por partido sólo en DEBUG (formato diferido); el resumen va en INFO
+                    logger.debug("Prediction: {} (confidence: {:.2%}) [Model: {}]",
+                                 label, result['confidence'], self.model_type)
+                    results_by_id[id(match)] = result
+                except Exception as e:
+                    logger.error(f"Error predicting match: {match.get('match_id')}: {e}")
+                    _fail(match, str(e))
 
-        logger.info(f"Successfully predicted {len(predictions)} out of {len(matches)} matches")
+        # Mantener el orden de entrada
+        return [results_by_id[id(m)] for m in matches], errors
 
-        return predictions
 
+class AsyncBatchPredictor:
+    """
+    Agrupa predicciones online (de a un partido) en micro-lotes
+
+    Los partidos que llegan sueltos (ej. desde el scraper) se encolan; un
+    thread de fondo junta hasta batch_size o espera timeout_ms desde el
+    primero y los predice juntos con MatchPredictor: una sola pasada del
+    modelo por lote en lugar de una por partido.
+    """
+
+    def __init__(self, predictor: MatchPredictor, batch_size: int = 64, timeout_ms: float = 20.0):
+        """
+        Args:
+            predictor: MatchPredictor ya inicializado
+            batch_size: Máximo de partidos por lote
+            timeout_ms: Espera máxima (desde el primer partido) para completar un lote
+        """
+        self.predictor = predictor
+        self.batch_size = batch_size
+        self.timeout = timeout_ms / 1000.0
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='AsyncBatchPredictor', daemon=True)
+        self._worker.start()
+
+    def submit(self, match: Dict) -> Future:
+        """
+        Encola un partido
+
+        Returns:
+            Future con el mismo dict que devolvería predict_match
+        """
+        future = Future()
+        self._queue.put((match, future))
+        return future
+
+    def predict_match_async(self, match: Dict) -> Future:
+        """Alias de submit con el nombre de la API de MatchPredictor"""
+        return self.submit(match)
+
+    def close(self):
+        """Procesa lo pendiente y detiene el thread de fondo"""
+        self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.timeout
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._predict(batch)
+            if stop:
+                return
+
+    def _predict(self, batch: List[tuple]):
+        # Futures cancelados por el cliente antes de empezar: se descartan
+        pending = [(match, future) for match, future in batch if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+        try:
+            results, _ = self.predictor._predict_aligned([match for match, _ in pending])
+        except Exception as e:
+            logger.error(f"Batch prediction failed: {e}")
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
 
 if __name__ == "__main__":
     # Test sencillo del predictor (opcional)
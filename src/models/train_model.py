@@ -4,23 +4,253 @@ Entrenamiento de modelos de Machine Learning para predicción de resultados
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.model_selection import StratifiedShuffleSplit, cross_validate, StratifiedKFold
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 try:
-    from xgboost import XGBClassifier  # type: ignore
+    import xgboost as xgb  # type: ignore
 except Exception:
-    XGBClassifier = None  # Fallback si no está disponible XGBoost
-from sklearn.metrics import accuracy_score, classification_report, log_loss
+    xgb = None  # Fallback si no está disponible XGBoost
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support, log_loss
 try:
     from sklearn.metrics import roc_auc_score, confusion_matrix  # type: ignore
 except Exception:
     roc_auc_score = None
     confusion_matrix = None
-import pickle
+import joblib
 import os
+import json
+import hashlib
+import functools
+import warnings
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 from loguru import logger
 
+try:
+    import blake3  # type: ignore
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+
+try:
+    import pyarrow  # noqa: F401  (motor de read_parquet / to_parquet)
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+@functools.lru_cache(maxsize=None)
+def _xgb_device() -> str:
+    """
+    Device de XGBoost: histogramas en GPU si hay una disponible, CPU si no
+
+    Se resuelve al primer entrenamiento y se cachea (nunca al importar: el
+    predictor importa este módulo para cargar el modelo legacy y no debe
+    pagar el booster de prueba ni el contexto CUDA).
+    """
+    return "cuda" if _cuda_available() else "cpu"
+
+
+def _cuda_available() -> bool:
+    """
+    Indica si XGBoost puede entrenar en GPU
+
+    Requiere un build de XGBoost con CUDA y una GPU visible: sin GPU, XGBoost
+    cae a CPU con un warning, así que se verifica el device efectivo de un
+    booster de prueba.
+    """
+    if xgb is None:
+        return False
+    try:
+        if not xgb.build_info().get('USE_CUDA'):
+            return False
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            booster = xgb.train({'device': 'cuda', 'tree_method': 'hist'},
+                                xgb.DMatrix(np.zeros((2, 1)), label=[0, 1]),
+                                num_boost_round=1)
+        config = json.loads(booster.save_config())
+        return config['learner']['generic_param']['device'].startswith('cuda')
+    except Exception:
+        return False
+
+
+# Hiperparámetros de XGBoost (API nativa; el objetivo depende del número de
+# clases y el device se agrega al entrenar, ver _xgb_device)
+XGB_PARAMS = {
+    'max_depth': 6,
+    'eta': 0.1,
+    # Boosting estocástico: cada árbol recorre ~80% de filas y columnas
+    'subsample': 0.8,
+    'colsample_bytree': 0.8,
+    'colsample_bylevel': 0.8,
+    'seed': 42,
+    'tree_method': 'hist',
+    'max_bin': 128,  # features float32 continuas: 128 cortes alcanzan y los histogramas entran en L1
+}
+XGB_NUM_BOOST_ROUND = 200
+# Corta el boosting cuando el logloss de validación no mejora en N rondas
+XGB_EARLY_STOPPING_ROUNDS = 20
+
+
+def _xgb_objective(n_classes: int) -> dict:
+    """Objetivo y métricas de XGBoost para n clases"""
+    if n_classes <= 2:
+        return {'objective': 'binary:logistic', 'eval_metric': 'logloss'}
+    return {'objective': 'multi:softprob', 'num_class': n_classes, 'eval_metric': 'mlogloss'}
+
+
+# Datasets de más filas se hashean por muestra: inicio, medio y fin de cada columna
+DATASET_HASH_FULL_MAX_ROWS = 1_000_000
+DATASET_HASH_SAMPLE_ROWS = 512
+
+
+def _dataset_hash(df: pd.DataFrame) -> str:
+    """
+    Hash del dataset sobre los buffers de cada columna (sin pasar por CSV)
+
+    Columnas en orden alfabético para que el hash no dependa del orden. Las
+    numéricas/fechas se hashean byte a byte; strings y categorías con
+    pd.util.hash_pandas_object (sus bytes crudos son punteros o códigos).
+    Sobre DATASET_HASH_FULL_MAX_ROWS filas sólo entran la forma del dataset y
+    tres bloques de DATASET_HASH_SAMPLE_ROWS filas por columna.
+
+    Returns:
+        Hex digest BLAKE3 (blake2b de hashlib si no hay blake3)
+    """
+    h = blake3.blake3() if BLAKE3_AVAILABLE else hashlib.blake2b(digest_size=32)
+    h.update(str(df.shape).encode('utf-8'))
+    n_rows = len(df)
+    if n_rows > DATASET_HASH_FULL_MAX_ROWS:
+        k, mid = DATASET_HASH_SAMPLE_ROWS, n_rows // 2
+        df = df.iloc[np.r_[0:k, mid:mid + k, n_rows - k:n_rows]]
+    for col in sorted(df.columns, key=str):
+        values = df[col]
+        if values.dtype.kind not in 'biufcmM':
+            values = pd.util.hash_pandas_object(values, index=False)
+        h.update(str(col).encode('utf-8'))
+        h.update(np.ascontiguousarray(values.to_numpy()).data)
+    return h.hexdigest()
+
+
+SYNTHETIC_CACHE_DIR = 'data/.cache'
+SYNTHETIC_NUM_MATCHES = 2000
+SYNTHETIC_SEED = 42
+
+
+def _synthetic_dataset(sport: str, num_matches: int = SYNTHETIC_NUM_MATCHES,
+                       seed: int = SYNTHETIC_SEED) -> pd.DataFrame:
+    """
+    Devuelve el dataset sintético de un deporte, cacheado en disco
+
+    Con semilla fija el generador siempre produce el mismo DataFrame, así que
+    se genera una sola vez por (sport, num_matches, seed) y las siguientes
+    corridas lo leen del caché (Feather con pyarrow, pickle si no).
+
+    Args:
+        sport: 'soccer' o 'nba'
+        num_matches: Número de partidos a generar
+        seed: Semilla del generador
+
+    Returns:
+        DataFrame con features y resultados
+    """
+    from src.utils.data_generator import generate_training_data
+
+    ext = 'feather' if PYARROW_AVAILABLE else 'pkl'
+    cache_path = os.path.join(SYNTHETIC_CACHE_DIR, f"synth_{sport}_{num_matches}_{seed}.{ext}")
+    if os.path.exists(cache_path):
+        try:
+            if PYARROW_AVAILABLE:
+                return pd.read_feather(cache_path)
+            return pd.read_pickle(cache_path)
+        except Exception as e:
+            logger.warning(f"Caché sintético inválido {cache_path}, regenerando. Error: {e}")
+
+    df = generate_training_data(sport, num_matches=num_matches, seed=seed)
+    try:
+        os.makedirs(SYNTHETIC_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        if PYARROW_AVAILABLE:
+            df.to_feather(tmp_path)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+        logger.info(f"Synthetic {sport} dataset cached: {cache_path}")
+    except Exception as e:
+        logger.warning(f"No se pudo guardar {cache_path}: {e}")
+    return df
+
+
+def _load_dataset(csv_path: str) -> pd.DataFrame:
+    """
+    Carga un dataset de entrenamiento, preferentemente desde su copia Parquet
+
+    La primera carga del CSV (o cuando el CSV es más nuevo que el Parquet)
+    baja las columnas float64 a float32 y deja un .parquet al lado, así las
+    siguientes cargas leen columnas ya tipadas sin reparsear texto.
+
+    Args:
+        csv_path: Ruta del CSV (el .parquet hermano se usa si existe)
+
+    Returns:
+        DataFrame del dataset
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if PYARROW_AVAILABLE and os.path.exists(parquet_path) and (
+            not os.path.exists(csv_path)
+            or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)):
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+
+    df = pd.read_csv(csv_path)
+    float_cols = df.select_dtypes(include=['float64']).columns
+    df = df.astype({col: np.float32 for col in float_cols})
+    if PYARROW_AVAILABLE:
+        try:
+            df.to_parquet(parquet_path, engine='pyarrow', compression='zstd', index=False)
+            logger.info(f"Dataset cached as Parquet: {parquet_path}")
+        except Exception as e:
+            logger.warning(f"No se pudo guardar {parquet_path}: {e}")
+    return df
+
+
+class BoosterClassifier:
+    """
+    Envoltorio liviano sobre un xgb.Booster con la API de clasificador que
+    usa BettingModel (predict, predict_proba, feature_importances_)
+    """
+
+    def __init__(self, booster, n_classes: int, n_features: int):
+        self.booster = booster
+        self.n_classes = n_classes
+        self.n_features = n_features
+
+    def get_booster(self):
+        return self.booster
+
+    def predict_proba(self, X) -> np.ndarray:
+        # inplace_predict: sin armar un DMatrix por llamada
+        proba = self.booster.inplace_predict(np.ascontiguousarray(X, dtype=np.float32))
+        if proba.ndim == 1:
+            # Binario: el booster devuelve sólo P(clase positiva)
+            proba = np.column_stack([1.0 - proba, proba])
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.predict_proba(X).argmax(axis=1)
+
+    @property
+    def feature_importances_(self) -> np.ndarray:
+        # Mismo criterio que XGBClassifier: gain normalizado
+        scores = self.booster.get_score(importance_type='gain')
+        importances = np.zeros(self.n_features, dtype=np.float32)
+        for name, value in scores.items():
+            importances[int(name[1:])] = value
+        total = importances.sum()
+        return importances / total if total > 0 else importances
+
 
 class BettingModel:
     """Modelo de predicción para apuestas deportivas"""
@@ -35,8 +265,11 @@ class BettingModel:
         self.model_type = model_type
         self.model = None
         self.feature_columns = []
+        self._feature_index = pd.Index([])
         self.classes_ = []
         self.label_encoder = LabelEncoder()
+        # Labels de cada columna de probabilidad como str de Python (ver predict_proba)
+        self._class_labels = []
 
     def train(self, data: pd.DataFrame, validation_split: float = 0.2):
         """
@@ -47,59 +280,101 @@ class BettingModel:
             validation_split: Proporción de datos para validación
         """
         logger.info(f"Training {self.model_type} model for {self.sport}")
+        if self.model_type == "xgboost" and xgb is not None:
+            logger.info(f"XGBoost device: {_xgb_device()}")
 
         # Separar features y target (usar solo columnas numéricas para evitar objetos)
         X = data.drop('result', axis=1)
-        X = X.select_dtypes(include=[np.number])
+        # Una sola copia float32 (el dtype de los histogramas de XGBoost) que
+        # reutilizan el split, el fit y los folds del CV
+        X = X.select_dtypes(include=[np.number]).astype(np.float32, copy=False)
         y = data['result']
 
         self.feature_columns = X.columns.tolist()
-        self.classes_ = sorted(y.unique())
-
+        self._feature_index = pd.Index(self.feature_columns)
         # Convertir labels a numéricos
-        y_encoded = self.label_encoder.fit_transform(y)
-
-        # Split train/test
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y_encoded, test_size=validation_split, random_state=42, stratify=y_encoded
-        )
-
-        # Inicializar modelo
-        if self.model_type == "xgboost" and XGBClassifier is not None:
-            self.model = XGBClassifier(
-                n_estimators=200,
-                max_depth=6,
-                learning_rate=0.1,
-                random_state=42,
-                eval_metric='mlogloss'
-            )
-        elif self.model_type == "xgboost" and XGBClassifier is None:
-            logger.warning("XGBoost no disponible en el entorno. Usando GradientBoostingClassifier como fallback.")
-            self.model = GradientBoostingClassifier(
-                n_estimators=200,
-                learning_rate=0.1,
-                random_state=42
-            )
-        elif self.model_type == "random_forest":
-            self.model = RandomForestClassifier(
-                n_estimators=200,
-                max_depth=10,
-                random_state=42
-            )
-        else:  # gradient_boosting
-            self.model = GradientBoostingClassifier(
-                n_estimators=200,
-                learning_rate=0.1,
-                random_state=42
-            )
-
-        # Entrenar
-        logger.info(f"Training on {len(X_train)} samples...")
-        self.model.fit(X_train, y_train)
-
-        # Evaluar
+        if isinstance(y.dtype, pd.CategoricalDtype):
+            # Categórico: los códigos enteros ya son el encoding (sin LabelEncoder.fit)
+            y = y.cat.remove_unused_categories()
+            y_encoded = y.cat.codes.to_numpy(np.int32)
+            self.label_encoder.classes_ = np.asarray(y.cat.categories)
+        else:
+            y_encoded = self.label_encoder.fit_transform(y)
+        self.classes_ = self.label_encoder.classes_.tolist()
+        self._class_labels = self.label_encoder.classes_.tolist()
+
+        # Split train/test por índices sobre un único array float32 (mismo
+        # split que train_test_split estratificado, sin pasar por pandas)
+        X_arr = X.to_numpy()
+        train_idx, test_idx = next(StratifiedShuffleSplit(
+            n_splits=1, test_size=validation_split, random_state=42
+        ).split(X_arr, y_encoded))
+        X_train, X_test = X_arr[train_idx], X_arr[test_idx]
+        y_train, y_test = y_encoded[train_idx], y_encoded[test_idx]
+
+        use_xgb = self.model_type == "xgboost" and xgb is not None
+        n_classes = len(self.label_encoder.classes_)
+
+        # Folds del CV sobre el split de train (test queda fuera: sin leakage),
+        # índices calculados una vez
+        cv_splits = list(StratifiedKFold(n_splits=5, shuffle=True, random_state=42).split(X_train, y_train))
+        logger.info(f"Training on {len(X_train)} samples ({len(cv_splits)}-fold CV)...")
+
+        # Entrenar: el modelo final es el mejor de los folds (5 fits en lugar
+        # de 5 del CV + 1 de reentrenamiento)
+        if use_xgb:
+            # API nativa, folds secuenciales (en GPU el contexto CUDA no
+            # sobrevive a un fork)
+            params = {**XGB_PARAMS, 'device': _xgb_device(), **_xgb_objective(n_classes)}
+            fold_models, fold_scores = [], []
+            for fold_train, fold_val in cv_splits:
+                booster = self._train_booster(params, X_train[fold_train], y_train[fold_train],
+                                              X_train[fold_val], y_train[fold_val])
+                model = BoosterClassifier(booster, n_classes, X.shape[1])
+                fold_models.append(model)
+                fold_scores.append(accuracy_score(y_train[fold_val], model.predict(X_train[fold_val])))
+            fold_scores = np.asarray(fold_scores)
+        else:
+            if self.model_type == "xgboost":
+                logger.warning("XGBoost no disponible en el entorno. Usando HistGradientBoostingClassifier como fallback.")
+                estimator = HistGradientBoostingClassifier(
+                    max_iter=200,
+                    max_depth=6,
+                    learning_rate=0.1,
+                    random_state=42
+                )
+            elif self.model_type == "random_forest":
+                estimator = RandomForestClassifier(
+                    n_estimators=200,
+                    max_depth=10,
+                    max_features='sqrt',
+                    random_state=42,
+                    n_jobs=-1
+                )
+            else:  # gradient_boosting (histogramas, como XGBoost/LightGBM)
+                estimator = HistGradientBoostingClassifier(
+                    max_iter=200,
+                    max_depth=6,
+                    learning_rate=0.1,
+                    random_state=42
+                )
+
+            # Folds en paralelo (loky reparte los threads de cada fit entre los workers)
+            cv_results = cross_validate(estimator, X_train, y_train, cv=cv_splits, scoring='accuracy',
+                                        return_estimator=True, n_jobs=-1, pre_dispatch='2*n_jobs')
+            fold_models, fold_scores = cv_results['estimator'], cv_results['test_score']
+
+        cv_mean, cv_std = float(fold_scores.mean()), float(fold_scores.std())
+        logger.info(f"Cross-validation accuracy: {cv_mean:.4f} (+/- {cv_std:.4f})")
+        best_fold = int(np.argmax(fold_scores))
+        self.model = fold_models[best_fold]
+        logger.info(f"Using fold {best_fold + 1} model (accuracy {fold_scores[best_fold]:.4f})")
+
+        # Evaluar: en test una sola pasada por los árboles; la predicción es el
+        # argmax de las probabilidades (clases codificadas 0..n-1)
         train_preds = self.model.predict(X_train)
-        test_preds = self.model.predict(X_test)
+        test_proba = self.model.predict_proba(X_test)
+        test_preds = test_proba.argmax(axis=1)
 
         train_acc = accuracy_score(y_train, train_preds)
         test_acc = accuracy_score(y_test, test_preds)
@@ -108,25 +383,27 @@ class BettingModel:
         logger.info(f"Test accuracy: {test_acc:.4f}")
 
         # Classification report (convertir a labels originales)
-        logger.info("\nClassification Report (Test Set):")
-        print(classification_report(y_test, test_preds, target_names=self.label_encoder.classes_))
-
-        # Cross-validation
-        cv_scores = cross_val_score(self.model, X, y_encoded, cv=5, scoring='accuracy')
-        logger.info(f"Cross-validation accuracy: {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
+        # Métricas por clase (Test Set): una pasada, una línea por clase
+        precision, recall, f1, support = precision_recall_fscore_support(
+            y_test, test_preds, labels=np.arange(n_classes), zero_division=0
+        )
+        for i, label in enumerate(self._class_labels):
+            logger.info(f"{label}: precision={precision[i]:.2f} recall={recall[i]:.2f} "
+                        f"f1={f1[i]:.2f} support={support[i]}")
 
         # Feature importance
         if hasattr(self.model, 'feature_importances_'):
-            feature_importance = pd.DataFrame({
-                'feature': self.feature_columns,
-                'importance': self.model.feature_importances_
-            }).sort_values('importance', ascending=False)
+            # Top-k con argpartition (O(n)) y orden sólo de esos k, sin DataFrame
+            importances = np.asarray(self.model.feature_importances_)
+            k = min(10, importances.size)
+            top = np.argpartition(-importances, k - 1)[:k]
+            top = top[np.argsort(-importances[top])]
 
-            logger.info("\nTop 10 Most Important Features:")
-            print(feature_importance.head(10))
+            logger.info(f"\nTop {k} Most Important Features:")
+            for rank, idx in enumerate(top, 1):
+                logger.info(f"{rank}. {self.feature_columns[idx]}: {importances[idx]:.4f}")
 
         # Log loss (para calibración de probabilidades)
-        test_proba = self.model.predict_proba(X_test)
         logloss = log_loss(y_test, test_proba)
         logger.info(f"Log Loss: {logloss:.4f}")
 
@@ -148,15 +425,60 @@ class BettingModel:
                 logger.warning(f"No se pudo calcular matriz de confusión: {e}")
 
         return {
-            'train_accuracy': train_acc,
-            'test_accuracy': test_acc,
-            'cv_accuracy_mean': cv_scores.mean(),
-            'cv_accuracy_std': cv_scores.std(),
-            'log_loss': logloss,
+            'train_accuracy': float(train_acc),
+            'test_accuracy': float(test_acc),
+            'cv_accuracy_mean': cv_mean,
+            'cv_accuracy_std': cv_std,
+            'log_loss': float(logloss),
             'auc_ovr': auc_ovr,
             'confusion_matrix': cm.tolist() if cm is not None else None
         }
 
+    @staticmethod
+    def _train_booster(params: dict, X_train: np.ndarray, y_train: np.ndarray,
+                       X_val: np.ndarray, y_val: np.ndarray):
+        """
+        Entrena un booster de XGBoost con la API nativa
+
+        Los bins de cada feature se calculan una sola vez (QuantileDMatrix) y
+        validación reutiliza los cortes de train. Early stopping sobre el
+        logloss de validación; el booster devuelto queda cortado en la mejor
+        ronda (save_best), así predict usa sólo esos árboles.
+
+        Returns:
+            xgb.Booster entrenado
+        """
+        max_bin = params['max_bin']
+        dtrain = xgb.QuantileDMatrix(X_train, label=y_train, max_bin=max_bin)
+        dval = xgb.QuantileDMatrix(X_val, label=y_val, ref=dtrain, max_bin=max_bin)
+        early_stop = xgb.callback.EarlyStopping(rounds=XGB_EARLY_STOPPING_ROUNDS, save_best=True)
+        return xgb.train(params, dtrain, num_boost_round=XGB_NUM_BOOST_ROUND,
+                         evals=[(dval, 'val')], callbacks=[early_stop], verbose_eval=False)
+
+    def _fitted_with_names(self) -> bool:
+        """Modelos de versiones previas (sklearn / XGBClassifier) entrenados con DataFrame"""
+        return hasattr(self.model, 'feature_names_in_')
+
+    def _model_input(self, features: pd.DataFrame):
+        """Features en el orden del entrenamiento, en el formato que espera self.model"""
+        if self._fitted_with_names():
+            # sklearn valida los nombres de features contra los del fit
+            return features[self.feature_columns]
+        # Columnas faltantes son un error (como el KeyError de sklearn), no
+        # NaN = missing: un cambio de esquema no debe degradar en silencio
+        missing = self._feature_index.difference(features.columns)
+        if len(missing):
+            raise ValueError(f"Missing feature columns: {list(missing)}")
+        # Array float32 contiguo (booster nativo: inplace_predict, sin DMatrix);
+        # reindex con el Index ya armado ordena las columnas del entrenamiento
+        return np.ascontiguousarray(
+            features.reindex(columns=self._feature_index).to_numpy(dtype=np.float32)
+        )
+
+    def _predict_proba_matrix(self, features: pd.DataFrame) -> np.ndarray:
+        """Matriz (N, clases) de probabilidades"""
+        return self.model.predict_proba(self._model_input(features))
+
     def predict_proba(self, features: pd.DataFrame) -> dict:
         """
         Predice probabilidades para cada resultado
@@ -164,41 +486,90 @@ class BettingModel:
         Args:
             features: DataFrame con las mismas features del entrenamiento
 
+        Returns:
+            Dict con probabilidades para cada clase (primera fila)
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet. Call train() first.")
+
+        probas = self._predict_proba_matrix(features)[0]
+
+        # Decodificar labels numéricos a strings originales; tolist() pasa
+        # todas las probabilidades a float de Python en una sola llamada
+        return dict(zip(self._class_labels, probas.tolist()))
+
+    def predict_proba_array(self, x: np.ndarray) -> dict:
+        """
+        Predice probabilidades desde un vector de features ya armado
+
+        Args:
+            x: Array (n_features,) en el orden de feature_columns
+
         Returns:
             Dict con probabilidades para cada clase
         """
         if self.model is None:
             raise ValueError("Model not trained yet. Call train() first.")
 
-        # Asegurar que las features estén en el orden correcto
-        features = features[self.feature_columns]
+        x = np.asarray(x, dtype=np.float32).reshape(1, -1)
+        if self._fitted_with_names():
+            # sklearn valida los nombres de features contra los del fit
+            x = pd.DataFrame(x, columns=self.feature_columns)
+        probas = self.model.predict_proba(x)[0]
+        return dict(zip(self._class_labels, probas.tolist()))
+
+    def predict_proba_from_dict(self, features: dict) -> dict:
+        """
+        Predice probabilidades desde un dict de features, sin pasar por pandas
+
+        Args:
+            features: Dict feature -> valor (debe incluir todas las feature_columns)
+
+        Returns:
+            Dict con probabilidades para cada clase
+        """
+        x = np.fromiter((features[col] for col in self.feature_columns),
+                        dtype=np.float32, count=len(self.feature_columns))
+        return self.predict_proba_array(x)
 
-        probas = self.model.predict_proba(features)[0]
+    def predict_proba_batch(self, features: pd.DataFrame) -> pd.DataFrame:
+        """
+        Predice probabilidades para muchos partidos en una llamada
 
-        result = {}
-        # Decodificar labels numéricos a strings originales
-        for i, class_label in enumerate(self.label_encoder.classes_):
-            result[class_label] = float(probas[i])
+        Args:
+            features: DataFrame con una fila por partido
+
+        Returns:
+            DataFrame (mismo index) con una columna de probabilidad por clase
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet. Call train() first.")
 
-        return result
+        return pd.DataFrame(self._predict_proba_matrix(features),
+                            columns=self._class_labels, index=features.index)
 
     def predict(self, features: pd.DataFrame) -> str:
         """Predice el resultado más probable"""
         if self.model is None:
             raise ValueError("Model not trained yet. Call train() first.")
 
-        features = features[self.feature_columns]
-        prediction_encoded = self.model.predict(features)[0]
-        # Decodificar label numérico a string original
-        prediction = self.label_encoder.inverse_transform([prediction_encoded])[0]
-        return prediction
+        prediction_encoded = self.model.predict(self._model_input(features))[0]
+        # Decodificar label numérico a string original: lookup directo, sin
+        # la validación de inverse_transform
+        return self._class_labels[int(prediction_encoded)]
 
     def save(self, filepath: str):
-        """Guarda el modelo entrenado"""
+        """
+        Guarda el modelo entrenado
+
+        Boosters de XGBoost: el ensemble de árboles va en formato nativo UBJSON
+        (<ruta sin extensión>.ubj, estable entre versiones de XGBoost) y filepath
+        guarda sólo el estado del wrapper. El resto de los modelos va entero en
+        filepath con joblib.
+        """
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
         model_data = {
-            'model': self.model,
             'sport': self.sport,
             'model_type': self.model_type,
             'feature_columns': self.feature_columns,
@@ -206,113 +577,194 @@ class BettingModel:
             'label_encoder': self.label_encoder
         }
 
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        if isinstance(self.model, BoosterClassifier):
+            booster_path = os.path.splitext(filepath)[0] + '.ubj'
+            # Primero el booster: el mtime de filepath (clave de cache del
+            # predictor) queda posterior al de los árboles
+            self.model.get_booster().save_model(booster_path)
+            model_data.update({
+                'booster_file': os.path.basename(booster_path),
+                'n_classes': self.model.n_classes,
+                'n_features': self.model.n_features,
+            })
+        else:
+            model_data['model'] = self.model
+
+        joblib.dump(model_data, filepath)
 
         logger.info(f"Model saved to {filepath}")
 
     @classmethod
     def load(cls, filepath: str):
-        """Carga un modelo guardado"""
-        with open(filepath, 'rb') as f:
-            model_data = pickle.load(f)
+        """Carga un modelo guardado (también los .pkl con pickle de versiones previas)"""
+        model_data = joblib.load(filepath)
 
         instance = cls(model_data['sport'], model_data['model_type'])
-        instance.model = model_data['model']
+        if 'booster_file' in model_data:
+            booster = xgb.Booster()
+            booster.load_model(os.path.join(os.path.dirname(filepath), model_data['booster_file']))
+            instance.model = BoosterClassifier(booster, model_data['n_classes'], model_data['n_features'])
+        else:
+            instance.model = model_data['model']
         instance.feature_columns = model_data['feature_columns']
+        instance._feature_index = pd.Index(instance.feature_columns)
         instance.classes_ = model_data['classes']
         instance.label_encoder = model_data.get('label_encoder', LabelEncoder())
+        if hasattr(instance.label_encoder, 'classes_'):
+            instance._class_labels = instance.label_encoder.classes_.tolist()
 
         logger.info(f"Model loaded from {filepath}")
         return instance
 
 
-def train_all_models():
-    """Entrena modelos sólo para deportes habilitados en config (actual: soccer)."""
-    from src.utils.data_generator import generate_training_data
-    from src.utils.database import BettingDatabase
-    import json
-    import hashlib
-    db = BettingDatabase()
+# Columnas de model_registry (además de id y created_at), en el orden del INSERT
+MODEL_REGISTRY_COLUMNS = {
+    'sport': 'TEXT',
+    'model_type': 'TEXT',
+    'test_accuracy': 'REAL',
+    'train_accuracy': 'REAL',
+    'cv_mean': 'REAL',
+    'cv_std': 'REAL',
+    'log_loss': 'REAL',
+    'auc_ovr': 'REAL',
+    'dataset_hash': 'TEXT',
+    'dataset_rows': 'INTEGER',
+    'dataset_cols': 'INTEGER',
+}
+MODEL_REGISTRY_INSERT = (
+    f"INSERT INTO model_registry ({', '.join(MODEL_REGISTRY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(MODEL_REGISTRY_COLUMNS))})"
+)
+
+
+def _ensure_model_registry(conn) -> None:
+    """
+    Crea model_registry o le agrega las columnas que le falten
+
+    Un solo PRAGMA table_info decide qué hacer, en lugar de intentar cada
+    ALTER TABLE y descartar el error de columna duplicada en cada corrida.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(model_registry)")}
+    if not existing:
+        columns = ',\n'.join(f"    {name} {sql_type}" for name, sql_type in MODEL_REGISTRY_COLUMNS.items())
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS model_registry (\n"
+            "    id INTEGER PRIMARY KEY AUTOINCREMENT,\n"
+            f"{columns},\n"
+            "    created_at TEXT DEFAULT CURRENT_TIMESTAMP\n"
+            ")"
+        )
+        return
+    for name, sql_type in MODEL_REGISTRY_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE model_registry ADD COLUMN {name} {sql_type}")
 
-    # Crear directorio de datos si no existe
-    os.makedirs("data", exist_ok=True)
-    os.makedirs("models", exist_ok=True)
 
-    # Soccer Model
+def _train_one(sport: str) -> tuple:
+    """
+    Entrena, guarda y resume el modelo de un deporte
+
+    Corre en un proceso aparte cuando se entrenan varios deportes (ver
+    train_all_models), así que sólo toca archivos: el registro en DB lo hace
+    el proceso padre.
+
+    Args:
+        sport: 'soccer' o 'nba'
+
+    Returns:
+        Tupla (ruta del modelo, métricas + hash/tamaño del dataset)
+    """
     logger.info("=" * 50)
-    logger.info("TRAINING SOCCER MODEL")
+    logger.info(f"TRAINING {sport.upper()} MODEL")
     logger.info("=" * 50)
 
     # Preferir dataset real si existe con suficiente tamaño
-    real_soccer_csv = "data/training_real_soccer.csv"
-    if os.path.exists(real_soccer_csv):
+    real_csv = f"data/training_real_{sport}.csv"
+    if os.path.exists(real_csv) or (PYARROW_AVAILABLE and os.path.exists(f"data/training_real_{sport}.parquet")):
         try:
-            soccer_data = pd.read_csv(real_soccer_csv)
-            logger.info(f"Loaded real soccer dataset: {len(soccer_data)} rows")
+            data = _load_dataset(real_csv)
+            logger.info(f"Loaded real {sport} dataset: {len(data)} rows")
         except Exception as e:
-            logger.warning(f"No se pudo cargar dataset real de soccer, usando sintético. Error: {e}")
-            soccer_data = generate_training_data("soccer", num_matches=2000)
+            logger.warning(f"No se pudo cargar dataset real de {sport}, usando sintético. Error: {e}")
+            data = _synthetic_dataset(sport)
     else:
-        soccer_data = generate_training_data("soccer", num_matches=2000)
-    soccer_model = BettingModel(sport="soccer", model_type="xgboost")
-    soccer_metrics = soccer_model.train(soccer_data, validation_split=0.2)
-    soccer_model.save("models/soccer_model.pkl")
+        data = _synthetic_dataset(sport)
+    # Resultado como category: train() toma los códigos enteros directamente
+    data['result'] = data['result'].astype('category')
+    model = BettingModel(sport=sport, model_type="xgboost")
+    metrics = model.train(data, validation_split=0.2)
+    model_path = f"models/{sport}_model.pkl"
+    model.save(model_path)
     # Hash y tamaño de dataset
-    soccer_csv = soccer_data.to_csv(index=False).encode('utf-8')
-    soccer_hash = hashlib.md5(soccer_csv).hexdigest()
-    soccer_rows, soccer_cols = soccer_data.shape
-    with open("models/soccer_model_metrics.json", 'w') as f:
-        json.dump({**soccer_metrics, 'dataset_hash': soccer_hash, 'dataset_rows': soccer_rows, 'dataset_cols': soccer_cols}, f, indent=2)
-    # Guardar resumen en DB (tabla model_registry pendiente de creación si no existe)
+    rows, cols = data.shape
+    metrics = {**metrics, 'dataset_hash': _dataset_hash(data), 'dataset_rows': rows, 'dataset_cols': cols}
+    with open(f"models/{sport}_model_metrics.json", 'w') as f:
+        json.dump(metrics, f, indent=2)
+    return model_path, metrics
+
+
+def _enabled_sports(config_path: str = "config/config.yaml") -> list:
+    """Deportes a entrenar según enabled_sports del config (soccer si no se puede leer)"""
     try:
-        db.connect()
-        cursor = db.conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS model_registry (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sport TEXT,
-                model_type TEXT,
-                test_accuracy REAL,
-                train_accuracy REAL,
-                cv_mean REAL,
-                cv_std REAL,
-                log_loss REAL,
-                auc_ovr REAL,
-                dataset_hash TEXT,
-                dataset_rows INTEGER,
-                dataset_cols INTEGER,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        # Intentar agregar columnas nuevas si la tabla ya existía
-        for stmt in [
-            "ALTER TABLE model_registry ADD COLUMN auc_ovr REAL",
-            "ALTER TABLE model_registry ADD COLUMN dataset_hash TEXT",
-            "ALTER TABLE model_registry ADD COLUMN dataset_rows INTEGER",
-            "ALTER TABLE model_registry ADD COLUMN dataset_cols INTEGER",
-        ]:
-            try:
-                cursor.execute(stmt)
-            except Exception:
-                pass
-        cursor.execute("""
-            INSERT INTO model_registry (sport, model_type, test_accuracy, train_accuracy, cv_mean, cv_std, log_loss, auc_ovr, dataset_hash, dataset_rows, dataset_cols)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            'soccer', 'xgboost', soccer_metrics['test_accuracy'], soccer_metrics['train_accuracy'],
-            soccer_metrics['cv_accuracy_mean'], soccer_metrics['cv_accuracy_std'], soccer_metrics['log_loss'],
-            soccer_metrics.get('auc_ovr'), soccer_hash, soccer_rows, soccer_cols
-        ))
-        db.conn.commit()
+        import yaml
+        with open(config_path, 'r') as f:
+            return list(yaml.safe_load(f).get('enabled_sports') or ['soccer'])
     except Exception as e:
-        logger.error(f"Error saving soccer model metrics to DB: {e}")
+        logger.warning(f"No se pudo leer enabled_sports de {config_path}: {e}")
+        return ['soccer']
+
+
+def train_all_models(sports: Optional[list] = None):
+    """
+    Entrena modelos sólo para deportes habilitados en config (actual: soccer)
+
+    Args:
+        sports: Deportes a entrenar (default: enabled_sports del config)
+    """
+    from src.utils.database import BettingDatabase
+    db = BettingDatabase()
+
+    # Crear directorio de datos si no existe
+    os.makedirs("data", exist_ok=True)
+    os.makedirs("models", exist_ok=True)
+
+    if sports is None:
+        sports = _enabled_sports()
+
+    # Los modelos son independientes: un proceso por deporte. En GPU se
+    # entrenan en serie (una GPU no se comparte limpio entre procesos)
+    results = {}
+    if len(sports) > 1 and _xgb_device() != "cuda":
+        # spawn: fork después de inicializar OpenMP (xgboost/sklearn) puede colgar al hijo
+        with ProcessPoolExecutor(max_workers=len(sports), mp_context=mp.get_context('spawn')) as executor:
+            futures = {sport: executor.submit(_train_one, sport) for sport in sports}
+            for sport, future in futures.items():
+                results[sport] = future.result()
+    else:
+        for sport in sports:
+            results[sport] = _train_one(sport)
+
+    # Guardar resumen en DB (tabla model_registry pendiente de creación si no existe)
+    for sport, (_, metrics) in results.items():
+        try:
+            conn = db.conn
+            _ensure_model_registry(conn)
+            # Transacción explícita: commit al salir, rollback si el INSERT falla
+            with conn:
+                conn.execute(MODEL_REGISTRY_INSERT, (
+                    sport, 'xgboost', metrics['test_accuracy'], metrics['train_accuracy'],
+                    metrics['cv_accuracy_mean'], metrics['cv_accuracy_std'], metrics['log_loss'],
+                    metrics.get('auc_ovr'), metrics['dataset_hash'], metrics['dataset_rows'], metrics['dataset_cols']
+                ))
+        except Exception as e:
+            logger.error(f"Error saving {sport} model metrics to DB: {e}")
 
-    # Summary (solo soccer)
+    # Summary
     logger.info("\n" + "=" * 50)
-    logger.info("TRAINING SUMMARY (SOCCER ONLY)")
+    logger.info("TRAINING SUMMARY")
     logger.info("=" * 50)
-    logger.info(f"Soccer Model - Test Accuracy: {soccer_metrics['test_accuracy']:.4f}")
+    for sport, (_, metrics) in results.items():
+        logger.info(f"{sport.capitalize()} Model - Test Accuracy: {metrics['test_accuracy']:.4f}")
     db.close()
 
 
@@ -7,53 +7,58 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
+from typing import Optional
 
 
-def generate_training_data(sport: str, num_matches: int = 1000) -> pd.DataFrame:
+def generate_training_data(sport: str, num_matches: int = 1000,
+                           seed: Optional[int] = None) -> pd.DataFrame:
     """
     Genera datos de entrenamiento sintéticos pero realistas
 
     Args:
         sport: 'soccer' o 'nba'
         num_matches: Número de partidos a generar
+        seed: Semilla para reproducir el mismo dataset (None = aleatorio)
 
     Returns:
         DataFrame con features y resultados
     """
+    rng = random.Random(seed)
+    np_rng = np.random.RandomState(seed)
     data = []
 
     for i in range(num_matches):
         # Features del equipo local
-        home_win_rate_last_10 = random.uniform(0.2, 0.8)
-        home_form_last_5 = random.uniform(0.4, 1.0)
-        home_win_rate = random.uniform(0.3, 0.8)
+        home_win_rate_last_10 = rng.uniform(0.2, 0.8)
+        home_form_last_5 = rng.uniform(0.4, 1.0)
+        home_win_rate = rng.uniform(0.3, 0.8)
 
         # Features del equipo visitante
-        away_win_rate_last_10 = random.uniform(0.2, 0.8)
-        away_form_last_5 = random.uniform(0.4, 1.0)
-        away_win_rate = random.uniform(0.2, 0.7)
+        away_win_rate_last_10 = rng.uniform(0.2, 0.8)
+        away_form_last_5 = rng.uniform(0.4, 1.0)
+        away_win_rate = rng.uniform(0.2, 0.7)
 
         if sport == "soccer":
             # Soccer-specific features
-            home_goals_scored = random.uniform(0.8, 2.5)
-            home_goals_conceded = random.uniform(0.5, 2.0)
-            away_goals_scored = random.uniform(0.6, 2.0)
-            away_goals_conceded = random.uniform(0.8, 2.2)
+            home_goals_scored = rng.uniform(0.8, 2.5)
+            home_goals_conceded = rng.uniform(0.5, 2.0)
+            away_goals_scored = rng.uniform(0.6, 2.0)
+            away_goals_conceded = rng.uniform(0.8, 2.2)
 
             home_goal_diff = home_goals_scored - home_goals_conceded
             away_goal_diff = away_goals_scored - away_goals_conceded
 
-            home_clean_sheet_rate = random.uniform(0.2, 0.6)
-            away_clean_sheet_rate = random.uniform(0.15, 0.5)
+            home_clean_sheet_rate = rng.uniform(0.2, 0.6)
+            away_clean_sheet_rate = rng.uniform(0.15, 0.5)
 
-            home_days_rest = random.randint(3, 7)
-            away_days_rest = random.randint(3, 7)
+            home_days_rest = rng.randint(3, 7)
+            away_days_rest = rng.randint(3, 7)
 
-            home_injuries = random.randint(0, 3)
-            away_injuries = random.randint(0, 3)
+            home_injuries = rng.randint(0, 3)
+            away_injuries = rng.randint(0, 3)
 
             # H2H
-            h2h_home_win_rate = random.uniform(0.2, 0.7)
+            h2h_home_win_rate = rng.uniform(0.2, 0.7)
 
             # Calcular probabilidad de victoria local (lógica simplificada)
             home_strength = (
@@ -100,7 +105,7 @@ def generate_training_data(sport: str, num_matches: int = 1000) -> pd.DataFrame:
             draw_prob = max(0, min(1, draw_prob))
 
             # Determinar resultado
-            outcome = np.random.choice(['home_win', 'draw', 'away_win'],
+            outcome = np_rng.choice(['home_win', 'draw', 'away_win'],
                                      p=[home_prob, draw_prob, away_prob])
 
             match = {
@@ -133,29 +138,29 @@ def generate_training_data(sport: str, num_matches: int = 1000) -> pd.DataFrame:
 
         else:  # NBA
             # NBA-specific features
-            home_points_scored = random.uniform(105, 118)
-            home_points_conceded = random.uniform(102, 115)
-            away_points_scored = random.uniform(102, 115)
-            away_points_conceded = random.uniform(105, 118)
+            home_points_scored = rng.uniform(105, 118)
+            home_points_conceded = rng.uniform(102, 115)
+            away_points_scored = rng.uniform(102, 115)
+            away_points_conceded = rng.uniform(105, 118)
 
             home_point_diff = home_points_scored - home_points_conceded
             away_point_diff = away_points_scored - away_points_conceded
 
-            home_off_rating = random.uniform(108, 118)
-            home_def_rating = random.uniform(105, 115)
-            away_off_rating = random.uniform(106, 116)
-            away_def_rating = random.uniform(107, 117)
+            home_off_rating = rng.uniform(108, 118)
+            home_def_rating = rng.uniform(105, 115)
+            away_off_rating = rng.uniform(106, 116)
+            away_def_rating = rng.uniform(107, 117)
 
-            home_pace = random.uniform(98, 104)
-            away_pace = random.uniform(98, 104)
+            home_pace = rng.uniform(98, 104)
+            away_pace = rng.uniform(98, 104)
 
-            home_days_rest = random.randint(1, 4)
-            away_days_rest = random.randint(1, 4)
+            home_days_rest = rng.randint(1, 4)
+            away_days_rest = rng.randint(1, 4)
 
-            home_injuries = random.randint(0, 3)
-            away_injuries = random.randint(0, 3)
+            home_injuries = rng.randint(0, 3)
+            away_injuries = rng.randint(0, 3)
 
-            h2h_home_win_rate = random.uniform(0.3, 0.7)
+            h2h_home_win_rate = rng.uniform(0.3, 0.7)
 
             # Calcular probabilidad
             home_strength = (
@@ -186,7 +191,7 @@ def generate_training_data(sport: str, num_matches: int = 1000) -> pd.DataFrame:
             home_prob = (home_strength / total_strength) + home_advantage
             away_prob = 1 - home_prob
 
-            outcome = np.random.choice(['home_win', 'away_win'],
+            outcome = np_rng.choice(['home_win', 'away_win'],
                                      p=[home_prob, away_prob])
 
             match = {
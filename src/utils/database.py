@@ -3,6 +3,7 @@ Database manager - Maneja el almacenamiento de datos históricos y apuestas
 """
 
 import sqlite3
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional
 import json
@@ -10,6 +11,10 @@ from loguru import logger
 import os
 
 
+# Statements preparados que guarda cada conexión (sqlite3 cached_statements)
+STATEMENT_CACHE_SIZE = 512
+
+
 class BettingDatabase:
     """Gestor de base de datos para el sistema de apuestas"""
 
@@ -20,32 +25,52 @@ class BettingDatabase:
         """
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
-        self.conn = None
+        # Una conexión por thread: con WAL las lecturas concurrentes (features
+        # en paralelo, jobs/cron/streamlit callbacks) no se serializan en una
+        # única conexión compartida
+        self._local = threading.local()
         self.create_tables()
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Conexión del thread actual (se abre al primer uso en cada thread)"""
+        if getattr(self._local, 'conn', None) is None:
+            self.connect()
+        return self._local.conn
+
     def connect(self):
-        """Establece conexión con la base de datos"""
-        if self.conn is None:
-            # Permitir uso seguro desde múltiples hilos (jobs/cron/streamlit callbacks)
+        """Establece conexión con la base de datos (para el thread actual)"""
+        if getattr(self._local, 'conn', None) is None:
+            # check_same_thread=False: una conexión puede cerrarse desde otro thread
             # Nota: SQLite no es full concurrent; por eso activamos WAL y usamos commits cortos.
-            self.conn = sqlite3.connect(
+            # cached_statements: cada SQL distinto se prepara una sola vez por
+            # conexión; el default (128) queda corto para todas las queries del
+            # módulo + feature engines y el LRU re-prepararía las de features
+            conn = sqlite3.connect(
                 self.db_path,
                 check_same_thread=False,
-                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                cached_statements=STATEMENT_CACHE_SIZE
             )
-            self.conn.row_factory = sqlite3.Row
+            conn.row_factory = sqlite3.Row
             try:
-                self.conn.execute("PRAGMA journal_mode=WAL;")
-                self.conn.execute("PRAGMA synchronous=NORMAL;")
-                self.conn.execute("PRAGMA foreign_keys=ON;")
+                conn.execute("PRAGMA journal_mode=WAL;")
+                conn.execute("PRAGMA synchronous=NORMAL;")
+                conn.execute("PRAGMA foreign_keys=ON;")
+                # Lecturas de histórico completo: mmap + cache de páginas grandes
+                conn.execute("PRAGMA mmap_size=268435456;")  # 256 MB
+                conn.execute("PRAGMA cache_size=-65536;")  # 64 MB
+                conn.execute("PRAGMA temp_store=MEMORY;")
             except Exception:
                 pass
+            self._local.conn = conn
 
     def close(self):
-        """Cierra conexión con la base de datos"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        """Cierra la conexión del thread actual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
 
     def create_tables(self):
         """Crea las tablas necesarias si no existen"""
@@ -208,6 +233,23 @@ class BettingDatabase:
             )
         ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_results_match ON raw_match_results(match_id)')
+        # Epoch (segundos, UTC) derivado de match_date para comparar fechas sin datetime() por fila
+        try:
+            cursor.execute(
+                "ALTER TABLE raw_match_results ADD COLUMN match_ts INTEGER "
+                "GENERATED ALWAYS AS (CAST(strftime('%s', match_date) AS INTEGER)) VIRTUAL"
+            )
+        except Exception:
+            pass
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_results_home_ts ON raw_match_results(sport, home_team, match_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_results_away_ts ON raw_match_results(sport, away_team, match_ts)')
+        # Pase cronológico completo por deporte (sweep de features, ELO materializado)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_results_sport_ts ON raw_match_results(sport, match_ts)')
+        # Join de entrenamiento: sólo partidos con resultado, por fecha
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_results_sport_date ON raw_match_results(sport, match_date) '
+            'WHERE result_label IS NOT NULL'
+        )
 
         # Odds canónicas (último snapshot antes de inicio + sin margen)
         cursor.execute('''
@@ -253,6 +295,52 @@ class BettingDatabase:
         ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_feat_match ON engineered_features(match_id)')
 
+        # Versión de resultados por deporte: cada insert/update/delete en
+        # raw_match_results la incrementa (invalida caches de features)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS results_version (
+                sport TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        bump = (
+            "INSERT INTO results_version (sport, version) VALUES (COALESCE({row}.sport, ''), 1) "
+            "ON CONFLICT(sport) DO UPDATE SET version = version + 1;"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS trg_results_version_insert AFTER INSERT ON raw_match_results "
+            f"BEGIN {bump.format(row='NEW')} END"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS trg_results_version_update AFTER UPDATE ON raw_match_results "
+            f"BEGIN {bump.format(row='OLD')} {bump.format(row='NEW')} END"
+        )
+        cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS trg_results_version_delete AFTER DELETE ON raw_match_results "
+            f"BEGIN {bump.format(row='OLD')} END"
+        )
+
+        # Snapshots de ELO por equipo tras cada partido (materializado por AdvancedFeatureEngine)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS team_elo_history (
+                team TEXT,
+                sport TEXT,
+                match_ts INTEGER,
+                elo REAL,
+                PRIMARY KEY (team, sport, match_ts)
+            )
+        ''')
+        # Último id de raw_match_results ya procesado por la materialización de
+        # ELO y parámetros con los que se calcularon los snapshots
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS team_elo_history_state (
+                sport TEXT PRIMARY KEY,
+                last_result_id INTEGER,
+                initial_elo REAL,
+                k_factor REAL
+            )
+        ''')
+
         self.conn.commit()
         logger.info("Database tables created/verified")
 
@@ -742,6 +830,13 @@ class BettingDatabase:
         logger.info(f"Inserted {inserted} raw odds snapshots")
         return inserted
 
+    def get_results_version(self, sport: str) -> int:
+        """Versión de raw_match_results para el deporte (la mantienen triggers)"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT version FROM results_version WHERE sport = ?', (sport,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
     def save_match_result(self, result: Dict):
         """Guarda resultado final del partido (stub para integración real)."""
         self.connect()
@@ -176,6 +176,14 @@ def main():
     
     print(f"✓ Modelo guardado: {output_file}")
     print(f"✓ Métricas guardadas: {output_file.replace('.pkl', '_metrics.json')}")
+    
+    # Grafo ONNX para inferencia con ONNX Runtime (MatchPredictor lo usa si existe)
+    onnx_file = output_file.replace('.pkl', '.onnx')
+    if model.export_onnx(onnx_file):
+        print(f"✓ Modelo ONNX exportado: {onnx_file}")
+    elif model.attach_native(output_file):
+        # Sin ONNX: librerías nativas precompiladas (MatchPredictor no invoca gcc)
+        print("✓ Librerías nativas compiladas en models/native/")
     print()
     
     # 8. Feature importance